@@ -1,146 +1,1430 @@
-from enum import Enum
+import asyncio
+import logging
+import math
 import types
-from app.resp.RESPCodec import RESPDecoder, RESPEncoder, SimpleString
-import os
-import inspect
-
-class SimpleCommand(Enum):
-    PING = "PING"
-    ECHO = "ECHO"
-    SET = "SET"
-    GET = "GET"
-    CONFIG = "CONFIG"
-    KEYS = "KEYS"
-    INFO = "INFO"
-
-class StreamingCommand(Enum):
-    PSYNC = "PSYNC"
+from itertools import islice
+from time import monotonic, perf_counter_ns
+from app.resp.RESPCodec import NULL_ARRAY, RESPEncoder, SimpleString, Error
+from app.commands import COMMAND_TABLE, Command
+from app.data.datatypes import (
+    STREAM_ID_MAX,
+    HashValue,
+    ListValue,
+    SetValue,
+    StreamValue,
+    ZSetValue,
+    format_score,
+    format_stream_id,
+    next_stream_id,
+    parse_score,
+    previous_stream_id,
+)
+from app.data.expiry import get_current_time
+from app.data.pattern import compile_glob
+from app.server.clients import ClientRegistry
+from app.server.cluster import CLUSTER_DISABLED_ERROR, key_hash_slot
+from app.server.pubsub import PubSub
+from app.server.stats import ServerStats
+from app.server.replication import FullSync, ReplicaLink, find_replica
+from app.server.transaction import EXECABORT_ERROR, TRANSACTION_COMMANDS, Transaction
+
+logger = logging.getLogger(__name__)
+
+# Returned by handlers that must not send anything back, e.g. REPLCONF ACK
+NO_REPLY = object()
+
+READONLY_ERROR = "READONLY You can't write against a read only replica."
+
+_encoder = RESPEncoder()
 
 class RedisAction:
-    handlers = {}
+    commands = COMMAND_TABLE
 
     @classmethod
-    def command(cls, name):
+    def command(cls, name, arity, flags="", keys=(0, 0, 0), propagate=True):
+        """Register a handler in the command table; see Command"""
         def decorator(func):
-            cls.handlers[name.upper()] = func
+            cls.commands[name.upper().encode()] = Command(name, func, arity, flags, keys, propagate)
             return func
         return decorator
 
-    @staticmethod
-    def propagate_to_replicas(command_name):
-        def decorator(func):
-            async def wrapper(self, args, writer=None, *f_args, **f_kwargs):
-                result = await func(self, args, writer=writer, *f_args, **f_kwargs)
-                if self.storage.metadata.role == "master":
-                    from app.resp.RESPCodec import RESPEncoder
-                    encoder = RESPEncoder()
-                    encoded = encoder.encode([command_name] + args)
-                    for w in self.storage.metadata.replica_writers:
-                        try:
-                            w.write(encoded)
-                            await w.drain()
-                        except Exception as e:
-                            print(f"Failed to write to replica: {e.with_traceback()}")
-                return result
-            return wrapper
-        return decorator
-
     def __init__(self, storage):
         self.storage = storage
+        # writer -> Transaction, for connections in MULTI or with WATCHed keys
+        self.transactions = {}
+        # (argv, aof) written by the EXEC being run, None outside of one
+        self.exec_writes = None
+        # Slot map when this process is one shard of a sharded server
+        self.cluster = storage.metadata.cluster
+        self.stats = ServerStats(storage.config)
+
+    def propagate(self, argv: list, aof: bool = True):
+        """Log a successful write to the AOF and forward it to replicas"""
+        if self.storage.loading:
+            return
+        if self.exec_writes is not None:
+            # Held back until EXEC ends, then sent as one MULTI/EXEC block
+            self.exec_writes.append((argv, aof))
+            return
+        self._propagate([(argv, aof)])
+
+    def _propagate(self, writes: list):
+        aof_file = self.storage.aof
+        if aof_file is not None:
+            for argv, aof in writes:
+                if aof:
+                    aof_file.feed(argv)
+        metadata = self.storage.metadata
+        if metadata.role == "master":
+            encoder = RESPEncoder()
+            encoded = b"".join(encoder.encode(argv) for argv, _ in writes)
+            metadata.feed_replication_stream(encoded)
+            # Queue only: each replica's sender task does the socket writes
+            for link in list(metadata.replicas):
+                link.feed(encoded)
+
+    async def handle_command(self, ins, writer=None):
+        """Run one already-decoded command and return its encoded reply.
+
+        Streaming commands return their generator untouched so the caller
+        can write the chunks itself.
+        """
+        reply = self.handle_command_nowait(ins, writer)
+        if type(reply) is types.CoroutineType:
+            reply = await reply
+        return reply
+
+    def handle_command_nowait(self, ins, writer=None):
+        """handle_command for callers that run commands straight from the
+        socket: the reply comes back at once unless the handler has to
+        wait, in which case it is a coroutine to await for it"""
+        if not isinstance(ins, list) or not ins or not isinstance(ins[0], bytes):
+            return _encoder.encode("ERR: Invalid input")
+        try:
+            result = self.execute(ins, writer)
+        except Error as e:
+            # Handlers raise Error to reject a command with an error reply
+            return _encoder.encode(e)
+        if type(result) is types.CoroutineType:
+            return self._encode_awaited(ins, result)
+        return self._encode_reply(ins, result)
+
+    async def _encode_awaited(self, ins, pending):
+        try:
+            result = await pending
+        except Error as e:
+            return _encoder.encode(e)
+        return self._encode_reply(ins, result)
+
+    def _encode_reply(self, ins, result):
+        if result is NO_REPLY:
+            return None
+        if isinstance(result, types.AsyncGeneratorType) or isinstance(result, types.GeneratorType):
+            return result
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Command %r returned: %r", ins[0], result)
+        return _encoder.encode(result)
+
+    async def dispatch(self, argv: list, writer=None):
+        """Call the handler for a parsed command and return its raw result.
+
+        Raises Error for unknown or rejected commands. Nothing is encoded,
+        so callers that discard replies (replication, AOF) pay nothing for it.
+        """
+        result = self.execute(argv, writer)
+        if type(result) is types.CoroutineType:
+            result = await result
+        return result
+
+    def execute(self, argv: list, writer=None):
+        """dispatch without the await: async handlers come back as the
+        coroutine to await. A write command that changed the dataset is
+        propagated as sent."""
+        command = self.commands.get(argv[0].upper())
+        transaction = self.transactions.get(writer) if self.transactions else None
+        in_multi = transaction is not None and transaction.in_multi
+        if command is None or not command.arity_ok(len(argv)):
+            if in_multi:
+                transaction.failed = True
+            if command is None:
+                raise Error(f"ERR unknown command '{argv[0].decode('utf-8', 'replace')}'")
+            command.stats.rejected_calls += 1
+            raise Error(f"ERR wrong number of arguments for '{command.name}' command")
+        if self.cluster is not None and writer is not None and (command.first_key or command.find_keys):
+            try:
+                self.cluster.check_keys(command.keys(argv))
+            except Error:
+                command.stats.rejected_calls += 1
+                if in_multi:
+                    transaction.failed = True
+                raise
+        if command.is_write and writer is not None and self.storage.metadata.role == "slave":
+            # A replica only takes writes from its master's stream, which
+            # runs without a client
+            command.stats.rejected_calls += 1
+            if in_multi:
+                transaction.failed = True
+            raise Error(READONLY_ERROR)
+        if in_multi and command.name not in TRANSACTION_COMMANDS:
+            if "no-multi" in command.flags:
+                command.stats.rejected_calls += 1
+                transaction.failed = True
+                raise Error("ERR Command not allowed inside a transaction")
+            transaction.queued.append(argv)
+            return SimpleString("QUEUED")
+        if command.is_async:
+            return self._call_async(command, argv, writer)
+        storage = self.storage
+        dirty = storage.dirty
+        started = perf_counter_ns()
+        try:
+            result = command.handler(self, argv[1:], writer=writer)
+        except Error:
+            command.stats.failed_calls += 1
+            raise
+        finally:
+            self.stats.call(command, argv, (perf_counter_ns() - started) // 1000, writer)
+        if command.propagate and storage.dirty != dirty:
+            self.propagate(argv)
+        return result
+
+    async def _call_async(self, command, argv: list, writer):
+        """Await an async handler, timing it without the time it spent
+        blocked waiting for keys"""
+        if writer is not None:
+            writer.blocked_time = 0.0
+        started = perf_counter_ns()
+        try:
+            return await command.handler(self, argv[1:], writer=writer)
+        except Error:
+            command.stats.failed_calls += 1
+            raise
+        finally:
+            elapsed = perf_counter_ns() - started
+            if writer is not None:
+                elapsed -= int(writer.blocked_time * 1e9)
+            self.stats.call(command, argv, max(elapsed, 0) // 1000, writer)
 
-    async def handle_input(self, data: bytes, writer=None):
-        decoder = RESPDecoder()
+    async def apply_replicated(self, frames: list, offset_base: int) -> list[bytes]:
+        """Apply a batch of (argv, end offset) from the master, in order.
+
+        The replication offset moves past each command once it has run, so
+        a GETACK reports the bytes applied before it. Returns the encoded
+        replies the master expects (REPLCONF ACK); everything else is dropped.
+        """
+        metadata = self.storage.metadata
         encoder = RESPEncoder()
-        ins = decoder.decode(data)
-        if ins is None:
-            return encoder.encode("ERR: Invalid input")
-        if "PING" in ins:
-            command, args = "PING", None
-        else:
-            command, *args = ins
-        handler = self.handlers.get(command.upper())
-        if handler:
-            if inspect.iscoroutinefunction(handler):
-                result = await handler(self, args, writer=writer)
-            else:
-                result = handler(self, args, writer=writer)
-            if isinstance(result, types.AsyncGeneratorType) or isinstance(result, types.GeneratorType):
-                return result
-            else:
-                print(f"Command {command} returned: {result}")
-                return encoder.encode(result)
-        else:
-            return encoder.encode("ERR: Unknown command")
+        replies = []
+        for argv, end in frames:
+            try:
+                result = await self.dispatch(argv)
+                if result is not NO_REPLY and argv[0].upper() == b"REPLCONF":
+                    replies.append(encoder.encode(result))
+            except Exception:
+                logger.exception("Failed to apply replicated command %r", argv[:1])
+            metadata.master_repl_offset = offset_base + end
+        return replies
 
-@RedisAction.command("PING")
+    def transaction(self, writer) -> Transaction:
+        transaction = self.transactions.get(writer)
+        if transaction is None:
+            transaction = self.transactions[writer] = Transaction(self.storage)
+        return transaction
+
+    def discard_transaction(self, writer):
+        """Forget a connection's MULTI queue and WATCHed keys"""
+        transaction = self.transactions.pop(writer, None)
+        if transaction is not None:
+            transaction.unwatch()
+
+@RedisAction.command("PING", -1, "fast loading stale")
 def handle_ping(self, args, writer=None):
     from app.resp.RESPCodec import SimpleString
+    if writer is not None and PubSub(self.storage.config).in_subscribed_mode(writer):
+        # Subscribed connections get pushes, so PING answers in that shape
+        return [b"pong", args[0] if args else b""]
     return SimpleString("PONG")
 
-@RedisAction.command("ECHO")
+@RedisAction.command("ECHO", 2, "fast loading stale")
 def handle_echo(self, args, writer=None):
     return args[0]
 
-@RedisAction.command("SET")
-@RedisAction.propagate_to_replicas("SET")
-async def handle_set(self, data: list, writer=None):
-    if len(data) > 2:
-        expiry = int(data[-1]) if data[-2] == "px" else int(data[-1])
-        data = data[:2]
-        self.storage.store(data[0], data[1], expiry)
-    else:
-        self.storage.store(data[0], data[1], -1)
-    
-    print(f"SET {data[0]} {data[1]}")
-    # Replicas don't respond to SET commands from master
-    if self.storage.metadata.role == "slave":
-        return None
-    return "OK"
+# SET expiry option -> milliseconds per unit of its argument
+_SET_EXPIRY_UNITS = {b"EX": 1000, b"PX": 1, b"EXAT": 1000, b"PXAT": 1}
+# Expiry deadlines are kept in ms and must fit a signed 64 bit integer
+_MAX_EXPIRY_MS = 2 ** 63 - 1
 
-@RedisAction.command("GET")
+@RedisAction.command("SET", -3, "write denyoom", keys=(1, 1, 1))
+def handle_set(self, data: list, writer=None):
+    key, value, *options = data
+    expiry, absolute = -1, False
+    # NX or XX; EX, PX, EXAT, PXAT or KEEPTTL
+    condition = expiry_option = None
+    get = False
+    i = 0
+    while i < len(options):
+        option = options[i].upper()
+        if option in (b"NX", b"XX") and condition in (None, option):
+            condition = option
+        elif option == b"GET":
+            get = True
+        elif option == b"KEEPTTL" and expiry_option in (None, option):
+            expiry_option = option
+        elif option in _SET_EXPIRY_UNITS and expiry_option in (None, option) and i + 1 < len(options):
+            expiry_option = option
+            i += 1
+            expiry = _int_arg(options[i])
+            if not 0 < expiry <= _MAX_EXPIRY_MS // _SET_EXPIRY_UNITS[option]:
+                raise Error("ERR invalid expire time in 'set' command")
+            expiry *= _SET_EXPIRY_UNITS[option]
+            absolute = option in (b"EXAT", b"PXAT")
+        else:
+            raise Error("ERR syntax error")
+        i += 1
+
+    storage = self.storage
+    # WRONGTYPE for GET is raised before anything is written
+    old = storage.fetch(key) if get else None
+    if condition is not None and bool(storage.count_existing([key])) != (condition == b"XX"):
+        return old
+    if expiry_option == b"KEEPTTL":
+        absolute = True
+        expiry = -1 if storage.expire_if_needed(key) else storage.expires.get(key, -1)
+    storage.store(key, value, expiry, absolute=absolute)
+    return old if get else SimpleString("OK")
+
+@RedisAction.command("GET", 2, "readonly fast", keys=(1, 1, 1))
 def handle_get(self, data, writer=None):
     return self.storage.fetch(data[0])
 
-@RedisAction.command("CONFIG")
+@RedisAction.command("MGET", -2, "readonly fast", keys=(1, -1, 1))
+def handle_mget(self, data, writer=None):
+    return self.storage.fetch_many(data)
+
+@RedisAction.command("MSET", -3, "write denyoom", keys=(1, -1, 2))
+def handle_mset(self, data: list, writer=None):
+    if not data or len(data) % 2:
+        raise Error("ERR wrong number of arguments for 'mset' command")
+    store = self.storage.store
+    for key, value in zip(data[::2], data[1::2]):
+        store(key, value, -1)
+    return SimpleString("OK")
+
+@RedisAction.command("MSETNX", -3, "write denyoom", keys=(1, -1, 2))
+def handle_msetnx(self, data: list, writer=None):
+    if not data or len(data) % 2:
+        raise Error("ERR wrong number of arguments for 'msetnx' command")
+    # All or nothing: any existing key means nothing is set
+    if self.storage.count_existing(data[::2]):
+        return 0
+    store = self.storage.store
+    for key, value in zip(data[::2], data[1::2]):
+        store(key, value, -1)
+    return 1
+
+def _incr_by(self, key: bytes, increment: int) -> int:
+    storage = self.storage
+    value = storage.fetch(key)
+    if value is not None and not _is_int(value):
+        raise Error("ERR value is not an integer or out of range")
+    result = (int(value) if value is not None else 0) + increment
+    if not -2 ** 63 <= result < 2 ** 63:
+        raise Error("ERR increment or decrement would overflow")
+    # The key keeps its TTL
+    storage.store(key, b"%d" % result, storage.expires.get(key, -1), absolute=True)
+    return result
+
+@RedisAction.command("INCR", 2, "write denyoom fast", keys=(1, 1, 1))
+def handle_incr(self, data: list, writer=None):
+    return _incr_by(self, data[0], 1)
+
+@RedisAction.command("DECR", 2, "write denyoom fast", keys=(1, 1, 1))
+def handle_decr(self, data: list, writer=None):
+    return _incr_by(self, data[0], -1)
+
+@RedisAction.command("INCRBY", 3, "write denyoom fast", keys=(1, 1, 1))
+def handle_incrby(self, data: list, writer=None):
+    return _incr_by(self, data[0], _int_arg(data[1]))
+
+@RedisAction.command("DECRBY", 3, "write denyoom fast", keys=(1, 1, 1))
+def handle_decrby(self, data: list, writer=None):
+    return _incr_by(self, data[0], -_int_arg(data[1]))
+
+@RedisAction.command("DEL", -2, "write", keys=(1, -1, 1))
+def handle_del(self, data: list, writer=None):
+    delete = self.storage.delete
+    return sum(delete(key) for key in data)
+
+@RedisAction.command("UNLINK", -2, "write fast", keys=(1, -1, 1))
+def handle_unlink(self, data: list, writer=None):
+    unlink = self.storage.unlink
+    return sum(unlink(key) for key in data)
+
+@RedisAction.command("EXISTS", -2, "readonly fast", keys=(1, -1, 1))
+def handle_exists(self, data, writer=None):
+    return self.storage.count_existing(data)
+
+@RedisAction.command("PEXPIREAT", 3, "write fast", keys=(1, 1, 1))
+def handle_pexpireat(self, data: list, writer=None):
+    return int(self.storage.expire_at(data[0], _int_arg(data[1])))
+
+@RedisAction.command("TYPE", 2, "readonly fast", keys=(1, 1, 1))
+def handle_type(self, data, writer=None):
+    if self.storage.lookup(data[0]) is None:
+        return SimpleString("none")
+    return SimpleString(self.storage.type_of(data[0]))
+
+@RedisAction.command("OBJECT", -2, "readonly", keys=(2, 2, 1))
+def handle_object(self, data, writer=None):
+    if data[0].upper() != b"ENCODING" or len(data) != 2:
+        raise Error("ERR unknown subcommand or wrong number of arguments for 'OBJECT'")
+    value = self.storage.lookup(data[1])
+    if value is None:
+        return None
+    if not isinstance(value, bytes):
+        return value.encoding
+    if len(value) <= 20 and _is_int(value):
+        return "int"
+    return "embstr" if len(value) <= 44 else "raw"
+
+def _is_int(value: bytes) -> bool:
+    try:
+        return b"%d" % int(value) == value
+    except ValueError:
+        return False
+
+def _int_arg(value: bytes) -> int:
+    try:
+        return int(value)
+    except ValueError:
+        raise Error("ERR value is not an integer or out of range")
+
+def _timeout_arg(value: bytes) -> float:
+    try:
+        timeout = float(value)
+    except ValueError:
+        raise Error("ERR timeout is not a float or out of range")
+    if timeout < 0:
+        raise Error("ERR timeout is negative")
+    return timeout
+
+def _push(self, key: bytes, values: list, left: bool) -> int:
+    storage = self.storage
+    items, before = storage.lookup_for_write(key, ListValue)
+    if left:
+        items.push_left(values, storage.config)
+    else:
+        items.push_right(values, storage.config)
+    storage.written(key, items, before)
+    # One popped element per woken client
+    storage.blocking.signal(key, len(values))
+    return len(items)
+
+@RedisAction.command("LPUSH", -3, "write denyoom fast", keys=(1, 1, 1))
+def handle_lpush(self, data: list, writer=None):
+    return _push(self, data[0], data[1:], left=True)
+
+@RedisAction.command("RPUSH", -3, "write denyoom fast", keys=(1, 1, 1))
+def handle_rpush(self, data: list, writer=None):
+    return _push(self, data[0], data[1:], left=False)
+
+def _pop(self, data: list, left: bool):
+    key = data[0]
+    count = _int_arg(data[1]) if len(data) > 1 else None
+    if count is not None and count < 0:
+        raise Error("ERR value is out of range, must be positive")
+    storage = self.storage
+    items, before = storage.lookup_for_write(key, ListValue, create=False)
+    if items is None:
+        return None
+    n = count if count is not None else 1
+    popped = items.pop_left(n) if left else items.pop_right(n)
+    storage.written(key, items, before)
+    return popped if count is not None else popped[0]
+
+@RedisAction.command("LPOP", -2, "write fast", keys=(1, 1, 1))
+def handle_lpop(self, data: list, writer=None):
+    return _pop(self, data, left=True)
+
+@RedisAction.command("RPOP", -2, "write fast", keys=(1, 1, 1))
+def handle_rpop(self, data: list, writer=None):
+    return _pop(self, data, left=False)
+
+async def _wait_for_keys(self, keys: list, writer, deadline) -> bool:
+    """Block until one of keys is signalled; False on timeout, or for
+    commands from the master, the AOF or an EXEC, which never wait"""
+    if writer is None or self.exec_writes is not None:
+        return False
+    loop = asyncio.get_running_loop()
+    remaining = deadline - loop.time() if deadline is not None else None
+    if remaining is not None and remaining <= 0:
+        return False
+    blocking = self.storage.blocking
+    waiter = blocking.block(keys)
+    started = loop.time()
+    try:
+        await asyncio.wait_for(waiter, remaining)
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        blocking.unblock(keys, waiter)
+        # Left out of the command's latency, like Redis does
+        writer.blocked_time += loop.time() - started
+    return writer.transport is not None and not writer.transport.is_closing()
+
+async def _blocking_pop(self, data: list, writer, left: bool):
+    *keys, timeout = data
+    timeout = _timeout_arg(timeout)
+    storage = self.storage
+    deadline = asyncio.get_running_loop().time() + timeout if timeout else None
+    while True:
+        for key in keys:
+            items, before = storage.lookup_for_write(key, ListValue, create=False)
+            if items is None:
+                continue
+            value = items.pop_left()[0] if left else items.pop_right()[0]
+            storage.written(key, items, before)
+            # Replicas and the AOF see the pop that happened, not the wait
+            self.propagate([b"LPOP" if left else b"RPOP", key])
+            return [key, value]
+        # Another client may have emptied the list first: block again
+        if not await _wait_for_keys(self, keys, writer, deadline):
+            return NULL_ARRAY
+
+@RedisAction.command("BLPOP", -3, "write blocking", keys=(1, -2, 1), propagate=False)
+async def handle_blpop(self, data: list, writer=None):
+    return await _blocking_pop(self, data, writer, left=True)
+
+@RedisAction.command("BRPOP", -3, "write blocking", keys=(1, -2, 1), propagate=False)
+async def handle_brpop(self, data: list, writer=None):
+    return await _blocking_pop(self, data, writer, left=False)
+
+@RedisAction.command("LLEN", 2, "readonly fast", keys=(1, 1, 1))
+def handle_llen(self, data, writer=None):
+    items = self.storage.lookup(data[0], ListValue)
+    return len(items) if items is not None else 0
+
+@RedisAction.command("LRANGE", 4, "readonly", keys=(1, 1, 1))
+def handle_lrange(self, data, writer=None):
+    items = self.storage.lookup(data[0], ListValue)
+    start, stop = _int_arg(data[1]), _int_arg(data[2])
+    return items.range(start, stop) if items is not None else []
+
+@RedisAction.command("LINDEX", 3, "readonly", keys=(1, 1, 1))
+def handle_lindex(self, data, writer=None):
+    items = self.storage.lookup(data[0], ListValue)
+    index = _int_arg(data[1])
+    return items.index(index) if items is not None else None
+
+@RedisAction.command("HSET", -4, "write denyoom fast", keys=(1, 1, 1))
+def handle_hset(self, data: list, writer=None):
+    key, pairs = data[0], data[1:]
+    if not pairs or len(pairs) % 2:
+        raise Error("ERR wrong number of arguments for 'hset' command")
+    storage = self.storage
+    hash_, before = storage.lookup_for_write(key, HashValue)
+    added = sum(hash_.set(field, value, storage.config) for field, value in zip(pairs[::2], pairs[1::2]))
+    storage.written(key, hash_, before)
+    return added
+
+@RedisAction.command("HGET", 3, "readonly fast", keys=(1, 1, 1))
+def handle_hget(self, data, writer=None):
+    hash_ = self.storage.lookup(data[0], HashValue)
+    return hash_.get(data[1]) if hash_ is not None else None
+
+@RedisAction.command("HMGET", -3, "readonly fast", keys=(1, 1, 1))
+def handle_hmget(self, data, writer=None):
+    hash_ = self.storage.lookup(data[0], HashValue)
+    if hash_ is None:
+        return [None] * len(data[1:])
+    return [hash_.get(field) for field in data[1:]]
+
+@RedisAction.command("HGETALL", 2, "readonly", keys=(1, 1, 1))
+def handle_hgetall(self, data, writer=None):
+    hash_ = self.storage.lookup(data[0], HashValue)
+    if hash_ is None:
+        return []
+    return [item for pair in hash_.items() for item in pair]
+
+@RedisAction.command("HDEL", -3, "write fast", keys=(1, 1, 1))
+def handle_hdel(self, data: list, writer=None):
+    storage = self.storage
+    hash_, before = storage.lookup_for_write(data[0], HashValue, create=False)
+    if hash_ is None:
+        return 0
+    removed = sum(hash_.delete(field) for field in data[1:])
+    storage.written(data[0], hash_, before)
+    return removed
+
+@RedisAction.command("HLEN", 2, "readonly fast", keys=(1, 1, 1))
+def handle_hlen(self, data, writer=None):
+    hash_ = self.storage.lookup(data[0], HashValue)
+    return len(hash_) if hash_ is not None else 0
+
+@RedisAction.command("HEXISTS", 3, "readonly fast", keys=(1, 1, 1))
+def handle_hexists(self, data, writer=None):
+    hash_ = self.storage.lookup(data[0], HashValue)
+    return int(hash_ is not None and hash_.get(data[1]) is not None)
+
+@RedisAction.command("SADD", -3, "write denyoom fast", keys=(1, 1, 1))
+def handle_sadd(self, data: list, writer=None):
+    storage = self.storage
+    members, before = storage.lookup_for_write(data[0], SetValue)
+    added = members.add(data[1:], storage.config)
+    storage.written(data[0], members, before)
+    return added
+
+@RedisAction.command("SREM", -3, "write fast", keys=(1, 1, 1))
+def handle_srem(self, data: list, writer=None):
+    storage = self.storage
+    members, before = storage.lookup_for_write(data[0], SetValue, create=False)
+    if members is None:
+        return 0
+    removed = members.remove(data[1:])
+    storage.written(data[0], members, before)
+    return removed
+
+@RedisAction.command("SMEMBERS", 2, "readonly", keys=(1, 1, 1))
+def handle_smembers(self, data, writer=None):
+    members = self.storage.lookup(data[0], SetValue)
+    return members.members() if members is not None else []
+
+@RedisAction.command("SISMEMBER", 3, "readonly fast", keys=(1, 1, 1))
+def handle_sismember(self, data, writer=None):
+    members = self.storage.lookup(data[0], SetValue)
+    return int(members is not None and data[1] in members)
+
+@RedisAction.command("SCARD", 2, "readonly fast", keys=(1, 1, 1))
+def handle_scard(self, data, writer=None):
+    members = self.storage.lookup(data[0], SetValue)
+    return len(members) if members is not None else 0
+
+_ZADD_FLAGS = (b"NX", b"XX", b"GT", b"LT", b"CH", b"INCR")
+
+def _score_arg(value: bytes) -> float:
+    try:
+        return parse_score(value)
+    except ValueError:
+        raise Error("ERR value is not a valid float")
+
+@RedisAction.command("ZADD", -4, "write denyoom fast", keys=(1, 1, 1))
+def handle_zadd(self, data: list, writer=None):
+    key, args = data[0], data[1:]
+    flags = set()
+    while args and args[0].upper() in _ZADD_FLAGS:
+        flags.add(args.pop(0).upper())
+    if not args or len(args) % 2:
+        raise Error("ERR syntax error")
+    if {b"NX", b"XX"} <= flags:
+        raise Error("ERR XX and NX options at the same time are not compatible")
+    if len(flags & {b"NX", b"GT", b"LT"}) > 1:
+        raise Error("ERR GT, LT, and/or NX options at the same time are not compatible")
+    incr = b"INCR" in flags
+    if incr and len(args) != 2:
+        raise Error("ERR INCR option supports a single increment-element pair")
+    pairs = [(_score_arg(score), member) for score, member in zip(args[::2], args[1::2])]
+
+    storage = self.storage
+    zset, before = storage.lookup_for_write(key, ZSetValue, create=b"XX" not in flags)
+    if zset is None:
+        return None if incr else 0
+    added = changed = 0
+    result = None
+    for score, member in pairs:
+        old = zset.score(member)
+        if old is None:
+            if b"XX" in flags:
+                continue
+            zset.add(score, member, storage.config)
+            added += 1
+            result = score
+            continue
+        if b"NX" in flags:
+            continue
+        new = old + score if incr else score
+        if math.isnan(new):
+            storage.written(key, zset, before)
+            raise Error("ERR resulting score is not a number (NaN)")
+        if (b"GT" in flags and new <= old) or (b"LT" in flags and new >= old):
+            continue
+        if new != old:
+            zset.add(new, member, storage.config)
+            changed += 1
+        result = new
+    storage.written(key, zset, before)
+    if incr:
+        return format_score(result) if result is not None else None
+    return added + changed if b"CH" in flags else added
+
+def _with_scores(pairs: list, with_scores: bool) -> list:
+    if not with_scores:
+        return [member for member, _ in pairs]
+    return [item for member, score in pairs for item in (member, format_score(score))]
+
+@RedisAction.command("ZRANGE", -4, "readonly", keys=(1, 1, 1))
+def handle_zrange(self, data, writer=None):
+    key, start, stop, *options = data
+    options = {option.upper() for option in options}
+    if not options <= {b"WITHSCORES", b"REV"}:
+        raise Error("ERR syntax error")
+    zset = self.storage.lookup(key, ZSetValue)
+    start, stop = _int_arg(start), _int_arg(stop)
+    if zset is None:
+        return []
+    return _with_scores(zset.range_by_rank(start, stop, reverse=b"REV" in options), b"WITHSCORES" in options)
+
+def _score_bound(value: bytes):
+    """(score, exclusive) from a ZRANGEBYSCORE bound such as 1, (1 or -inf"""
+    exclusive = value.startswith(b"(")
+    try:
+        return parse_score(value[1:] if exclusive else value), exclusive
+    except ValueError:
+        raise Error("ERR min or max is not a float")
+
+@RedisAction.command("ZRANGEBYSCORE", -4, "readonly", keys=(1, 1, 1))
+def handle_zrangebyscore(self, data, writer=None):
+    key, low, high, *options = data
+    (low, low_exclusive), (high, high_exclusive) = _score_bound(low), _score_bound(high)
+    with_scores, offset, count = False, 0, -1
+    i = 0
+    while i < len(options):
+        option = options[i].upper()
+        if option == b"WITHSCORES":
+            with_scores = True
+            i += 1
+        elif option == b"LIMIT" and i + 2 < len(options):
+            offset, count = _int_arg(options[i + 1]), _int_arg(options[i + 2])
+            i += 3
+        else:
+            raise Error("ERR syntax error")
+    zset = self.storage.lookup(key, ZSetValue)
+    if zset is None or offset < 0:
+        return []
+    return _with_scores(zset.range_by_score(low, low_exclusive, high, high_exclusive, offset, count), with_scores)
+
+@RedisAction.command("ZSCORE", 3, "readonly fast", keys=(1, 1, 1))
+def handle_zscore(self, data, writer=None):
+    zset = self.storage.lookup(data[0], ZSetValue)
+    score = zset.score(data[1]) if zset is not None else None
+    return format_score(score) if score is not None else None
+
+@RedisAction.command("ZRANK", 3, "readonly fast", keys=(1, 1, 1))
+def handle_zrank(self, data, writer=None):
+    zset = self.storage.lookup(data[0], ZSetValue)
+    return zset.rank(data[1]) if zset is not None else None
+
+@RedisAction.command("ZREM", -3, "write fast", keys=(1, 1, 1))
+def handle_zrem(self, data: list, writer=None):
+    storage = self.storage
+    zset, before = storage.lookup_for_write(data[0], ZSetValue, create=False)
+    if zset is None:
+        return 0
+    removed = sum(zset.remove(member) for member in data[1:])
+    storage.written(data[0], zset, before)
+    return removed
+
+@RedisAction.command("ZCARD", 2, "readonly fast", keys=(1, 1, 1))
+def handle_zcard(self, data, writer=None):
+    zset = self.storage.lookup(data[0], ZSetValue)
+    return len(zset) if zset is not None else 0
+
+_INVALID_STREAM_ID = "ERR Invalid stream ID specified as stream command argument"
+_XADD_ID_TOO_SMALL = "ERR The ID specified in XADD is equal or smaller than the target stream top item"
+
+def _stream_id_arg(value: bytes, missing_seq: int = 0) -> tuple:
+    """(ms, seq) from `<ms>-<seq>`, or `<ms>` with missing_seq"""
+    ms, separator, seq = value.partition(b"-")
+    # Plain digits only: int() would also take signs, spaces and underscores
+    if not ms.isdigit() or (separator and not seq.isdigit()):
+        raise Error(_INVALID_STREAM_ID)
+    stream_id = int(ms), int(seq) if separator else missing_seq
+    if not all(part <= STREAM_ID_MAX for part in stream_id):
+        raise Error(_INVALID_STREAM_ID)
+    return stream_id
+
+def _stream_range_bound(value: bytes, start: bool) -> tuple:
+    """An XRANGE bound: an ID, `(` + ID for exclusive, or `-` / `+`"""
+    if value == b"-":
+        return 0, 0
+    if value == b"+":
+        return STREAM_ID_MAX, STREAM_ID_MAX
+    exclusive = value.startswith(b"(")
+    stream_id = _stream_id_arg(value[1:] if exclusive else value, 0 if start else STREAM_ID_MAX)
+    if exclusive:
+        stream_id = next_stream_id(stream_id) if start else previous_stream_id(stream_id)
+        if stream_id is None:
+            raise Error(f"ERR invalid {'start' if start else 'end'} ID for the interval")
+    return stream_id
+
+def _new_stream_id(value: bytes, last_id: tuple) -> tuple:
+    """The ID XADD gives its entry: `*`, `<ms>-*` or an explicit one"""
+    if value == b"*":
+        ms = int(get_current_time())
+        stream_id = (ms, 0) if ms > last_id[0] else next_stream_id(last_id)
+        if stream_id is None:
+            raise Error("ERR The stream has exhausted the last possible ID, unable to add more items")
+    elif value.endswith(b"-*"):
+        ms = _stream_id_arg(value[:-2])[0]
+        if ms > last_id[0]:
+            stream_id = (ms, 0)
+        else:
+            stream_id = (ms, last_id[1] + 1) if ms == last_id[0] and last_id[1] < STREAM_ID_MAX else None
+    else:
+        stream_id = _stream_id_arg(value)
+        if stream_id == (0, 0):
+            raise Error("ERR The ID specified in XADD must be greater than 0-0")
+    if stream_id is None or stream_id <= last_id:
+        raise Error(_XADD_ID_TOO_SMALL)
+    return stream_id
+
+def _format_stream_entries(entries: list) -> list:
+    return [[format_stream_id(stream_id), pairs] for stream_id, pairs in entries]
+
+@RedisAction.command("XADD", -5, "write denyoom fast", keys=(1, 1, 1), propagate=False)
+def handle_xadd(self, data: list, writer=None):
+    key, args = data[0], data[1:]
+    create, maxlen, approximate = True, None, False
+    i = 0
+    while i < len(args):
+        option = args[i].upper()
+        if option == b"NOMKSTREAM":
+            create = False
+            i += 1
+        elif option == b"MAXLEN":
+            i += 1
+            if i < len(args) and args[i] in (b"=", b"~"):
+                approximate = args[i] == b"~"
+                i += 1
+            if i >= len(args):
+                raise Error("ERR syntax error")
+            maxlen = _int_arg(args[i])
+            if maxlen < 0:
+                raise Error("ERR The MAXLEN argument must be >= 0.")
+            i += 1
+            if i < len(args) and args[i].upper() == b"LIMIT":
+                if not approximate:
+                    raise Error("ERR syntax error, LIMIT cannot be used without the special ~ option")
+                # Trimming is by whole nodes already, which bounds its work
+                _int_arg(args[i + 1] if i + 1 < len(args) else b"")
+                i += 2
+        else:
+            break
+    pairs = args[i + 1:]
+    if not pairs or len(pairs) % 2:
+        raise Error("ERR wrong number of arguments for 'xadd' command")
+
+    storage = self.storage
+    # Work out the ID before touching the key, so a bad one leaves no stream
+    existing = storage.lookup(key, StreamValue)
+    if existing is None and not create:
+        return None
+    stream_id = _new_stream_id(args[i], existing.last_id if existing is not None else (0, 0))
+    stream, before = storage.lookup_for_write(key, StreamValue)
+    stream.add(stream_id, pairs, storage.config)
+    if maxlen is not None:
+        stream.trim(maxlen, approximate)
+    storage.written(key, stream, before)
+    # Readers do not consume entries, so every one blocked on the key wakes
+    storage.blocking.signal(key)
+
+    # Replicas must store the same ID and end up with the same entries
+    argv = [b"XADD", key]
+    if maxlen is not None:
+        argv += [b"MAXLEN", b"=", str(len(stream)).encode()]
+    self.propagate(argv + [format_stream_id(stream_id)] + pairs)
+    return format_stream_id(stream_id)
+
+@RedisAction.command("XSETID", 3, "write denyoom fast", keys=(1, 1, 1))
+def handle_xsetid(self, data: list, writer=None):
+    storage = self.storage
+    stream_id = _stream_id_arg(data[1])
+    stream, before = storage.lookup_for_write(data[0], StreamValue, create=False)
+    if stream is None:
+        raise Error("ERR no such key")
+    last_entry = stream.range((0, 0), (STREAM_ID_MAX, STREAM_ID_MAX), 1, reverse=True)
+    if last_entry and stream_id < last_entry[0][0]:
+        raise Error("ERR The ID specified in XSETID is smaller than the target stream top item")
+    stream.last_id = stream_id
+    storage.written(data[0], stream, before)
+    return SimpleString("OK")
+
+@RedisAction.command("XLEN", 2, "readonly fast", keys=(1, 1, 1))
+def handle_xlen(self, data, writer=None):
+    stream = self.storage.lookup(data[0], StreamValue)
+    return len(stream) if stream is not None else 0
+
+def _xrange(self, data: list, reverse: bool) -> list:
+    key, first, second, *options = data
+    start = _stream_range_bound(second if reverse else first, start=True)
+    end = _stream_range_bound(first if reverse else second, start=False)
+    count = None
+    if options:
+        if len(options) != 2 or options[0].upper() != b"COUNT":
+            raise Error("ERR syntax error")
+        count = _int_arg(options[1])
+    stream = self.storage.lookup(key, StreamValue)
+    if stream is None or (count is not None and count <= 0):
+        return []
+    return _format_stream_entries(stream.range(start, end, count or 0, reverse=reverse))
+
+@RedisAction.command("XRANGE", -4, "readonly", keys=(1, 1, 1))
+def handle_xrange(self, data, writer=None):
+    return _xrange(self, data, reverse=False)
+
+@RedisAction.command("XREVRANGE", -4, "readonly", keys=(1, 1, 1))
+def handle_xrevrange(self, data, writer=None):
+    return _xrange(self, data, reverse=True)
+
+def _xread_keys(argv: list) -> list:
+    """Positions of the keys in an XREAD: the first half after STREAMS"""
+    for i, arg in enumerate(argv):
+        if arg.upper() == b"STREAMS":
+            return list(range(i + 1, i + 1 + (len(argv) - i - 1) // 2))
+    return []
+
+@RedisAction.command("XREAD", -4, "readonly blocking movablekeys", keys=_xread_keys)
+async def handle_xread(self, data: list, writer=None):
+    count, block = 0, None
+    i = 0
+    while True:
+        option = data[i].upper() if i < len(data) else None
+        if option == b"STREAMS":
+            i += 1
+            break
+        if option in (b"COUNT", b"BLOCK") and i + 1 < len(data):
+            if option == b"COUNT":
+                count = _int_arg(data[i + 1])
+            else:
+                block = _int_arg(data[i + 1])
+                if block < 0:
+                    raise Error("ERR timeout is negative")
+            i += 2
+        else:
+            raise Error("ERR syntax error")
+    streams = data[i:]
+    if not streams or len(streams) % 2:
+        raise Error("ERR Unbalanced 'xread' list of streams: for each stream key an ID or '$' must be specified.")
+    keys, ids = streams[:len(streams) // 2], streams[len(streams) // 2:]
+
+    storage = self.storage
+    after = []
+    for key, stream_id in zip(keys, ids):
+        if stream_id == b"$":
+            # Only entries added from now on
+            stream = storage.lookup(key, StreamValue)
+            after.append(stream.last_id if stream is not None else (0, 0))
+        else:
+            after.append(_stream_id_arg(stream_id))
+    deadline = asyncio.get_running_loop().time() + block / 1000 if block else None
+    end = (STREAM_ID_MAX, STREAM_ID_MAX)
+    while True:
+        result = []
+        for key, last_id in zip(keys, after):
+            stream = storage.lookup(key, StreamValue)
+            start = next_stream_id(last_id)
+            if stream is None or start is None:
+                continue
+            entries = stream.range(start, end, max(count, 0))
+            if entries:
+                result.append([key, _format_stream_entries(entries)])
+        if result:
+            return result
+        if block is None or not await _wait_for_keys(self, keys, writer, deadline):
+            return NULL_ARRAY
+
+def _subscription_command(self, writer, kind: bytes, names: list, change: str):
+    """Run the PubSub method named change for each name and push one
+    confirmation per name, as Redis does; they go out through the
+    subscriber so no published message can overtake them"""
+    if writer is None:
+        raise Error(f"ERR {kind.decode().upper()} is not allowed here")
+    pubsub = PubSub(self.storage.config)
+    subscriber = pubsub.subscriber(writer)
+    encoder = RESPEncoder()
+    if not names:
+        # Nothing to unsubscribe from still gets a confirmation
+        subscriber.send(encoder.encode([kind, None, subscriber.subscriptions()]))
+    for name in names:
+        getattr(pubsub, change)(subscriber, name)
+        subscriber.send(encoder.encode([kind, name, subscriber.subscriptions()]))
+    if not subscriber.subscriptions():
+        pubsub.remove(writer)
+    return NO_REPLY
+
+@RedisAction.command("SUBSCRIBE", -2, "pubsub noscript loading stale")
+def handle_subscribe(self, data, writer=None):
+    return _subscription_command(self, writer, b"subscribe", data, "subscribe")
+
+@RedisAction.command("PSUBSCRIBE", -2, "pubsub noscript loading stale")
+def handle_psubscribe(self, data, writer=None):
+    return _subscription_command(self, writer, b"psubscribe", data, "psubscribe")
+
+@RedisAction.command("UNSUBSCRIBE", -1, "pubsub noscript loading stale")
+def handle_unsubscribe(self, data, writer=None):
+    subscriber = PubSub(self.storage.config).subscribers.get(writer)
+    channels = data or (sorted(subscriber.channels) if subscriber is not None else [])
+    return _subscription_command(self, writer, b"unsubscribe", channels, "unsubscribe")
+
+@RedisAction.command("PUNSUBSCRIBE", -1, "pubsub noscript loading stale")
+def handle_punsubscribe(self, data, writer=None):
+    subscriber = PubSub(self.storage.config).subscribers.get(writer)
+    patterns = data or (sorted(subscriber.patterns) if subscriber is not None else [])
+    return _subscription_command(self, writer, b"punsubscribe", patterns, "punsubscribe")
+
+@RedisAction.command("PUBLISH", 3, "pubsub loading stale fast may-replicate")
+def handle_publish(self, data: list, writer=None):
+    receivers = PubSub(self.storage.config).publish(data[0], data[1])
+    # Subscribers of replicas get it too; the AOF does not keep messages
+    self.propagate([b"PUBLISH"] + data, aof=False)
+    return receivers
+
+@RedisAction.command("PUBSUB", -2, "pubsub loading stale")
+def handle_pubsub(self, data, writer=None):
+    pubsub = PubSub(self.storage.config)
+    subcommand = data[0].upper() if data else b""
+    if subcommand == b"CHANNELS":
+        match = compile_glob(data[1]) if len(data) > 1 else None
+        return [channel for channel in pubsub.channels if match is None or match(channel)]
+    if subcommand == b"NUMSUB":
+        return [item for channel in data[1:] for item in (channel, len(pubsub.channels.get(channel, ())))]
+    if subcommand == b"NUMPAT":
+        return pubsub.patterns.count
+    raise Error("ERR unknown subcommand or wrong number of arguments for 'PUBSUB'")
+
+@RedisAction.command("MULTI", 1, "noscript loading stale fast")
+def handle_multi(self, data, writer=None):
+    transaction = self.transaction(writer)
+    if transaction.in_multi:
+        raise Error("ERR MULTI calls can not be nested")
+    transaction.queued = []
+    return SimpleString("OK")
+
+@RedisAction.command("EXEC", 1, "noscript loading stale skip-slowlog")
+async def handle_exec(self, data: list, writer=None):
+    """Run the queued commands back to back and reply with all results.
+
+    No handler awaits anything that can suspend while exec_writes is set
+    (blocking commands give up at once), so no other client runs in between
+    and the writes reach replicas and the AOF wrapped in MULTI/EXEC.
+    """
+    transaction = self.transactions.get(writer)
+    if transaction is None or not transaction.in_multi:
+        raise Error("ERR EXEC without MULTI")
+    queued = transaction.queued
+    failed = transaction.failed
+    modified = transaction.modified()
+    self.discard_transaction(writer)
+    if failed:
+        raise Error(EXECABORT_ERROR)
+    if modified:
+        return NULL_ARRAY
+    results = []
+    self.exec_writes = []
+    try:
+        for argv in queued:
+            try:
+                result = await self.dispatch(argv, writer)
+            except Error as e:
+                result = e
+            results.append(None if result is NO_REPLY else result)
+    finally:
+        writes, self.exec_writes = self.exec_writes, None
+        if writes:
+            self._propagate([([b"MULTI"], True)] + writes + [([b"EXEC"], True)])
+    return results
+
+@RedisAction.command("DISCARD", 1, "noscript loading stale fast")
+def handle_discard(self, data, writer=None):
+    transaction = self.transactions.get(writer)
+    if transaction is None or not transaction.in_multi:
+        raise Error("ERR DISCARD without MULTI")
+    self.discard_transaction(writer)
+    return SimpleString("OK")
+
+@RedisAction.command("WATCH", -2, "noscript loading stale fast", keys=(1, -1, 1))
+def handle_watch(self, data, writer=None):
+    if not data:
+        raise Error("ERR wrong number of arguments for 'watch' command")
+    transaction = self.transaction(writer)
+    if transaction.in_multi:
+        raise Error("ERR WATCH inside MULTI is not allowed")
+    for key in data:
+        transaction.watch(key)
+    return SimpleString("OK")
+
+@RedisAction.command("UNWATCH", 1, "noscript loading stale fast")
+def handle_unwatch(self, data, writer=None):
+    self.discard_transaction(writer)
+    return SimpleString("OK")
+
+def _client_type(self, connection) -> str:
+    if find_replica(self.storage.metadata, connection) is not None:
+        return "replica"
+    if PubSub(self.storage.config).in_subscribed_mode(connection):
+        return "pubsub"
+    return "normal"
+
+def _client_line(self, connection) -> str:
+    """One CLIENT LIST line"""
+    client = connection.client
+    subscriber = PubSub(self.storage.config).subscribers.get(connection)
+    transaction = self.transactions.get(connection)
+    in_multi = transaction is not None and transaction.in_multi
+    flags = {"replica": "S", "pubsub": "P", "normal": ""}[_client_type(self, connection)]
+    if in_multi:
+        flags += "x"
+    if client.close_after_reply:
+        flags += "c"
+    now = monotonic()
+    return (
+        f"id={client.id} addr={client.addr} laddr={client.laddr} name={client.name} "
+        f"age={int(now - client.created)} idle={int(now - client.last_interaction)} flags={flags or 'N'} db=0 "
+        f"sub={len(subscriber.channels) if subscriber is not None else 0} "
+        f"psub={len(subscriber.patterns) if subscriber is not None else 0} "
+        f"multi={len(transaction.queued) if in_multi else -1} "
+        f"omem={connection.transport.get_write_buffer_size()} "
+        f"tot-net-in={client.bytes_in} tot-net-out={client.bytes_out} "
+        f"cmd={client.last_command.decode('utf-8', 'replace').lower() or 'NULL'}"
+    )
+
+def _client_type_arg(value: bytes) -> str:
+    client_type = value.decode("utf-8", "replace").lower()
+    if client_type == "slave":
+        return "replica"
+    if client_type not in ("normal", "replica", "pubsub", "master"):
+        raise Error(f"ERR Unknown client type '{client_type}'")
+    return client_type
+
+def _kill_client(self, connection, writer):
+    if connection is writer:
+        # Still answer the CLIENT KILL itself
+        connection.client.close_after_reply = True
+    else:
+        connection.close()
+
+def _client_kill(self, args: list, writer) -> int:
+    """CLIENT KILL <filter> <value> ...: how many clients were closed"""
+    if len(args) % 2:
+        raise Error("ERR syntax error")
+    client_id = addr = laddr = client_type = None
+    skipme = True
+    for option, value in zip(args[::2], args[1::2]):
+        option = option.upper()
+        if option == b"ID":
+            client_id = _int_arg(value)
+        elif option == b"ADDR":
+            addr = value.decode()
+        elif option == b"LADDR":
+            laddr = value.decode()
+        elif option == b"TYPE":
+            client_type = _client_type_arg(value)
+        elif option == b"SKIPME":
+            if value.lower() not in (b"yes", b"no"):
+                raise Error("ERR syntax error")
+            skipme = value.lower() == b"yes"
+        else:
+            raise Error("ERR syntax error")
+    killed = 0
+    for connection in list(ClientRegistry(self.storage.config).connections.values()):
+        client = connection.client
+        if ((client_id is not None and client.id != client_id)
+                or (addr is not None and client.addr != addr)
+                or (laddr is not None and client.laddr != laddr)
+                or (client_type is not None and _client_type(self, connection) != client_type)
+                or (skipme and connection is writer)):
+            continue
+        _kill_client(self, connection, writer)
+        killed += 1
+    return killed
+
+@RedisAction.command("CLIENT", -2, "admin noscript loading stale")
+def handle_client(self, data, writer=None):
+    if writer is None:
+        raise Error("ERR CLIENT is only available to connected clients")
+    subcommand = data[0].upper()
+    registry = ClientRegistry(self.storage.config)
+    if subcommand == b"ID" and len(data) == 1:
+        return writer.client.id
+    if subcommand == b"GETNAME" and len(data) == 1:
+        return writer.client.name or None
+    if subcommand == b"SETNAME" and len(data) == 2:
+        if any(byte < 33 or byte > 126 for byte in data[1]):
+            raise Error("ERR Client names cannot contain spaces, newlines or special characters.")
+        writer.client.name = data[1].decode()
+        return SimpleString("OK")
+    if subcommand == b"INFO" and len(data) == 1:
+        return _client_line(self, writer) + "\n"
+    if subcommand == b"LIST":
+        connections = list(registry.connections.values())
+        if len(data) == 3 and data[1].upper() == b"TYPE":
+            client_type = _client_type_arg(data[2])
+            connections = [c for c in connections if _client_type(self, c) == client_type]
+        elif len(data) > 2 and data[1].upper() == b"ID":
+            ids = [_int_arg(value) for value in data[2:]]
+            connections = [registry.get(i) for i in ids if registry.get(i) is not None]
+        elif len(data) != 1:
+            raise Error("ERR syntax error")
+        return "".join(_client_line(self, connection) + "\n" for connection in connections)
+    if subcommand == b"KILL" and len(data) == 2:
+        # The old form: CLIENT KILL ip:port
+        address = data[1].decode()
+        for connection in list(registry.connections.values()):
+            if connection.client.addr == address:
+                _kill_client(self, connection, writer)
+                return SimpleString("OK")
+        raise Error("ERR No such client")
+    if subcommand == b"KILL" and len(data) > 2:
+        return _client_kill(self, data[1:], writer)
+    raise Error("ERR unknown subcommand or wrong number of arguments for 'CLIENT'")
+
+@RedisAction.command("CONFIG", -2, "admin noscript loading stale")
 def handle_config(self, data, writer=None):
-    if data[-1] == "dir":
+    if data[0].upper() == b"SET":
+        for name, value in zip(data[1::2], data[2::2]):
+            try:
+                self.storage.config.set(name.decode(), value)
+            except KeyError:
+                raise Error(f"ERR Unknown option or number of arguments for CONFIG SET - '{name.decode()}'")
+            except ValueError as e:
+                raise Error(f"ERR CONFIG SET failed - {e}")
+        return SimpleString("OK")
+    if data[0].upper() == b"RESETSTAT":
+        self.stats.reset(self.storage, self.commands.values())
+        return SimpleString("OK")
+    name = data[-1].decode().lower()
+    if name == "dir":
         return self.storage.get_dir()
-    else:
-        return self.storage.get_dbfielname()
+    if name == "dbfilename":
+        return self.storage.get_dbfilename()
+    value = self.storage.config.get(name)
+    if value is None:
+        return []
+    return [name, str(value)]
 
-@RedisAction.command("KEYS")
+@RedisAction.command("KEYS", 2, "readonly")
 def handle_keys(self, data, writer=None):
-    return self.storage.fetch_all_keys()
+    return self.storage.fetch_all_keys(data[0] if data else b"*")
 
-@RedisAction.command("INFO")
+@RedisAction.command("SCAN", -2, "readonly")
+def handle_scan(self, data, writer=None):
+    try:
+        cursor = int(data[0])
+    except ValueError:
+        cursor = -1
+    # Cursors are unsigned 64 bit integers, as in Redis
+    if not 0 <= cursor < 2 ** 64:
+        raise Error("ERR invalid cursor")
+    pattern, count, type_name = None, 10, None
+    options = data[1:]
+    if len(options) % 2:
+        raise Error("ERR syntax error")
+    for option, argument in zip(options[::2], options[1::2]):
+        option = option.upper()
+        if option == b"MATCH":
+            pattern = argument
+        elif option == b"COUNT":
+            count = _int_arg(argument)
+            if count < 1:
+                raise Error("ERR syntax error")
+        elif option == b"TYPE":
+            type_name = argument.decode("utf-8", "replace").lower()
+        else:
+            raise Error("ERR syntax error")
+    cursor, keys = self.storage.scan(cursor, count, pattern, type_name)
+    return [str(cursor), keys]
+
+@RedisAction.command("INFO", -1, "loading stale")
 def handle_info(self, data, writer=None):
-    return self.storage.get_metadata_str()
+    sections = {
+        "clients": lambda: self.stats.clients_info(self.storage),
+        "replication": self.storage.get_metadata_str,
+        "memory": self.storage.get_memory_str,
+        "persistence": self.storage.get_persistence_str,
+        "stats": lambda: self.stats.info(self.storage),
+        "cluster": lambda: f"cluster_enabled:{int(self.cluster is not None)}",
+    }
+    requested = data[0].decode().lower() if data else None
+
+    def commandstats():
+        # One line per command that ran; too long for the default sections
+        return "\n".join(
+            f"cmdstat_{command.name}:{command.stats.info()}"
+            for command in self.commands.values() if command.stats.calls
+        )
 
-@RedisAction.command("REPLCONF")
+    if requested == "commandstats":
+        sections = {}
+    elif requested in sections:
+        sections = {requested: sections[requested]}
+    if requested in ("commandstats", "all", "everything"):
+        sections["commandstats"] = commandstats
+    return "\n\n".join(f"# {name.capitalize()}\n{render()}" for name, render in sections.items())
+
+@RedisAction.command("CLUSTER", -2, "loading stale")
+def handle_cluster(self, data, writer=None):
+    subcommand = data[0].upper()
+    if subcommand == b"KEYSLOT" and len(data) == 2:
+        return key_hash_slot(data[1])
+    cluster = self.cluster
+    if cluster is None:
+        raise Error(CLUSTER_DISABLED_ERROR)
+    if subcommand == b"SLOTS":
+        return cluster.slots_reply()
+    if subcommand == b"SHARDS":
+        return cluster.shards_reply()
+    if subcommand == b"NODES":
+        return cluster.nodes_reply()
+    if subcommand == b"MYID":
+        return cluster.myself.node_id
+    if subcommand == b"INFO":
+        return cluster.info()
+    raise Error("ERR unknown subcommand or wrong number of arguments for 'CLUSTER'")
+
+@RedisAction.command("COMMAND", -1, "loading stale")
+def handle_command_info(self, data, writer=None):
+    commands = self.commands
+    subcommand = data[0].upper() if data else None
+    if subcommand is None:
+        return [command.info() for command in commands.values()]
+    if subcommand == b"COUNT":
+        return len(commands)
+    if subcommand == b"LIST":
+        return [command.name for command in commands.values()]
+    if subcommand == b"INFO":
+        names = data[1:] or list(commands)
+        return [commands[name.upper()].info() if name.upper() in commands else None for name in names]
+    if subcommand == b"DOCS":
+        # No docs are kept, which clients take as nothing to show
+        return []
+    if subcommand == b"GETKEYS" and len(data) > 1:
+        command = commands.get(data[1].upper())
+        if command is None:
+            raise Error("ERR Invalid command specified")
+        if not command.arity_ok(len(data) - 1):
+            raise Error("ERR Invalid number of arguments specified for command")
+        keys = command.keys(data[1:])
+        if not keys:
+            raise Error("ERR The command has no key arguments")
+        return keys
+    raise Error("ERR unknown subcommand or wrong number of arguments for 'COMMAND'")
+
+@RedisAction.command("SLOWLOG", -2, "admin loading stale")
+def handle_slowlog(self, data, writer=None):
+    subcommand = data[0].upper()
+    slowlog = self.stats.slowlog
+    if subcommand == b"GET" and len(data) <= 2:
+        count = _int_arg(data[1]) if len(data) == 2 else 10
+        if count < -1:
+            raise Error("ERR count should be greater than or equal to -1")
+        entries = list(slowlog) if count == -1 else list(islice(slowlog, count))
+        return [list(entry) for entry in entries]
+    if subcommand == b"LEN" and len(data) == 1:
+        return len(slowlog)
+    if subcommand == b"RESET" and len(data) == 1:
+        slowlog.clear()
+        return SimpleString("OK")
+    raise Error("ERR unknown subcommand or wrong number of arguments for 'SLOWLOG'")
+
+@RedisAction.command("LATENCY", -2, "admin noscript loading stale")
+def handle_latency(self, data, writer=None):
+    if data[0].upper() != b"HISTOGRAM":
+        raise Error("ERR unknown subcommand or wrong number of arguments for 'LATENCY'")
+    commands = self.commands
+    if len(data) > 1:
+        selected = [commands[name.upper()] for name in data[1:] if name.upper() in commands]
+    else:
+        selected = commands.values()
+    reply = []
+    for command in selected:
+        if command.stats.calls:
+            reply += [command.name, command.stats.histogram_reply()]
+    return reply
+
+@RedisAction.command("SAVE", 1, "admin noscript no-multi")
+def handle_save(self, data, writer=None):
+    self.storage.save()
+    return SimpleString("OK")
+
+@RedisAction.command("BGSAVE", -1, "admin noscript")
+def handle_bgsave(self, data, writer=None):
+    self.storage.bgsave()
+    return SimpleString("Background saving started")
+
+@RedisAction.command("LASTSAVE", 1, "loading stale fast")
+def handle_lastsave(self, data, writer=None):
+    return self.storage.lastsave
+
+@RedisAction.command("BGREWRITEAOF", 1, "admin noscript")
+def handle_bgrewriteaof(self, data, writer=None):
+    self.storage.bgrewriteaof()
+    return SimpleString("Background append only file rewriting started")
+
+@RedisAction.command("MEMORY", -2, "readonly")
+def handle_memory(self, data, writer=None):
+    if data and data[0].upper() == b"USAGE" and len(data) > 1:
+        return self.storage.memory_usage(data[1])
+    raise Error("ERR unknown subcommand or wrong number of arguments for 'MEMORY'")
+
+@RedisAction.command("REPLCONF", -1, "admin noscript loading stale")
 def handle_replconf(self, data, writer=None):
-    if data[0] == "GETACK" and self.storage.metadata.role == "slave":
-        print(f"REPLCONF received: {data}")
-        return ["REPLCONF", "ACK", "0"]
-    return "OK"
+    metadata = self.storage.metadata
+    subcommand = data[0].upper()
+    if subcommand == b"GETACK" and metadata.role == "slave":
+        logger.debug("REPLCONF received: %r", data)
+        # Offset of the stream applied before this GETACK
+        return ["REPLCONF", "ACK", str(metadata.master_repl_offset)]
+    if subcommand == b"ACK":
+        link = find_replica(metadata, writer)
+        if link is not None:
+            link.ack(int(data[1]))
+        return NO_REPLY
+    if writer is not None and subcommand in (b"LISTENING-PORT", b"CAPA"):
+        handshake = metadata.replica_handshakes.setdefault(writer, {"listening_port": None, "capa": set()})
+        if subcommand == b"LISTENING-PORT":
+            handshake["listening_port"] = int(data[1])
+        else:
+            handshake["capa"].update(capa.decode().lower() for capa in data[1::2])
+    return SimpleString("OK")
 
-@RedisAction.command("PSYNC")
+@RedisAction.command("PSYNC", -3, "admin noscript no-multi")
 async def handle_psync(self, data, writer=None):
     encoder = RESPEncoder()
-    # 1. Send FULLRESYNC
-    yield encoder.encode(f"FULLRESYNC {self.storage.metadata.master_replid} 0")
-    # 2. Send RDB as RESP bulk string
-    rdb_path = self.storage.rdb_path
-    if rdb_path and os.path.exists(rdb_path):
-        with open(rdb_path, "rb") as f:
-            rdb_data = f.read()
-        if len(rdb_data) > 0:
-            header = f"${len(rdb_data)}\r\n".encode()
-            yield header + rdb_data
-            return
-    # If no RDB file or empty, send minimal valid RDB
-    minimal_rdb = b"REDIS0011\xff"
-    header = f"${len(minimal_rdb)}\r\n".encode()
-    yield header + minimal_rdb
-    if self.storage.metadata.role == "master" and writer is not None:
-        self.storage.metadata.replica_writers.append(writer)
-    
\ No newline at end of file
+    metadata = self.storage.metadata
+    config = self.storage.config
+    if metadata.role != "master" or writer is None:
+        yield encoder.encode(Error("ERR PSYNC is only served by a master"))
+        return
+    replid = data[0].decode("utf-8", "replace")
+    try:
+        offset = int(data[1])
+    except ValueError:
+        # Nothing to resume from: the replica gets a full resync
+        offset = None
+    backlog = metadata.create_backlog(config.repl_backlog_size)
+    handshake = metadata.replica_handshakes.pop(writer, {})
+    # Registered before anything is awaited, so no write can slip between
+    # the sync offset and the stream queued on the link
+    link = ReplicaLink(metadata, config, writer, handshake.get("listening_port"), handshake.get("capa", ()))
+    metadata.replicas.append(link)
+    if offset is not None and replid == metadata.master_replid and backlog.can_serve(offset):
+        # Partial resync: only the bytes the replica missed
+        logger.info("Partial resync from offset %d", offset)
+        link.ack(offset - 1)
+        yield encoder.encode(SimpleString(f"CONTINUE {metadata.master_replid}")) + backlog.read_from(offset)
+        link.start()
+        return
+
+    # Full resync from a forked snapshot, shared with replicas syncing alongside
+    diskless = config.repl_diskless_sync == "yes" and "eof" in link.capabilities
+    sync = metadata.full_sync
+    if sync is None or not sync.can_attach(diskless):
+        sync = metadata.full_sync = FullSync(self.storage, diskless)
+    sync.attach(link)
+    await sync.started.wait()
+    if sync.failed:
+        return
+    link.ack(sync.offset)
+    yield encoder.encode(SimpleString(f"FULLRESYNC {metadata.master_replid} {sync.offset}"))
+    async for chunk in sync.stream(link):
+        yield chunk
+    link.start()
@@ -0,0 +1,52 @@
+"""The benchmark suite: codec microbenchmarks, then the load generator.
+
+Run with ``python -m app.benchmark``; takes the options of both
+``app.benchmark.codec`` and ``app.benchmark.load``. Prints a single JSON
+document, with the interpreter and git revision it ran on, so runs can be
+saved and compared to catch regressions between releases.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+
+from app.benchmark import codec, load
+
+
+def git_revision():
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=root, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Codec and load benchmarks, as JSON')
+    codec.add_arguments(parser)
+    load.add_arguments(parser)
+    parser.add_argument('--skip-codec', action='store_true', help='only run the load benchmark')
+    parser.add_argument('--skip-load', action='store_true', help='only run the codec microbenchmarks')
+    parser.add_argument('--output', type=str, default=None, help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = {
+        "timestamp": int(time.time()),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "codec": None if args.skip_codec else codec.benchmark(args),
+        "load": None if args.skip_load else load.benchmark(args),
+    }
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
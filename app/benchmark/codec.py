@@ -0,0 +1,111 @@
+"""RESP codec microbenchmarks.
+
+Run with ``python -m app.benchmark.codec``. Each decode workload is encoded
+once, then fed to a fresh ``RESPDecoder`` in fixed-size chunks, the way
+socket reads arrive, and the decode throughput is reported in MB/s and
+commands/s. The encode workload times ``RESPEncoder`` on the kinds of
+replies commands return. ``--json`` prints the results as JSON.
+"""
+import argparse
+import json
+import time
+
+from app.resp.RESPCodec import RESPDecoder, RESPEncoder, SimpleString
+
+
+def small_commands(count: int) -> bytes:
+    encoder = RESPEncoder()
+    return b''.join(encoder.encode(["SET", f"key:{i}", f"value:{i}"]) for i in range(count))
+
+
+def large_values(count: int, value_size: int) -> bytes:
+    encoder = RESPEncoder()
+    value = "x" * value_size
+    return b''.join(encoder.encode(["SET", f"key:{i}", value]) for i in range(count))
+
+
+def typical_replies(count: int) -> list:
+    """A reply per command: OKs, integers, values, nils and small arrays"""
+    ok = SimpleString("OK")
+    shapes = [ok, 42, b"value", None, [b"a", b"b", b"c"]]
+    return [shapes[i % len(shapes)] for i in range(count)]
+
+
+def run_encode(name: str, replies: list, repeat: int) -> dict:
+    best = None
+    size = 0
+    for _ in range(repeat):
+        encoder = RESPEncoder()
+        start = time.perf_counter()
+        size = sum(len(encoder.encode(reply)) for reply in replies)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        "workload": name,
+        "bytes": size,
+        "commands": len(replies),
+        "chunk_size": None,
+        "seconds": best,
+        "mb_per_sec": size / best / (1024 * 1024),
+        "commands_per_sec": len(replies) / best,
+    }
+
+
+def run(name: str, payload: bytes, commands: int, chunk_size: int, repeat: int) -> dict:
+    best = None
+    for _ in range(repeat):
+        decoder = RESPDecoder()
+        decoded = 0
+        start = time.perf_counter()
+        for offset in range(0, len(payload), chunk_size):
+            decoded += len(decoder.decode_all(payload[offset:offset + chunk_size]))
+        elapsed = time.perf_counter() - start
+        if decoded != commands:
+            raise RuntimeError(f"{name}: decoded {decoded} of {commands} commands")
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        "workload": name,
+        "bytes": len(payload),
+        "commands": commands,
+        "chunk_size": chunk_size,
+        "seconds": best,
+        "mb_per_sec": len(payload) / best / (1024 * 1024),
+        "commands_per_sec": commands / best,
+    }
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--commands', type=int, default=100000, help='number of small SET commands / encoded replies')
+    parser.add_argument('--large-count', type=int, default=64, help='number of large SET commands')
+    parser.add_argument('--value-size', type=int, default=1024 * 1024, help='value size for the large workload')
+    parser.add_argument('--chunk-size', type=int, default=16 * 1024, help='bytes fed to the decoder per call')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per workload, best one is reported')
+
+
+def benchmark(args) -> list:
+    """Run every codec workload described by parsed arguments"""
+    return [
+        run("small-commands", small_commands(args.commands), args.commands, args.chunk_size, args.repeat),
+        run("large-values", large_values(args.large_count, args.value_size), args.large_count, args.chunk_size, args.repeat),
+        run_encode("encode-replies", typical_replies(args.commands), args.repeat),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='RESP codec microbenchmarks')
+    add_arguments(parser)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    results = benchmark(args)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        chunks = f", {r['chunk_size']} byte chunks" if r['chunk_size'] else ""
+        print(f"{r['workload']:>15}: {r['mb_per_sec']:10.1f} MB/s {r['commands_per_sec']:12.0f} commands/s "
+              f"({r['commands']} commands, {r['bytes']} bytes{chunks})")
+
+
+if __name__ == "__main__":
+    main()
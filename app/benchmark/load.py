@@ -0,0 +1,263 @@
+"""Load generator, in the spirit of redis-benchmark.
+
+Run with ``python -m app.benchmark.load``. Unless ``--port`` points it at a
+running server, it starts one on a free port, fills ``--keyspace`` keys with
+``--data-size`` byte values and drives it with ``--clients`` asyncio
+connections, each keeping ``--pipeline`` commands in flight. Commands are
+drawn from ``--mix`` (e.g. ``get=4,set=4,mget=1,incr=1,lpush=1``).
+
+A command's latency runs from the write of its pipeline batch to the read of
+its reply, as redis-benchmark measures it. Results are printed as JSON:
+overall and per command throughput with p50/p99/p999 latency in usec.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import time
+
+from app.resp.RESPCodec import Error, RESPDecoder, RESPEncoder
+
+COMMANDS = ("get", "set", "mget", "incr", "lpush")
+DEFAULT_MIX = "get=4,set=4,mget=1,incr=1,lpush=1"
+# Keys per MGET
+MGET_KEYS = 10
+# Seconds to wait for a spawned server to accept connections
+SERVER_START_TIMEOUT = 10
+READ_SIZE = 64 * 1024
+
+
+def parse_mix(value: str) -> dict:
+    """``name=weight,...`` -> {name: weight}; a bare name weighs 1"""
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.strip().partition("=")
+        name = name.lower()
+        if name not in COMMANDS:
+            raise argparse.ArgumentTypeError(f"unknown command in mix: {name} (choose from {', '.join(COMMANDS)})")
+        mix[name] = int(weight or 1)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("mix has no command with a positive weight")
+    return mix
+
+
+def percentile(ordered: list, fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def latency_summary(latencies: list) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "p50": percentile(ordered, 0.50),
+        "p99": percentile(ordered, 0.99),
+        "p999": percentile(ordered, 0.999),
+        "max": ordered[-1] if ordered else 0.0,
+    }
+
+
+class Workload:
+    """Encodes random commands from the mix over the configured keyspace"""
+
+    def __init__(self, mix: dict, keyspace: int, value_size: int, seed: int):
+        self.names = [name for name in mix if mix[name] > 0]
+        self.weights = [mix[name] for name in self.names]
+        self.keyspace = keyspace
+        self.value = b"x" * value_size
+        self.random = random.Random(seed)
+        self.encoder = RESPEncoder()
+
+    def key(self, prefix: bytes) -> bytes:
+        return b"%s:%d" % (prefix, self.random.randrange(self.keyspace))
+
+    def command(self, name: str) -> bytes:
+        if name == "get":
+            argv = [b"GET", self.key(b"key")]
+        elif name == "set":
+            argv = [b"SET", self.key(b"key"), self.value]
+        elif name == "mget":
+            argv = [b"MGET"] + [self.key(b"key") for _ in range(MGET_KEYS)]
+        elif name == "incr":
+            argv = [b"INCR", self.key(b"counter")]
+        else:
+            argv = [b"LPUSH", self.key(b"list"), self.value]
+        return self.encoder.encode(argv)
+
+    def batch(self, size: int) -> tuple[list, bytes]:
+        """size random commands: their names and the bytes to send"""
+        names = self.random.choices(self.names, self.weights, k=size)
+        return names, b"".join(self.command(name) for name in names)
+
+
+async def read_replies(reader, decoder: RESPDecoder, count: int, on_reply):
+    """Read until count replies arrived, calling on_reply(reply) for each"""
+    pending = count
+    while pending:
+        data = await reader.read(READ_SIZE)
+        if not data:
+            raise ConnectionError("server closed the connection")
+        for reply in decoder.decode_all(data):
+            on_reply(reply)
+            pending -= 1
+
+
+async def prefill(host: str, port: int, keyspace: int, value_size: int, batch: int = 1000):
+    """SET every key once, so reads measure hits rather than misses"""
+    reader, writer = await asyncio.open_connection(host, port)
+    encoder, decoder = RESPEncoder(), RESPDecoder()
+    value = b"x" * value_size
+    try:
+        for start in range(0, keyspace, batch):
+            end = min(start + batch, keyspace)
+            writer.write(b"".join(encoder.encode([b"SET", b"key:%d" % i, value]) for i in range(start, end)))
+            await writer.drain()
+            await read_replies(reader, decoder, end - start, lambda reply: None)
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+async def client(host: str, port: int, workload: Workload, requests: int, pipeline: int, results: dict):
+    """One connection sending requests commands, pipeline at a time"""
+    reader, writer = await asyncio.open_connection(host, port)
+    decoder = RESPDecoder()
+    try:
+        while requests > 0:
+            size = min(pipeline, requests)
+            requests -= size
+            names, payload = workload.batch(size)
+            replies = iter(names)
+            sent = time.perf_counter()
+
+            def on_reply(reply):
+                latency = (time.perf_counter() - sent) * 1e6
+                stats = results[next(replies)]
+                stats["latencies"].append(latency)
+                if isinstance(reply, Error):
+                    stats["errors"] += 1
+
+            writer.write(payload)
+            await writer.drain()
+            await read_replies(reader, decoder, size, on_reply)
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+async def run_load(host: str, port: int, clients: int, requests: int, pipeline: int,
+                   mix: dict, keyspace: int, value_size: int, seed: int) -> dict:
+    await prefill(host, port, keyspace, value_size)
+    results = {name: {"latencies": [], "errors": 0} for name in mix}
+    per_client = [requests // clients + (i < requests % clients) for i in range(clients)]
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        client(host, port, Workload(mix, keyspace, value_size, seed + i), count, pipeline, results)
+        for i, count in enumerate(per_client) if count
+    ))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for stats in results.values() for latency in stats["latencies"]]
+    return {
+        "benchmark": "load",
+        "clients": clients,
+        "requests": requests,
+        "pipeline": pipeline,
+        "keyspace": keyspace,
+        "data_size": value_size,
+        "mix": mix,
+        "seconds": elapsed,
+        "ops_per_sec": len(latencies) / elapsed,
+        "errors": sum(stats["errors"] for stats in results.values()),
+        "latency_usec": latency_summary(latencies),
+        "commands": {
+            name: {
+                "calls": len(stats["latencies"]),
+                "errors": stats["errors"],
+                "ops_per_sec": len(stats["latencies"]) / elapsed,
+                "latency_usec": latency_summary(stats["latencies"]),
+            }
+            for name, stats in results.items() if stats["latencies"]
+        },
+    }
+
+
+def free_port(host: str) -> int:
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def start_server(host: str, port: int, server_args: list) -> subprocess.Popen:
+    """Run ``python -m app.main`` from the repository root and wait until it
+    accepts connections"""
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "app.main", "--host", host, "--port", str(port), "--loglevel", "warning",
+         *server_args],
+        cwd=root,
+    )
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            socket.create_connection((host, port), timeout=0.1).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.terminate()
+    raise RuntimeError(f"server did not start listening on {host}:{port}")
+
+
+def stop_server(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='the host of the server')
+    parser.add_argument('--port', type=int, default=None, help='benchmark a running server instead of starting one')
+    parser.add_argument('--server-args', type=str, default='', help='extra arguments for the started server, e.g. "--appendonly yes"')
+    parser.add_argument('--clients', type=int, default=50, help='concurrent connections')
+    parser.add_argument('--requests', type=int, default=100000, help='total commands sent')
+    parser.add_argument('--pipeline', type=int, default=1, help='commands in flight per connection')
+    parser.add_argument('--keyspace', type=int, default=10000, help='distinct keys used')
+    parser.add_argument('--data-size', type=int, default=3, help='bytes per SET/LPUSH value, as redis-benchmark -d')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f'command weights (default {DEFAULT_MIX})')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the random commands')
+
+
+def benchmark(args) -> dict:
+    """Run the load benchmark described by parsed arguments"""
+    process = None
+    port = args.port
+    if port is None:
+        port = free_port(args.host)
+        process = start_server(args.host, port, shlex.split(args.server_args))
+    try:
+        return asyncio.run(run_load(args.host, port, args.clients, args.requests, args.pipeline,
+                                    args.mix, args.keyspace, args.data_size, args.seed))
+    finally:
+        if process is not None:
+            stop_server(process)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load generator for the server')
+    add_arguments(parser)
+    args = parser.parse_args()
+    print(json.dumps(benchmark(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
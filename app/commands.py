@@ -1,13 +1,60 @@
-from enum import Enum
-
-class SimpleCommand(Enum):
-    PING = "PING"
-    ECHO = "ECHO"
-    SET = "SET"
-    GET = "GET"
-    CONFIG = "CONFIG"
-    KEYS = "KEYS"
-    INFO = "INFO"
-
-class StreamingCommand(Enum):
-    PSYNC = "PSYNC"
\ No newline at end of file
+import inspect
+
+from app.resp.RESPCodec import SimpleString
+from app.server.stats import CommandStats
+
+
+class Command:
+    """One command table entry: its handler plus what COMMAND reports.
+
+    arity counts the command name, and a negative one means "at least".
+    Keys sit at first_key, first_key + key_step, ... up to last_key, which
+    counts from the end when negative; commands whose keys move around
+    (movablekeys) pass a function from argv to key positions instead.
+    """
+
+    __slots__ = ("name", "handler", "arity", "flags", "first_key", "last_key", "key_step",
+                 "find_keys", "is_async", "is_write", "propagate", "stats")
+
+    def __init__(self, name: str, handler, arity: int, flags: str = "", keys=(0, 0, 0), propagate: bool = True):
+        self.name = name.lower()
+        self.handler = handler
+        self.arity = arity
+        self.flags = tuple(flags.split())
+        if callable(keys):
+            self.find_keys = keys
+            self.first_key = self.last_key = self.key_step = 0
+        else:
+            self.find_keys = None
+            self.first_key, self.last_key, self.key_step = keys
+        # Worked out once here rather than on every call
+        self.is_async = inspect.iscoroutinefunction(handler)
+        self.is_write = "write" in self.flags
+        # Writes reach replicas and the AOF as sent, unless the handler
+        # propagates a rewritten form itself (e.g. BLPOP as LPOP); async
+        # handlers may suspend, so they always propagate their own writes
+        self.propagate = self.is_write and propagate and not self.is_async
+        self.stats = CommandStats()
+
+    def arity_ok(self, argc: int) -> bool:
+        return argc == self.arity if self.arity >= 0 else argc >= -self.arity
+
+    def key_positions(self, argv: list) -> list:
+        if self.find_keys is not None:
+            return self.find_keys(argv)
+        if not self.first_key:
+            return []
+        last = self.last_key if self.last_key >= 0 else len(argv) + self.last_key
+        return list(range(self.first_key, min(last, len(argv) - 1) + 1, self.key_step))
+
+    def keys(self, argv: list) -> list:
+        return [argv[i] for i in self.key_positions(argv)]
+
+    def info(self) -> list:
+        """The COMMAND INFO reply for this command"""
+        return [self.name, self.arity, [SimpleString(flag) for flag in self.flags],
+                self.first_key, self.last_key, self.key_step]
+
+
+# Upper-cased name as sent (bytes) -> Command, filled in as handlers register
+COMMAND_TABLE = {}
@@ -0,0 +1,263 @@
+import asyncio
+import logging
+import os
+import time
+
+from app.data.datatypes import HashValue, ListValue, SetValue, StreamValue, format_score, format_stream_id
+from app.data.expiry import get_current_time, is_expired
+from app.resp.RESPCodec import Error, RESPDecoder, RESPEncoder
+
+logger = logging.getLogger(__name__)
+
+# How often the AOF cron flushes, reaps rewrite children and runs everysec
+AOF_CRON_PERIOD = 0.1
+# Bytes read per chunk while replaying the file at startup
+AOF_LOAD_CHUNK = 1024 * 1024
+# Elements per command when a rewrite rebuilds a collection
+AOF_REWRITE_ITEMS_PER_CMD = 64
+
+_RELATIVE_EXPIRY = {b"EX": 1000, b"PX": 1}
+
+
+def absolute_expiry_argv(argv: list) -> list:
+    """Rewrite SET ... EX/PX <ttl> to PXAT <deadline> so a replay later on
+    does not give keys a fresh TTL"""
+    name = argv[0].upper() if isinstance(argv[0], bytes) else argv[0].upper().encode()
+    if name != b"SET":
+        return argv
+    rewritten = list(argv)
+    for i in range(3, len(rewritten) - 1):
+        option = rewritten[i].upper() if isinstance(rewritten[i], bytes) else rewritten[i].upper().encode()
+        if option in _RELATIVE_EXPIRY:
+            deadline = int(get_current_time() + int(rewritten[i + 1]) * _RELATIVE_EXPIRY[option])
+            rewritten[i:i + 2] = [b"PXAT", str(deadline).encode()]
+            break
+    return rewritten
+
+
+class AppendOnlyFile:
+    """Write-ahead log of every write command, in RESP.
+
+    Commands are collected in a buffer and written out before replies are
+    sent. fsync runs on a worker thread: awaited before replying for
+    ``always``, once a second from the cron for ``everysec``, never for ``no``.
+    """
+
+    def __init__(self, path: str, config):
+        self.path = path
+        self.config = config
+        self.encoder = RESPEncoder()
+        self.buffer = bytearray()
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.size = os.fstat(self.fd).st_size
+        self._unsynced = False
+        self._last_fsync = time.monotonic()
+        self._fsync_in_progress = False
+        # While BGREWRITEAOF runs, commands are also kept here for the new file
+        self.rewrite_buffer = None
+        self.rewrite_child_pid = None
+        self.last_rewrite_status = "ok"
+
+    def feed(self, argv: list):
+        encoded = self.encoder.encode(absolute_expiry_argv(argv))
+        self.buffer += encoded
+        if self.rewrite_buffer is not None:
+            self.rewrite_buffer += encoded
+
+    def write(self):
+        """Write buffered commands to the file (no fsync)"""
+        if not self.buffer:
+            return
+        data = self.buffer
+        self.buffer = bytearray()
+        view = memoryview(data)
+        while view:
+            written = os.write(self.fd, view)
+            view = view[written:]
+        self.size += len(data)
+        self._unsynced = True
+
+    def fsync_due(self) -> bool:
+        """Whether written commands still need an fsync before replying"""
+        return self.config.appendfsync == "always" and self._unsynced
+
+    async def flush(self):
+        """Write pending commands; with appendfsync always, fsync them too"""
+        self.write()
+        if self.config.appendfsync == "always" and self._unsynced:
+            await self.fsync()
+
+    async def fsync(self):
+        self._unsynced = False
+        self._fsync_in_progress = True
+        try:
+            await asyncio.to_thread(os.fsync, self.fd)
+        finally:
+            self._fsync_in_progress = False
+            self._last_fsync = time.monotonic()
+
+    async def cron(self):
+        self.write()
+        if (self.config.appendfsync == "everysec" and self._unsynced
+                and not self._fsync_in_progress and time.monotonic() - self._last_fsync >= 1):
+            await self.fsync()
+
+    def start_rewrite(self, storage):
+        if self.rewrite_child_pid is not None:
+            raise Error("ERR Background append only file rewriting already in progress")
+        self.write()
+        self.rewrite_buffer = bytearray()
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                rewrite_aof(storage, self._temp_path(os.getpid()))
+            except BaseException as e:
+                logger.error("Background AOF rewrite failed: %s", e)
+                status = 1
+            os._exit(status)
+        self.rewrite_child_pid = pid
+
+    def check_rewrite(self):
+        """Reap a finished rewrite child and swap the new file in"""
+        if self.rewrite_child_pid is None:
+            return
+        pid, status = os.waitpid(self.rewrite_child_pid, os.WNOHANG)
+        if pid == 0:
+            return
+        self.rewrite_child_pid = None
+        temp_path = self._temp_path(pid)
+        tail, self.rewrite_buffer = self.rewrite_buffer, None
+        if os.waitstatus_to_exitcode(status) != 0:
+            self.last_rewrite_status = "err"
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            logger.warning("Background AOF rewrite error")
+            return
+        # Append what was written while the child ran, then swap files. No
+        # awaits happen in between, so no command can slip past both files.
+        self.write()
+        with open(temp_path, "ab") as f:
+            f.write(tail)
+        os.replace(temp_path, self.path)
+        old_fd = self.fd
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        self.size = os.fstat(self.fd).st_size
+        self._unsynced = True
+        os.close(old_fd)
+        self.last_rewrite_status = "ok"
+        logger.info("Background AOF rewrite finished successfully")
+
+    def _temp_path(self, pid: int) -> str:
+        return os.path.join(os.path.dirname(self.path) or ".", f"temp-rewriteaof-bg-{pid}.aof")
+
+    def info(self) -> str:
+        return (
+            f"aof_enabled:1\n"
+            f"aof_rewrite_in_progress:{int(self.rewrite_child_pid is not None)}\n"
+            f"aof_last_bgrewrite_status:{self.last_rewrite_status}\n"
+            f"aof_current_size:{self.size}\n"
+            f"aof_buffer_length:{len(self.buffer)}"
+        )
+
+
+def _stream_commands(key: bytes, stream: StreamValue):
+    if not len(stream):
+        # Added then trimmed away: creates the key with its last ID
+        yield [b"XADD", key, b"MAXLEN", b"0", format_stream_id(stream.last_id), b"x", b"y"]
+        return
+    for stream_id, pairs in stream.entries():
+        yield [b"XADD", key, format_stream_id(stream_id)] + pairs
+    yield [b"XSETID", key, format_stream_id(stream.last_id)]
+
+
+def _collection_commands(key: bytes, value):
+    """Commands rebuilding a collection, AOF_REWRITE_ITEMS_PER_CMD elements each"""
+    if isinstance(value, StreamValue):
+        yield from _stream_commands(key, value)
+        return
+    if isinstance(value, ListValue):
+        command, items = b"RPUSH", list(value)
+    elif isinstance(value, SetValue):
+        command, items = b"SADD", value.members()
+    elif isinstance(value, HashValue):
+        command, items = b"HSET", [item for pair in value.items() for item in pair]
+    else:
+        command, items = b"ZADD", [item for member, score in value.items() for item in (format_score(score), member)]
+    # Hashes and sorted sets take their elements as pairs
+    step = AOF_REWRITE_ITEMS_PER_CMD * (1 if command in (b"RPUSH", b"SADD") else 2)
+    for i in range(0, len(items), step):
+        yield [command, key] + items[i:i + step]
+
+
+def rewrite_aof(storage, path: str):
+    """Write the smallest command log that rebuilds the current keyspace"""
+    encoder = RESPEncoder()
+    now = get_current_time()
+    with open(path, "wb") as f:
+        chunk = bytearray()
+        for key, entry in storage.memory.items():
+            when = storage.expires.get(key)
+            if is_expired(when, now):
+                continue
+            value = entry.value
+            if isinstance(value, bytes):
+                argv = [b"SET", key, value]
+                if when is not None:
+                    argv += [b"PXAT", str(int(when)).encode()]
+                chunk += encoder.encode(argv)
+            else:
+                for argv in _collection_commands(key, value):
+                    chunk += encoder.encode(argv)
+                if when is not None:
+                    chunk += encoder.encode([b"PEXPIREAT", key, str(int(when)).encode()])
+            if len(chunk) >= 64 * 1024:
+                f.write(chunk)
+                chunk = bytearray()
+        f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def replay_aof(storage, path: str) -> int:
+    """Re-run every command in the AOF against storage; returns the count"""
+    from app.action import RedisAction
+
+    async def replay():
+        action = RedisAction(storage)
+        decoder = RESPDecoder()
+        count = 0
+        with open(path, "rb") as f:
+            while chunk := f.read(AOF_LOAD_CHUNK):
+                for command in decoder.decode_all(chunk):
+                    await action.handle_command(command)
+                    count += 1
+        if decoder.pending:
+            logger.warning("AOF %s ends with a truncated command, ignoring it", path)
+        return count
+
+    started = time.monotonic()
+    storage.loading = True
+    # Startup runs before the server's event loop exists, so use a private one
+    loop = asyncio.new_event_loop()
+    try:
+        count = loop.run_until_complete(replay())
+    finally:
+        loop.close()
+        storage.loading = False
+    logger.info("Replayed %d commands from AOF in %.3fs", count, time.monotonic() - started)
+    return count
+
+
+async def aof_cron(storage):
+    """Flush the AOF buffer, run everysec fsyncs and finish rewrites"""
+    while True:
+        await asyncio.sleep(AOF_CRON_PERIOD)
+        aof = storage.aof
+        if aof is None:
+            continue
+        try:
+            aof.check_rewrite()
+            await aof.cron()
+        except Exception:
+            logger.exception("AOF cron failed")
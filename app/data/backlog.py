@@ -0,0 +1,61 @@
+class ReplicationBacklog:
+    """Ring buffer holding the tail of the replication stream.
+
+    Offsets follow Redis: ``end`` is the replication offset of the last byte
+    fed and a replica asking for ``PSYNC <replid> <offset>`` wants everything
+    from byte ``offset`` on, so ``first_offset()`` .. ``end + 1`` can be served.
+    """
+
+    __slots__ = ("size", "buffer", "idx", "histlen", "end")
+
+    def __init__(self, size: int, offset: int):
+        self.size = size
+        self.buffer = bytearray(size)
+        # Next write position inside buffer
+        self.idx = 0
+        # Bytes of real history held, at most size
+        self.histlen = 0
+        self.end = offset
+
+    def feed(self, data: bytes):
+        n = len(data)
+        self.end += n
+        if n >= self.size:
+            self.buffer[:] = data[n - self.size:]
+            self.idx = 0
+            self.histlen = self.size
+            return
+        first = min(n, self.size - self.idx)
+        self.buffer[self.idx:self.idx + first] = data[:first]
+        if first < n:
+            self.buffer[:n - first] = data[first:]
+        self.idx = (self.idx + n) % self.size
+        self.histlen = min(self.histlen + n, self.size)
+
+    def first_offset(self) -> int:
+        return self.end - self.histlen + 1
+
+    def can_serve(self, offset: int) -> bool:
+        return self.first_offset() <= offset <= self.end + 1
+
+    def read_from(self, offset: int) -> bytes:
+        """Everything fed from replication offset `offset` on"""
+        length = self.end + 1 - offset
+        if not length:
+            return b""
+        start = (self.idx - length) % self.size
+        if start + length <= self.size:
+            return bytes(self.buffer[start:start + length])
+        return bytes(self.buffer[start:]) + bytes(self.buffer[:start + length - self.size])
+
+    def resize(self, size: int):
+        """Change capacity, keeping as much of the newest history as fits"""
+        if size == self.size:
+            return
+        keep = min(self.histlen, size)
+        tail = self.read_from(self.end + 1 - keep)
+        self.size = size
+        self.buffer = bytearray(size)
+        self.buffer[:keep] = tail
+        self.idx = keep % size
+        self.histlen = keep
@@ -0,0 +1,52 @@
+import asyncio
+
+
+class BlockingKeys:
+    """Clients blocked on keys, by BLPOP or XREAD BLOCK.
+
+    Each key maps to its waiters in arrival order, so signalling a key only
+    touches the clients blocked on that key and the longest waiting is
+    served first. A waiter is a future resolved with the key that woke it;
+    it stays registered on its other keys until ``unblock()``.
+    """
+
+    def __init__(self):
+        # key -> {future: None}, a dict as an ordered set
+        self.waiters = {}
+
+    def block(self, keys: list) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        for key in keys:
+            self.waiters.setdefault(key, {})[future] = None
+        return future
+
+    def unblock(self, keys: list, future: asyncio.Future):
+        for key in keys:
+            waiting = self.waiters.get(key)
+            if waiting is None:
+                continue
+            waiting.pop(future, None)
+            if not waiting:
+                del self.waiters[key]
+
+    def signal(self, key: bytes, count: int = None):
+        """Wake up to count clients blocked on key, oldest first, or all of
+        them if count is None"""
+        waiting = self.waiters.get(key)
+        if not waiting:
+            return
+        for future in list(waiting):
+            if count is not None and count <= 0:
+                break
+            del waiting[future]
+            # Already woken through another of its keys
+            if future.done():
+                continue
+            future.set_result(key)
+            if count is not None:
+                count -= 1
+        if not waiting:
+            del self.waiters[key]
+
+    def blocked_clients(self) -> int:
+        return len({future for waiting in self.waiters.values() for future in waiting})
@@ -0,0 +1,247 @@
+import logging
+
+from app.decorators.singleton import singleton
+
+_MEMORY_UNITS = {
+    "b": 1,
+    "k": 1000, "kb": 1024,
+    "m": 1000 ** 2, "mb": 1024 ** 2,
+    "g": 1000 ** 3, "gb": 1024 ** 3,
+}
+
+MAXMEMORY_POLICIES = ("noeviction", "allkeys-lru", "allkeys-lfu", "volatile-lru", "volatile-ttl")
+
+
+def parse_memory(value) -> int:
+    """Parse a redis.conf style size such as 100mb or 1gb into bytes"""
+    if isinstance(value, int):
+        size = value
+    else:
+        value = value.decode() if isinstance(value, bytes) else value
+        text = value.strip().lower()
+        digits = text.rstrip("kmgb")
+        unit = text[len(digits):] or "b"
+        if unit not in _MEMORY_UNITS:
+            raise ValueError(f"Invalid memory size: {value}")
+        size = int(digits) * _MEMORY_UNITS[unit]
+    if size < 0:
+        raise ValueError(f"Invalid memory size: {value}")
+    return size
+
+
+def parse_policy(value) -> str:
+    value = value.decode() if isinstance(value, bytes) else value
+    if value.lower() not in MAXMEMORY_POLICIES:
+        raise ValueError(f"Invalid maxmemory-policy: {value}")
+    return value.lower()
+
+
+def parse_save(value) -> str:
+    """Validate `save` as space separated <seconds> <changes> pairs"""
+    value = value.decode() if isinstance(value, bytes) else value
+    parts = value.split()
+    if len(parts) % 2 or not all(part.isdigit() for part in parts):
+        raise ValueError(f"Invalid save parameters: {value}")
+    return " ".join(parts)
+
+
+def parse_yes_no(value) -> str:
+    value = value.decode() if isinstance(value, bytes) else value
+    if value.lower() not in ("yes", "no"):
+        raise ValueError(f"Expected yes or no, got: {value}")
+    return value.lower()
+
+
+def parse_appendfsync(value) -> str:
+    value = value.decode() if isinstance(value, bytes) else value
+    if value.lower() not in ("always", "everysec", "no"):
+        raise ValueError(f"Invalid appendfsync: {value}")
+    return value.lower()
+
+
+OUTPUT_BUFFER_CLASSES = ("normal", "replica", "pubsub")
+
+
+def parse_output_buffer_limits(value) -> dict:
+    """Parse `<class> <hard> <soft> <soft seconds>` groups, redis.conf style"""
+    value = value.decode() if isinstance(value, bytes) else value
+    parts = value.split()
+    if not parts or len(parts) % 4:
+        raise ValueError(f"Invalid client-output-buffer-limit: {value}")
+    limits = {}
+    for i in range(0, len(parts), 4):
+        name = "replica" if parts[i].lower() == "slave" else parts[i].lower()
+        if name not in OUTPUT_BUFFER_CLASSES:
+            raise ValueError(f"Invalid client class: {parts[i]}")
+        limits[name] = (parse_memory(parts[i + 1]), parse_memory(parts[i + 2]), int(parts[i + 3]))
+    return limits
+
+
+def format_output_buffer_limits(limits: dict) -> str:
+    return " ".join(f"{name} {hard} {soft} {seconds}" for name, (hard, soft, seconds) in limits.items())
+
+
+def parse_diskless_load(value) -> str:
+    value = value.decode() if isinstance(value, bytes) else value
+    if value.lower() not in ("disabled", "swapdb"):
+        raise ValueError(f"Invalid repl-diskless-load: {value}")
+    return value.lower()
+
+
+# redis.conf loglevel -> level of the "app" logger. Per connection and per
+# command chatter logs at VERBOSE or DEBUG, so the default skips it.
+VERBOSE = 15
+logging.addLevelName(VERBOSE, "VERBOSE")
+LOGLEVELS = {
+    "debug": logging.DEBUG,
+    "verbose": VERBOSE,
+    "notice": logging.INFO,
+    "warning": logging.WARNING,
+    "nothing": logging.CRITICAL + 1,
+}
+
+
+def parse_loglevel(value) -> str:
+    value = value.decode() if isinstance(value, bytes) else value
+    if value.lower() not in LOGLEVELS:
+        raise ValueError(f"Invalid loglevel: {value}")
+    return value.lower()
+
+
+def apply_loglevel(value: str):
+    logging.getLogger("app").setLevel(LOGLEVELS[value])
+
+
+def parse_str(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def save_points(value: str) -> list[tuple[int, int]]:
+    parts = [int(part) for part in value.split()]
+    return list(zip(parts[::2], parts[1::2]))
+
+
+@singleton
+class ServerConfig:
+    """Runtime tunables, readable and writable through CONFIG GET/SET.
+
+    Names use the redis.conf spelling (``maxmemory-policy``); each one maps to
+    an attribute with dashes turned into underscores.
+    """
+
+    # name -> parser applied on CONFIG SET and on command line values
+    parsers = {
+        "maxmemory": parse_memory,
+        "maxmemory-policy": parse_policy,
+        "maxmemory-samples": int,
+        "save": parse_save,
+        "appendonly": parse_yes_no,
+        "appendfilename": parse_str,
+        "appendfsync": parse_appendfsync,
+        "repl-backlog-size": parse_memory,
+        "client-output-buffer-limit": parse_output_buffer_limits,
+        "repl-diskless-sync": parse_yes_no,
+        "repl-diskless-sync-delay": int,
+        "repl-diskless-load": parse_diskless_load,
+        "list-max-listpack-size": int,
+        "hash-max-listpack-entries": int,
+        "hash-max-listpack-value": int,
+        "set-max-intset-entries": int,
+        "set-max-listpack-entries": int,
+        "set-max-listpack-value": int,
+        "zset-max-listpack-entries": int,
+        "zset-max-listpack-value": int,
+        "stream-node-max-entries": int,
+        "stream-node-max-bytes": parse_memory,
+        "loglevel": parse_loglevel,
+        "slowlog-log-slower-than": int,
+        "slowlog-max-len": int,
+        "maxclients": int,
+        "timeout": int,
+    }
+    # name -> how CONFIG GET renders values that are not plain strings/ints
+    formatters = {
+        "client-output-buffer-limit": format_output_buffer_limits,
+    }
+    # name -> what to do with a value once set, when more than storing it
+    appliers = {
+        "loglevel": apply_loglevel,
+    }
+    # Only read when the server starts
+    startup_only = ("appendonly", "appendfilename")
+
+    def __init__(self, **overrides) -> None:
+        self.maxmemory = 0
+        self.maxmemory_policy = "noeviction"
+        self.maxmemory_samples = 5
+        self.save = "3600 1 300 100 60 10000"
+        self.appendonly = "no"
+        self.appendfilename = "appendonly.aof"
+        self.appendfsync = "everysec"
+        self.repl_backlog_size = 1024 * 1024
+        # Full syncs stream the snapshot straight to replicas that can take it;
+        # the delay lets replicas connecting together share one snapshot
+        self.repl_diskless_sync = "yes"
+        self.repl_diskless_sync_delay = 0
+        # How a replica loads a full sync: "disabled" empties the keyspace and
+        # answers -LOADING meanwhile, "swapdb" keeps serving the old keys
+        self.repl_diskless_load = "disabled"
+        # class -> (hard limit, soft limit, soft seconds); 0 disables a limit
+        self.client_output_buffer_limit = {
+            "normal": (0, 0, 0),
+            "replica": (256 * 1024 ** 2, 64 * 1024 ** 2, 60),
+            "pubsub": (32 * 1024 ** 2, 8 * 1024 ** 2, 60),
+        }
+        # Collections keep a compact encoding up to these sizes (entries, or
+        # bytes per element for *-value) and convert once past them, for good
+        self.list_max_listpack_size = 128
+        self.hash_max_listpack_entries = 128
+        self.hash_max_listpack_value = 64
+        self.set_max_intset_entries = 512
+        self.set_max_listpack_entries = 128
+        self.set_max_listpack_value = 64
+        self.zset_max_listpack_entries = 128
+        self.zset_max_listpack_value = 64
+        self.stream_node_max_entries = 100
+        self.stream_node_max_bytes = 4096
+        self.loglevel = "notice"
+        # Commands taking at least this many usec go to the slow log, whose
+        # oldest entries go past slowlog-max-len; negative disables it
+        self.slowlog_log_slower_than = 10000
+        self.slowlog_max_len = 128
+        # New connections past maxclients are refused; clients idle for
+        # timeout seconds are closed (0: never)
+        self.maxclients = 10000
+        self.timeout = 0
+        for name, value in overrides.items():
+            if value is not None:
+                self.set(name, value, startup=True)
+        for name, apply in self.appliers.items():
+            apply(getattr(self, name.replace("-", "_")))
+
+    def names(self) -> list[str]:
+        return list(self.parsers)
+
+    def get(self, name: str):
+        name = name.lower()
+        if name not in self.parsers:
+            return None
+        value = getattr(self, name.replace("-", "_"))
+        if name in self.formatters:
+            return self.formatters[name](value)
+        return value
+
+    def set(self, name: str, value, startup: bool = False) -> None:
+        name = name.lower().replace("_", "-")
+        if name not in self.parsers:
+            raise KeyError(name)
+        if name in self.startup_only and not startup:
+            raise ValueError(f"{name} can only be set at startup")
+        attr = name.replace("-", "_")
+        parsed = self.parsers[name](value)
+        if isinstance(parsed, dict):
+            # Setting some classes leaves the others as they were
+            parsed = {**getattr(self, attr), **parsed}
+        setattr(self, attr, parsed)
+        if name in self.appliers:
+            self.appliers[name](parsed)
@@ -0,0 +1,628 @@
+import bisect
+import math
+import sys
+from array import array
+from collections import deque
+from itertools import islice
+
+WRONGTYPE_ERROR = "WRONGTYPE Operation against a key holding the wrong kind of value"
+
+# Bookkeeping per element on top of the element objects themselves
+SLOT_SIZE = 8
+SCORE_SIZE = 24
+INTSET_SLOT_SIZE = 8
+
+_INT64_MIN = -(1 << 63)
+_INT64_MAX = (1 << 63) - 1
+
+
+def _item_size(item: bytes) -> int:
+    return sys.getsizeof(item) + SLOT_SIZE
+
+
+def _normalize_range(start: int, stop: int, length: int):
+    """Redis inclusive start/stop with negative indexes -> python slice bounds"""
+    if start < 0:
+        start = max(length + start, 0)
+    if stop < 0:
+        stop = length + stop
+    stop = min(stop, length - 1)
+    if start > stop or start >= length:
+        return 0, 0
+    return start, stop + 1
+
+
+class ListValue:
+    """A list: a plain Python list while small (listpack), a deque past
+    list-max-listpack-size entries (quicklist), with O(1) pushes and pops
+    at both ends."""
+
+    __slots__ = ("items", "nbytes")
+    type_name = "list"
+
+    def __init__(self, items=(), config=None):
+        self.items = list(items)
+        self.nbytes = sum(map(_item_size, self.items))
+        if config is not None:
+            self._maybe_convert(config)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def encoding(self) -> str:
+        return "listpack" if isinstance(self.items, list) else "quicklist"
+
+    def _maybe_convert(self, config):
+        if isinstance(self.items, list) and len(self.items) > config.list_max_listpack_size:
+            self.items = deque(self.items)
+
+    def push_left(self, values: list, config):
+        if isinstance(self.items, list) and len(self.items) + len(values) <= config.list_max_listpack_size:
+            self.items[0:0] = values[::-1]
+        else:
+            self.items = deque(self.items) if isinstance(self.items, list) else self.items
+            self.items.extendleft(values)
+        self.nbytes += sum(map(_item_size, values))
+
+    def push_right(self, values: list, config):
+        self.items.extend(values)
+        self.nbytes += sum(map(_item_size, values))
+        self._maybe_convert(config)
+
+    def pop_left(self, count: int = 1) -> list:
+        items = self.items
+        count = min(count, len(items))
+        if isinstance(items, list):
+            popped = items[:count]
+            del items[:count]
+        else:
+            popped = [items.popleft() for _ in range(count)]
+        self.nbytes -= sum(map(_item_size, popped))
+        return popped
+
+    def pop_right(self, count: int = 1) -> list:
+        items = self.items
+        count = min(count, len(items))
+        popped = [items.pop() for _ in range(count)]
+        self.nbytes -= sum(map(_item_size, popped))
+        return popped
+
+    def range(self, start: int, stop: int) -> list:
+        start, stop = _normalize_range(start, stop, len(self.items))
+        if isinstance(self.items, list):
+            return self.items[start:stop]
+        return list(islice(self.items, start, stop))
+
+    def index(self, i: int):
+        if i < 0:
+            i += len(self.items)
+        if 0 <= i < len(self.items):
+            return self.items[i]
+        return None
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+class HashValue:
+    """A hash: a flat [field, value, ...] list while small (listpack), a
+    dict once it has more than hash-max-listpack-entries fields or a field
+    or value longer than hash-max-listpack-value bytes (hashtable)."""
+
+    __slots__ = ("data", "nbytes")
+    type_name = "hash"
+
+    def __init__(self, pairs=None, config=None):
+        self.data = []
+        self.nbytes = 0
+        if pairs:
+            for field, value in pairs.items():
+                self.set(field, value, config)
+
+    def __len__(self):
+        data = self.data
+        return len(data) // 2 if isinstance(data, list) else len(data)
+
+    @property
+    def encoding(self) -> str:
+        return "listpack" if isinstance(self.data, list) else "hashtable"
+
+    def _find(self, field: bytes) -> int:
+        data = self.data
+        for i in range(0, len(data), 2):
+            if data[i] == field:
+                return i
+        return -1
+
+    def get(self, field: bytes):
+        data = self.data
+        if isinstance(data, dict):
+            return data.get(field)
+        i = self._find(field)
+        return data[i + 1] if i >= 0 else None
+
+    def set(self, field: bytes, value: bytes, config=None) -> int:
+        """Set a field; returns 1 if it is new"""
+        data = self.data
+        if isinstance(data, list) and config is not None and (
+                len(field) > config.hash_max_listpack_value
+                or len(value) > config.hash_max_listpack_value
+                or (len(data) // 2 >= config.hash_max_listpack_entries and self._find(field) < 0)):
+            data = self.data = dict(zip(data[::2], data[1::2]))
+        if isinstance(data, dict):
+            old = data.get(field)
+            data[field] = value
+        else:
+            i = self._find(field)
+            old = data[i + 1] if i >= 0 else None
+            if i >= 0:
+                data[i + 1] = value
+            else:
+                data += (field, value)
+        self.nbytes += _item_size(value)
+        if old is None:
+            self.nbytes += _item_size(field)
+            return 1
+        self.nbytes -= _item_size(old)
+        return 0
+
+    def delete(self, field: bytes) -> int:
+        data = self.data
+        if isinstance(data, dict):
+            value = data.pop(field, None)
+        else:
+            i = self._find(field)
+            value = data[i + 1] if i >= 0 else None
+            if i >= 0:
+                del data[i:i + 2]
+        if value is None:
+            return 0
+        self.nbytes -= _item_size(field) + _item_size(value)
+        return 1
+
+    def items(self):
+        data = self.data
+        if isinstance(data, dict):
+            return data.items()
+        return zip(data[::2], data[1::2])
+
+
+def _as_int64(member: bytes):
+    """member as an int if it is a canonical 64 bit integer string"""
+    if not member or len(member) > 20:
+        return None
+    try:
+        value = int(member)
+    except ValueError:
+        return None
+    if not _INT64_MIN <= value <= _INT64_MAX or b"%d" % value != member:
+        return None
+    return value
+
+
+class SetValue:
+    """A set: a sorted array of int64 while every member is an integer
+    (intset), a plain list while small (listpack), else a Python set
+    (hashtable)."""
+
+    __slots__ = ("data", "nbytes")
+    type_name = "set"
+
+    def __init__(self, members=(), config=None):
+        self.data = array("q")
+        self.nbytes = 0
+        if members:
+            self.add(list(members), config)
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def encoding(self) -> str:
+        data = self.data
+        if isinstance(data, array):
+            return "intset"
+        return "listpack" if isinstance(data, list) else "hashtable"
+
+    def _convert(self, to: str):
+        data = self.data
+        members = [b"%d" % n for n in data] if isinstance(data, array) else list(data)
+        self.nbytes = sum(map(_item_size, members))
+        self.data = members if to == "listpack" else set(members)
+
+    def add(self, members: list, config) -> int:
+        added = 0
+        for member in members:
+            data = self.data
+            if isinstance(data, array):
+                value = _as_int64(member)
+                if value is not None:
+                    i = bisect.bisect_left(data, value)
+                    if i < len(data) and data[i] == value:
+                        continue
+                    if config is None or len(data) < config.set_max_intset_entries:
+                        data.insert(i, value)
+                        self.nbytes += INTSET_SLOT_SIZE
+                        added += 1
+                        continue
+                    self._convert("hashtable")
+                else:
+                    fits = config is None or (len(data) < config.set_max_listpack_entries
+                                              and len(member) <= config.set_max_listpack_value)
+                    self._convert("listpack" if fits else "hashtable")
+            data = self.data
+            if isinstance(data, list):
+                if member in data:
+                    continue
+                if config is not None and (len(data) >= config.set_max_listpack_entries
+                                           or len(member) > config.set_max_listpack_value):
+                    self._convert("hashtable")
+                    data = self.data
+                else:
+                    data.append(member)
+                    self.nbytes += _item_size(member)
+                    added += 1
+                    continue
+            if member not in data:
+                data.add(member)
+                self.nbytes += _item_size(member)
+                added += 1
+        return added
+
+    def remove(self, members: list) -> int:
+        removed = 0
+        data = self.data
+        for member in members:
+            if isinstance(data, array):
+                value = _as_int64(member)
+                if value is None:
+                    continue
+                i = bisect.bisect_left(data, value)
+                if i < len(data) and data[i] == value:
+                    del data[i]
+                    self.nbytes -= INTSET_SLOT_SIZE
+                    removed += 1
+            elif member in data:
+                data.remove(member)
+                self.nbytes -= _item_size(member)
+                removed += 1
+        return removed
+
+    def __contains__(self, member: bytes) -> bool:
+        data = self.data
+        if isinstance(data, array):
+            value = _as_int64(member)
+            if value is None:
+                return False
+            i = bisect.bisect_left(data, value)
+            return i < len(data) and data[i] == value
+        return member in data
+
+    def members(self) -> list:
+        data = self.data
+        if isinstance(data, array):
+            return [b"%d" % n for n in data]
+        return list(data)
+
+
+def format_score(score: float) -> bytes:
+    if score.is_integer() and abs(score) < 1e17:
+        return b"%d" % score
+    if math.isinf(score):
+        return b"inf" if score > 0 else b"-inf"
+    return repr(score).encode()
+
+
+def parse_score(value: bytes) -> float:
+    try:
+        score = float(value)
+    except ValueError:
+        raise ValueError("value is not a valid float")
+    if math.isnan(score):
+        raise ValueError("value is not a valid float")
+    return score
+
+
+class ZSetValue:
+    """A sorted set kept as parallel ``scores``/``members`` lists ordered by
+    (score, member), so ranges are bisections and slices. Small sets search
+    members linearly (listpack); past zset-max-listpack-entries members or
+    zset-max-listpack-value bytes a member -> score dict is added for O(1)
+    lookups (the role of the skiplist's dict in Redis)."""
+
+    __slots__ = ("scores", "members", "index", "nbytes")
+    type_name = "zset"
+
+    def __init__(self, pairs=None, config=None):
+        self.scores = []
+        self.members = []
+        self.index = None
+        self.nbytes = 0
+        if pairs:
+            # Bulk loads sort once instead of inserting member by member
+            ordered = sorted((score, member) for member, score in pairs.items())
+            self.scores = [score for score, _ in ordered]
+            self.members = [member for _, member in ordered]
+            self.nbytes = sum(_item_size(member) + SCORE_SIZE for member in self.members)
+            if config is not None and (len(ordered) > config.zset_max_listpack_entries or any(
+                    len(member) > config.zset_max_listpack_value for member in self.members)):
+                self.index = dict(pairs)
+
+    def __len__(self):
+        return len(self.members)
+
+    @property
+    def encoding(self) -> str:
+        return "listpack" if self.index is None else "skiplist"
+
+    def score(self, member: bytes):
+        if self.index is not None:
+            return self.index.get(member)
+        try:
+            return self.scores[self.members.index(member)]
+        except ValueError:
+            return None
+
+    def _position(self, score: float, member: bytes) -> int:
+        """Insertion point of (score, member): bisect scores, then members"""
+        lo = bisect.bisect_left(self.scores, score)
+        hi = bisect.bisect_right(self.scores, score, lo)
+        return bisect.bisect_left(self.members, member, lo, hi)
+
+    def add(self, score: float, member: bytes, config=None) -> bool:
+        """Insert or move member; returns True if it was not there before"""
+        old = self.score(member)
+        if old is not None:
+            if old == score:
+                return False
+            self._delete_at(self._position(old, member))
+        i = self._position(score, member)
+        self.scores.insert(i, score)
+        self.members.insert(i, member)
+        if self.index is not None:
+            self.index[member] = score
+        elif config is not None and (len(self.members) > config.zset_max_listpack_entries
+                                     or len(member) > config.zset_max_listpack_value):
+            self.index = dict(zip(self.members, self.scores))
+        if old is None:
+            self.nbytes += _item_size(member) + SCORE_SIZE
+        return old is None
+
+    def _delete_at(self, i: int):
+        del self.scores[i]
+        del self.members[i]
+
+    def remove(self, member: bytes) -> bool:
+        score = self.score(member)
+        if score is None:
+            return False
+        self._delete_at(self._position(score, member))
+        if self.index is not None:
+            del self.index[member]
+        self.nbytes -= _item_size(member) + SCORE_SIZE
+        return True
+
+    def rank(self, member: bytes):
+        score = self.score(member)
+        if score is None:
+            return None
+        return self._position(score, member)
+
+    def range_by_rank(self, start: int, stop: int, reverse: bool = False) -> list:
+        length = len(self.members)
+        start, stop = _normalize_range(start, stop, length)
+        if reverse:
+            start, stop = length - stop, length - start
+            return list(zip(self.members[start:stop][::-1], self.scores[start:stop][::-1]))
+        return list(zip(self.members[start:stop], self.scores[start:stop]))
+
+    def range_by_score(self, low: float, low_exclusive: bool, high: float, high_exclusive: bool,
+                       offset: int = 0, count: int = -1) -> list:
+        scores = self.scores
+        start = (bisect.bisect_right if low_exclusive else bisect.bisect_left)(scores, low)
+        stop = (bisect.bisect_left if high_exclusive else bisect.bisect_right)(scores, high)
+        start += offset
+        if count >= 0:
+            stop = min(stop, start + count)
+        if start >= stop:
+            return []
+        return list(zip(self.members[start:stop], scores[start:stop]))
+
+    def items(self):
+        return zip(self.members, self.scores)
+
+
+
+# Per-entry flags, as in Redis stream listpacks
+STREAM_ITEM_FLAG_DELETED = 1
+STREAM_ITEM_FLAG_SAMEFIELDS = 2
+STREAM_ID_MAX = (1 << 64) - 1
+# Bookkeeping per stream entry: its two ID slots and flag byte
+STREAM_ENTRY_SIZE = 17
+
+
+def format_stream_id(stream_id: tuple) -> bytes:
+    return b"%d-%d" % stream_id
+
+
+def next_stream_id(stream_id: tuple):
+    """The smallest ID after stream_id, None past the last possible one"""
+    ms, seq = stream_id
+    if seq < STREAM_ID_MAX:
+        return ms, seq + 1
+    return (ms + 1, 0) if ms < STREAM_ID_MAX else None
+
+
+def previous_stream_id(stream_id: tuple):
+    ms, seq = stream_id
+    if seq > 0:
+        return ms, seq - 1
+    return (ms - 1, STREAM_ID_MAX) if ms > 0 else None
+
+
+def _stored_size(stored: tuple) -> int:
+    return sys.getsizeof(stored) + sum(map(_item_size, stored)) + STREAM_ENTRY_SIZE
+
+
+class StreamNode:
+    """A block of consecutive stream entries.
+
+    IDs live in two uint64 arrays that are bisected by (ms, seq); an entry
+    whose fields are the same as the node's first entry keeps only its
+    values, like the master entry of a Redis listpack node.
+    """
+
+    __slots__ = ("ms", "seq", "master_fields", "entries", "flags", "nbytes")
+
+    def __init__(self, master_fields: tuple):
+        self.ms = array("Q")
+        self.seq = array("Q")
+        self.master_fields = master_fields
+        self.entries = []
+        self.flags = bytearray()
+        self.nbytes = sys.getsizeof(master_fields) + sum(map(_item_size, master_fields))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def id_at(self, i: int) -> tuple:
+        return self.ms[i], self.seq[i]
+
+    def position(self, stream_id: tuple, after: bool = False) -> int:
+        """Index of the first entry >= stream_id (> stream_id if after)"""
+        ms, seq = stream_id
+        lo = bisect.bisect_left(self.ms, ms)
+        hi = bisect.bisect_right(self.ms, ms, lo)
+        return (bisect.bisect_right if after else bisect.bisect_left)(self.seq, seq, lo, hi)
+
+    def append(self, stream_id: tuple, pairs: list) -> int:
+        """Add an entry; returns the bytes it takes"""
+        self.ms.append(stream_id[0])
+        self.seq.append(stream_id[1])
+        if tuple(pairs[::2]) == self.master_fields:
+            self.flags.append(STREAM_ITEM_FLAG_SAMEFIELDS)
+            stored = tuple(pairs[1::2])
+        else:
+            self.flags.append(0)
+            stored = tuple(pairs)
+        self.entries.append(stored)
+        size = _stored_size(stored)
+        self.nbytes += size
+        return size
+
+    def pairs_at(self, i: int) -> list:
+        if self.flags[i] & STREAM_ITEM_FLAG_SAMEFIELDS:
+            return [item for pair in zip(self.master_fields, self.entries[i]) for item in pair]
+        return list(self.entries[i])
+
+    def drop_first(self, count: int) -> int:
+        """Remove the first count entries; returns the bytes freed"""
+        freed = sum(map(_stored_size, self.entries[:count]))
+        del self.ms[:count], self.seq[:count], self.entries[:count], self.flags[:count]
+        self.nbytes -= freed
+        return freed
+
+
+class StreamValue:
+    """An append-only log of (ID, field/value pairs) kept in StreamNode
+    blocks of up to stream-node-max-entries entries / stream-node-max-bytes.
+    The first ID of every node is indexed, so seeking is a bisection over
+    nodes and then inside one; MAXLEN ~ trimming drops whole nodes."""
+
+    __slots__ = ("nodes", "first_ids", "length", "last_id", "entries_added", "nbytes")
+    type_name = "stream"
+    encoding = "stream"
+
+    def __init__(self):
+        self.nodes = []
+        self.first_ids = []
+        self.length = 0
+        # Highest ID ever added; trimming does not lower it
+        self.last_id = (0, 0)
+        self.entries_added = 0
+        self.nbytes = 0
+
+    def __len__(self):
+        return self.length
+
+    def first_id(self):
+        return self.first_ids[0] if self.nodes else None
+
+    def add(self, stream_id: tuple, pairs: list, config):
+        """Append an entry; stream_id must be above last_id"""
+        node = self.nodes[-1] if self.nodes else None
+        if node is None or len(node) >= config.stream_node_max_entries \
+                or node.nbytes >= config.stream_node_max_bytes:
+            node = StreamNode(tuple(pairs[::2]))
+            self.nodes.append(node)
+            self.first_ids.append(stream_id)
+            self.nbytes += node.nbytes
+        self.nbytes += node.append(stream_id, pairs)
+        self.length += 1
+        self.last_id = stream_id
+        self.entries_added += 1
+
+    def trim(self, maxlen: int, approximate: bool = False) -> int:
+        """Drop the oldest entries beyond maxlen; approximate trimming only
+        drops whole nodes, so it may leave a few more"""
+        removed = 0
+        while self.nodes and self.length - len(self.nodes[0]) >= maxlen:
+            node = self.nodes[0]
+            del self.nodes[0], self.first_ids[0]
+            self.length -= len(node)
+            self.nbytes -= node.nbytes
+            removed += len(node)
+        if not approximate and self.length > maxlen:
+            count = self.length - maxlen
+            node = self.nodes[0]
+            self.nbytes -= node.drop_first(count)
+            self.first_ids[0] = node.id_at(0)
+            self.length -= count
+            removed += count
+        return removed
+
+    def range(self, start: tuple, end: tuple, count: int = 0, reverse: bool = False) -> list:
+        """[(id, pairs)] with start <= id <= end, newest first if reverse"""
+        result = []
+        nodes = self.nodes
+        if start > end or not nodes:
+            return result
+        if not reverse:
+            i = max(bisect.bisect_right(self.first_ids, start) - 1, 0)
+            j = nodes[i].position(start)
+            while i < len(nodes):
+                node = nodes[i]
+                while j < len(node):
+                    stream_id = node.id_at(j)
+                    if stream_id > end:
+                        return result
+                    result.append((stream_id, node.pairs_at(j)))
+                    if len(result) == count:
+                        return result
+                    j += 1
+                i, j = i + 1, 0
+            return result
+        i = bisect.bisect_right(self.first_ids, end) - 1
+        if i < 0:
+            return result
+        j = nodes[i].position(end, after=True) - 1
+        while i >= 0:
+            node = nodes[i]
+            while j >= 0:
+                stream_id = node.id_at(j)
+                if stream_id < start:
+                    return result
+                result.append((stream_id, node.pairs_at(j)))
+                if len(result) == count:
+                    return result
+                j -= 1
+            i -= 1
+            j = len(nodes[i]) - 1 if i >= 0 else -1
+        return result
+
+    def entries(self):
+        """Every (id, pairs), oldest first"""
+        for node in self.nodes:
+            for j in range(len(node)):
+                yield node.id_at(j), node.pairs_at(j)
@@ -0,0 +1,62 @@
+import math
+import random
+import time
+
+# Approximated LRU/LFU in the style of Redis: every entry carries one 24 bit
+# field. For LRU it is a seconds clock; for LFU the top 16 bits hold the last
+# decrement time in minutes and the low 8 bits a logarithmic access counter.
+LRU_CLOCK_MAX = (1 << 24) - 1
+LFU_INIT_VAL = 5
+LFU_LOG_FACTOR = 10
+LFU_DECAY_TIME = 1  # minutes per counter decrement
+
+# Best candidates found so far are kept between evictions, like EVPOOL_SIZE
+EVICTION_POOL_SIZE = 16
+
+
+def lru_clock() -> int:
+    return int(time.time()) & LRU_CLOCK_MAX
+
+
+def lru_idle_time(lru: int) -> int:
+    """Seconds since the entry was last touched, allowing for clock wrap"""
+    now = lru_clock()
+    if now >= lru:
+        return now - lru
+    return now + (LRU_CLOCK_MAX - lru)
+
+
+def lfu_time_in_minutes() -> int:
+    return (int(time.time()) // 60) & 0xFFFF
+
+
+def lfu_init() -> int:
+    return (lfu_time_in_minutes() << 8) | LFU_INIT_VAL
+
+
+def lfu_decayed_counter(lru: int) -> int:
+    """Counter after applying the decay owed since its last decrement"""
+    last = lru >> 8
+    counter = lru & 0xFF
+    now = lfu_time_in_minutes()
+    elapsed = now - last if now >= last else 0xFFFF - last + now
+    periods = elapsed // LFU_DECAY_TIME if LFU_DECAY_TIME else 0
+    return max(counter - periods, 0)
+
+
+def lfu_touch(lru: int) -> int:
+    counter = lfu_decayed_counter(lru)
+    if counter < 255:
+        base = max(counter - LFU_INIT_VAL, 0)
+        if random.random() < 1.0 / (base * LFU_LOG_FACTOR + 1):
+            counter += 1
+    return (lfu_time_in_minutes() << 8) | counter
+
+
+def eviction_score(policy: str, lru: int, when) -> float:
+    """Higher scores are better eviction candidates"""
+    if policy.endswith("-lfu"):
+        return 255 - lfu_decayed_counter(lru)
+    if policy == "volatile-ttl":
+        return -when if when is not None else -math.inf
+    return lru_idle_time(lru)
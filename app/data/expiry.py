@@ -1,13 +1,35 @@
+import asyncio
+import logging
 import time
 
-def check_expiry(data):
-    print(f"Checking expiry for... {data} with current time {get_current_time()} and expiry time {data[1]}")
-    if data[1] < 0:
-        return data[0]
-    elif data[1] >= get_current_time():
-        return data[0]
-    else:
-        return None
+logger = logging.getLogger(__name__)
+
+# Active expiration follows the shape of Redis' activeExpireCycle: run HZ
+# times a second, sample keys with a TTL, and keep going while a large share
+# of the sample turns out to be stale, within a per-cycle time budget.
+ACTIVE_EXPIRE_CYCLE_HZ = 10
+ACTIVE_EXPIRE_CYCLE_KEYS_PER_LOOP = 20
+ACTIVE_EXPIRE_CYCLE_ACCEPTABLE_STALE = 10  # percent of the sample
+ACTIVE_EXPIRE_CYCLE_TIME_PERC = 25  # percent of each 1/HZ period
+
+
+def is_expired(when, now=None) -> bool:
+    if when is None or when < 0:
+        return False
+    return when < (get_current_time() if now is None else now)
+
 
 def get_current_time():
-    return time.time() * 1000
\ No newline at end of file
+    return time.time() * 1000
+
+
+async def active_expire_cycle(storage):
+    """Background task that reclaims expired keys nobody reads again"""
+    period = 1 / ACTIVE_EXPIRE_CYCLE_HZ
+    time_limit_ms = 1000 * period * ACTIVE_EXPIRE_CYCLE_TIME_PERC / 100
+    while True:
+        await asyncio.sleep(period)
+        try:
+            storage.active_expire(time_limit_ms)
+        except Exception:
+            logger.exception("Active expire cycle failed")
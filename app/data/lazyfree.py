@@ -0,0 +1,94 @@
+"""Release big values a slice at a time from the event loop.
+
+CPython frees an object on whichever thread drops its last reference, and
+always under the GIL, so handing values to a thread only moves the work
+around. Instead UNLINK queues the collections inside a big value and the
+event loop empties them LAZYFREE_CHUNK elements per callback, serving other
+clients in between.
+"""
+import asyncio
+from array import array
+from collections import deque
+
+# Values whose free effort is above this are released in chunks
+LAZYFREE_THRESHOLD = 64
+# Elements released per event loop callback
+LAZYFREE_CHUNK = 1024
+
+# Collections still to be emptied, oldest first
+_pending = deque()
+_scheduled = False
+
+
+def free_effort(value) -> int:
+    """Roughly how many allocations releasing value touches"""
+    if isinstance(value, (bytes, bytearray, str, int, float)):
+        return 1
+    try:
+        return len(value)
+    except TypeError:
+        return 1
+
+
+def free_object(value):
+    """Release value, a slice per event loop callback if it is big.
+
+    Big values are emptied in place, so value must already be unreachable
+    from the keyspace.
+    """
+    if free_effort(value) <= LAZYFREE_THRESHOLD:
+        return
+    _pending.extend(_collections(value))
+    _schedule()
+
+
+def pending_objects() -> int:
+    return len(_pending)
+
+
+def _collections(value) -> list:
+    """The containers value keeps its elements in"""
+    found = []
+    for name in getattr(type(value), "__slots__", ()):
+        attr = getattr(value, name, None)
+        if isinstance(attr, (list, dict, set, deque, array, bytearray)):
+            found.append(attr)
+    return found
+
+
+def _schedule():
+    global _scheduled
+    if _scheduled:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # Outside the server loop (AOF replay at startup): free it all now
+        _pending.clear()
+        return
+    _scheduled = True
+    loop.call_soon(_release)
+
+
+def _release():
+    global _scheduled
+    _scheduled = False
+    budget = LAZYFREE_CHUNK
+    while _pending and budget:
+        container = _pending[0]
+        n = min(budget, len(container))
+        _remove_last(container, n)
+        budget -= n
+        if not container:
+            _pending.popleft()
+    if _pending:
+        _schedule()
+
+
+def _remove_last(container, n: int):
+    if isinstance(container, (dict, set, deque)):
+        pop = container.popitem if isinstance(container, dict) else container.pop
+        for _ in range(n):
+            pop()
+    elif n:
+        del container[len(container) - n:]
@@ -1,14 +1,117 @@
-import json
+import logging
 import os
-import struct
-from typing import Any
+import sys
+import time
 
-from app.data.expiry import check_expiry, get_current_time
+from app.data.blocking import BlockingKeys
+from app.data.datatypes import WRONGTYPE_ERROR
+from app.data.expiry import (
+    ACTIVE_EXPIRE_CYCLE_ACCEPTABLE_STALE,
+    ACTIVE_EXPIRE_CYCLE_KEYS_PER_LOOP,
+    get_current_time,
+    is_expired,
+)
+from app.data.aof import AppendOnlyFile, replay_aof, rewrite_aof
+from app.data.config import ServerConfig, save_points
+from app.data.eviction import (
+    EVICTION_POOL_SIZE,
+    eviction_score,
+    lfu_init,
+    lfu_touch,
+    lru_clock,
+)
+from app.data.lazyfree import free_object, pending_objects
 from app.data.metadata import ServerMetadata
+from app.data.pattern import compile_glob
+from app.data.rdb import RDBFormatError, fork_save_rdb, load_rdb, save_rdb
+from app.data.sampled_dict import SampledDict
+from app.resp.RESPCodec import Error
+
+logger = logging.getLogger(__name__)
+
+OOM_ERROR = "OOM command not allowed when used memory > 'maxmemory'."
+# Wait this long after a failed BGSAVE before a save point may retry
+BGSAVE_RETRY_DELAY = 5
+
+
+class Entry:
+    """A stored value plus its 24 bit LRU clock / LFU counter"""
+
+    __slots__ = ("value", "lru")
+
+    def __init__(self, value, lru: int):
+        self.value = value
+        self.lru = lru
+
+
+# Rough per-key bookkeeping cost: the Entry itself plus its slots in the
+# keyspace dict, the sampling list and the position map
+ENTRY_OVERHEAD = sys.getsizeof(Entry(None, 0)) + 96
+EXPIRE_OVERHEAD = 96
+
+
+def estimate_size(key: bytes, value) -> int:
+    # Collections track their own size as they change
+    value_size = sys.getsizeof(value) if isinstance(value, bytes) else sys.getsizeof(value) + value.nbytes
+    return sys.getsizeof(key) + value_size + ENTRY_OVERHEAD
+
+
+class StagedKeyspace:
+    """Keys loaded beside the live keyspace and swapped in once complete,
+    so readers keep seeing the old data until then"""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.memory = SampledDict()
+        self.expires = SampledDict()
+        self.used_memory = 0
+
+    def store_at(self, key: bytes, value, when: float):
+        if key in self.memory:
+            self.used_memory -= estimate_size(key, self.memory[key].value)
+        self.memory[key] = Entry(value, self.storage._new_lru())
+        self.used_memory += estimate_size(key, value)
+        if when > 0:
+            if key not in self.expires:
+                self.used_memory += EXPIRE_OVERHEAD
+            self.expires[key] = when
+
 
 class RedisStore:
-    def __init__(self, __dir: str, dbfilename: str, metadata: ServerMetadata):
-        self.memory = dict()
+    def __init__(self, __dir: str, dbfilename: str, metadata: ServerMetadata, config: ServerConfig = None):
+        self.config = config if config is not None else ServerConfig()
+        # key -> Entry; sampled for allkeys-* eviction
+        self.memory = SampledDict()
+        # TTLs live in their own index (key -> absolute expiry in ms), so keys
+        # without one cost nothing extra and the expire cycle can sample it
+        self.expires = SampledDict()
+        self.expired_keys = 0
+        self.evicted_keys = 0
+        # Reads that found / missed their key, for INFO stats
+        self.keyspace_hits = 0
+        self.keyspace_misses = 0
+        # Estimated bytes held by keys, values and their bookkeeping
+        self.used_memory = 0
+        self._eviction_pool = []
+        # Persistence bookkeeping: writes since the last successful save
+        self.dirty = 0
+        self.lastsave = int(time.time())
+        self.rdb_child_pid = None
+        self._dirty_before_bgsave = 0
+        self.last_bgsave_status = "ok"
+        self._last_bgsave_try = 0
+        # True while replaying the AOF: no eviction and no re-logging
+        self.loading = False
+        # The action layer's propagate(argv), set once it exists: keys the
+        # store deletes by itself (expired, evicted) reach the AOF and
+        # replicas as DELs
+        self.propagate = None
+        self.aof = None
+        # Clients waiting in BLPOP and friends
+        self.blocking = BlockingKeys()
+        # key -> [version, watchers], only for keys some client WATCHes, so
+        # a write to any other key costs a single dict lookup
+        self.watched_keys = {}
         self.dir = __dir
         self.dbfilename = dbfilename
         self.rdb_path = None
@@ -16,51 +119,27 @@ class RedisStore:
 
         if self.dir is not None and self.dbfilename is not None:
             self.rdb_path = os.path.join(self.dir, self.dbfilename)
-            if os.path.exists(self.rdb_path):
-                self._load_rdb(self.rdb_path)
-        print("memory stored in ", self.memory)
+
+        # With appendonly the AOF is the source of truth and wins over the RDB
+        aof_path = os.path.join(self.dir or ".", self.config.appendfilename)
+        aof_exists = self.config.appendonly == "yes" and os.path.exists(aof_path)
+        if aof_exists:
+            replay_aof(self, aof_path)
+        elif self.rdb_path is not None and os.path.exists(self.rdb_path):
+            self._load_rdb(self.rdb_path)
+        if self.config.appendonly == "yes":
+            if not aof_exists and self.memory:
+                # Seed a new AOF with what the RDB held so it survives restarts
+                rewrite_aof(self, aof_path)
+            self.aof = AppendOnlyFile(aof_path, self.config)
+        self.dirty = 0
+        logger.info("DB loaded: %d keys", len(self.memory))
 
     def _load_rdb(self, path):
-        with open(path, "rb") as f:
-            data = f.read()
-        pos = 0
-        # Check header
-        if data[:9] != b'REDIS0011':
-            print("Invalid RDB header")
-            return
-        pos = 9
-        expiry = -1
-        while pos < len(data):
-            b1 = data[pos]
-            if b1 == 0xFE:  # DB selector
-                pos += 2  # skip FE and db number (assume 1 byte db index)
-            elif b1 == 0xFB:  # Hash table size info
-                pos += 1
-                _, n = _decode_size(data, pos)
-                pos += n
-                _, n2 = _decode_size(data, pos)
-                pos += n2
-            elif b1 == 0xFC:  # Expiry in ms
-                pos += 1
-                expiry = struct.unpack('<Q', data[pos:pos+8])[0]
-                pos += 8
-            elif b1 == 0xFD:  # Expiry in s
-                pos += 1
-                expiry = struct.unpack('<I', data[pos:pos+4])[0] * 1000
-                pos += 4
-            elif b1 == 0xFF:  # End of file
-                break
-            elif b1 == 0x00:  # String type
-                pos += 1
-                key, n = _decode_string(data, pos)
-                pos += n
-                value, n = _decode_string(data, pos)
-                pos += n
-                self.memory[key] = (value, expiry)
-                expiry = -1  # reset expiry for next key
-            else:
-                # Unknown type, skip
-                pos += 1
+        try:
+            load_rdb(self, path)
+        except RDBFormatError as e:
+            logger.warning("Failed to load RDB %s: %s", path, e)
 
     def get_dir(self):
         return ["dir", self.dir]
@@ -70,55 +149,427 @@ class RedisStore:
 
     def get_metadata_str(self) -> str:
         return self.metadata.to_str()
-    
-    def store(self, key: str, value: Any, expiry: int):
-        if isinstance(self.memory, dict):
-            self.memory[key] = (value, get_current_time() + expiry if expiry > 0 else -1)
+
+    def get_memory_str(self) -> str:
+        maxmemory = self.config.maxmemory
+        return (
+            f"used_memory:{self.used_memory}\n"
+            f"used_memory_human:{_human_bytes(self.used_memory)}\n"
+            f"used_memory_rss:{_rss_bytes()}\n"
+            f"used_memory_rss_human:{_human_bytes(_rss_bytes())}\n"
+            f"maxmemory:{maxmemory}\n"
+            f"maxmemory_human:{_human_bytes(maxmemory)}\n"
+            f"maxmemory_policy:{self.config.maxmemory_policy}\n"
+            f"lazyfree_pending_objects:{pending_objects()}"
+        )
+
+    def get_persistence_str(self) -> str:
+        return (
+            f"rdb_changes_since_last_save:{self.dirty}\n"
+            f"rdb_bgsave_in_progress:{int(self.rdb_child_pid is not None)}\n"
+            f"rdb_last_save_time:{self.lastsave}\n"
+            f"rdb_last_bgsave_status:{self.last_bgsave_status}\n"
+            + (self.aof.info() if self.aof is not None else "aof_enabled:0")
+        )
+
+    def rdb_target(self) -> str:
+        """Where SAVE/BGSAVE write: the configured file, else ./dump.rdb"""
+        if self.rdb_path is not None:
+            return self.rdb_path
+        return os.path.join(self.dir or ".", self.dbfilename or "dump.rdb")
+
+    def save(self):
+        if self.rdb_child_pid is not None:
+            raise Error("ERR Background save already in progress")
+        save_rdb(self, self.rdb_target())
+        self.dirty = 0
+        self.lastsave = int(time.time())
+
+    def bgsave(self):
+        if self.rdb_child_pid is not None:
+            raise Error("ERR Background save already in progress")
+        self._dirty_before_bgsave = self.dirty
+        self._last_bgsave_try = time.time()
+        self.rdb_child_pid = fork_save_rdb(self, self.rdb_target())
+
+    def check_background_save(self):
+        """Reap a finished BGSAVE child without blocking"""
+        if self.rdb_child_pid is None:
+            return
+        pid, status = os.waitpid(self.rdb_child_pid, os.WNOHANG)
+        if pid == 0:
+            return
+        self.rdb_child_pid = None
+        if os.waitstatus_to_exitcode(status) == 0:
+            self.dirty -= self._dirty_before_bgsave
+            self.lastsave = int(time.time())
+            self.last_bgsave_status = "ok"
+            logger.info("Background saving terminated with success")
         else:
-            with open(self.memory, "w") as f:
-                f.write(json.dumps({key: (value, get_current_time() + expiry)}))
+            self.last_bgsave_status = "err"
+            logger.warning("Background saving error")
 
-    def fetch(self, key):
-        if isinstance(self.memory, dict):
-            if self.memory.get(key) is not None:
-                return check_expiry(self.memory.get(key))
-            else:
-                return None
+    def save_point_reached(self) -> bool:
+        # Automatic saves only apply when an RDB file was configured
+        if self.rdb_path is None or not self.dirty:
+            return False
+        now = time.time()
+        if self.last_bgsave_status != "ok" and now - self._last_bgsave_try < BGSAVE_RETRY_DELAY:
+            return False
+        for seconds, changes in save_points(self.config.save):
+            if self.dirty >= changes and now - self.lastsave >= seconds:
+                return True
+        return False
+
+    def bgrewriteaof(self):
+        if self.aof is None:
+            raise Error("ERR Append only file is not enabled")
+        self.aof.start_rewrite(self)
+
+    def flush(self):
+        """Drop every key"""
+        self.memory.clear()
+        self.expires.clear()
+        self.used_memory = 0
+        self._eviction_pool.clear()
+        self.dirty += 1
+        self._touch_all_watched()
+
+    def swap_keyspace(self, staged: StagedKeyspace):
+        """Replace all keys with a fully loaded StagedKeyspace"""
+        self.memory = staged.memory
+        self.expires = staged.expires
+        self.used_memory = staged.used_memory
+        self._eviction_pool.clear()
+        self.dirty += 1
+        self._touch_all_watched()
+
+    def watch_key(self, key: bytes) -> int:
+        """Start tracking writes to key; returns its current version"""
+        watch = self.watched_keys.get(key)
+        if watch is None:
+            watch = self.watched_keys[key] = [0, 0]
+        watch[1] += 1
+        return watch[0]
+
+    def unwatch_key(self, key: bytes):
+        watch = self.watched_keys.get(key)
+        if watch is None:
+            return
+        watch[1] -= 1
+        if not watch[1]:
+            del self.watched_keys[key]
+
+    def key_version(self, key: bytes) -> int:
+        """Bumped on every write to a watched key"""
+        watch = self.watched_keys.get(key)
+        return watch[0] if watch is not None else 0
+
+    def _touch_watched(self, key: bytes):
+        if self.watched_keys:
+            watch = self.watched_keys.get(key)
+            if watch is not None:
+                watch[0] += 1
+
+    def _touch_all_watched(self):
+        for watch in self.watched_keys.values():
+            watch[0] += 1
+
+    def memory_usage(self, key: bytes):
+        if self.expires and self.expire_if_needed(key):
+            return None
+        entry = self.memory.get(key)
+        if entry is None:
+            return None
+        return estimate_size(key, entry.value) + (EXPIRE_OVERHEAD if key in self.expires else 0)
+
+    def _reserve_memory(self):
+        """Evict ahead of a write that may grow memory, or refuse it"""
+        if not self.config.maxmemory or self.loading:
+            return
+        # Replicas ignore maxmemory (Redis's replica-ignore-maxmemory yes):
+        # the master evicts and its DELs keep the replica in step
+        if self.metadata.role != "master":
+            return
+        if not self.perform_evictions():
+            raise Error(OOM_ERROR)
+
+    def store(self, key: bytes, value: bytes, expiry: int, absolute: bool = False):
+        """Store from a command; expiry is a TTL in ms, or a deadline if absolute"""
+        self._reserve_memory()
+        if absolute:
+            when = expiry
         else:
-            with open(self.memory, "r") as f:
-                # TODO we are loading the whole RDB file for each get, that's not good
-                pair = json.loads(f.read())
-                print(f"Fetched from {self.memory} and got {pair}")
-            print(f"Found value {pair.get(key)} for key {key}")
-            return check_expiry(pair.get(key))
-
-    def fetch_all_keys(self):
-        if isinstance(self.memory, dict):
-            return list(self.memory.keys())
+            when = get_current_time() + expiry if expiry > 0 else -1
+        self.store_at(key, value, when)
+        self.dirty += 1
+
+    def store_at(self, key: bytes, value, when: float):
+        """Store a value with an absolute expiry in ms, or -1 for none"""
+        old = self.memory.get(key)
+        if old is not None:
+            self.used_memory -= estimate_size(key, old.value)
+        self._touch_watched(key)
+        self.memory[key] = Entry(value, self._new_lru())
+        self.used_memory += estimate_size(key, value)
+        if when > 0:
+            if key not in self.expires:
+                self.used_memory += EXPIRE_OVERHEAD
+            self.expires[key] = when
+        elif self.expires and self.expires.pop(key) is not None:
+            self.used_memory -= EXPIRE_OVERHEAD
+
+    def expire_at(self, key: bytes, when: int) -> bool:
+        """Give an existing key an absolute expiry in ms"""
+        if self._lookup(key) is None:
+            return False
+        if key not in self.expires:
+            self.used_memory += EXPIRE_OVERHEAD
+        self.expires[key] = when
+        self.dirty += 1
+        self._touch_watched(key)
+        return True
+
+    def fetch(self, key: bytes):
+        """A string value, None if missing; WRONGTYPE for other types"""
+        value = self.lookup(key)
+        if value is not None and not isinstance(value, bytes):
+            raise Error(WRONGTYPE_ERROR)
+        return value
+
+    def lookup(self, key: bytes, value_type=None):
+        """The live value at key, of any type unless value_type is given;
+        counted as a keyspace hit or miss"""
+        value = self._lookup(key, value_type)
+        if value is None:
+            self.keyspace_misses += 1
         else:
-            with open(self.memory, "r") as f:
-                # TODO we are loading the whole RDB file for each get, that's not good
-                pair = json.loads(f.read())
-                print(f"Fetched from {self.memory} and got {pair}")
-            return list(pair.keys())
-
-def _decode_size(data, pos):
-    b = data[pos]
-    type_ = (b & 0xC0) >> 6
-    if type_ == 0:
-        return b & 0x3F, 1
-    elif type_ == 1:
-        val = ((b & 0x3F) << 8) | data[pos+1]
-        return val, 2
-    elif type_ == 2:
-        val = int.from_bytes(data[pos+1:pos+5], 'big')
-        return val, 5
-    else:
-        # Not handling special string encodings for this stage
-        return 0, 1
-
-def _decode_string(data, pos):
-    strlen, n = _decode_size(data, pos)
-    pos += n
-    s = data[pos:pos+strlen].decode('utf-8')
-    return s, n + strlen
\ No newline at end of file
+            self.keyspace_hits += 1
+        return value
+
+    def _lookup(self, key: bytes, value_type=None):
+        if self.expires and self.expire_if_needed(key):
+            return None
+        entry = self.memory.get(key)
+        if entry is None:
+            return None
+        if value_type is not None and type(entry.value) is not value_type:
+            raise Error(WRONGTYPE_ERROR)
+        self._touch(entry)
+        return entry.value
+
+    def lookup_for_write(self, key: bytes, value_type, create: bool = True):
+        """(collection at key, its size before the write) for a command that
+        changes it in place; an empty one is added if missing and create is
+        set. Pair with ``written()`` once the change is made."""
+        if create:
+            self._reserve_memory()
+        value = self._lookup(key, value_type)
+        if value is None:
+            if not create:
+                return None, 0
+            value = value_type()
+            self.store_at(key, value, -1)
+        return value, value.nbytes
+
+    def written(self, key: bytes, value, nbytes_before: int):
+        """Account for an in-place change; a collection left empty is deleted"""
+        self.used_memory += value.nbytes - nbytes_before
+        self.dirty += 1
+        self._touch_watched(key)
+        # Streams stay when trimmed to nothing: they still hold their last ID
+        if not len(value) and value.type_name != "stream":
+            self._remove(key)
+
+    def _new_lru(self) -> int:
+        if self.config.maxmemory_policy.endswith("-lfu"):
+            return lfu_init()
+        return lru_clock()
+
+    def _touch(self, entry: Entry):
+        if self.config.maxmemory_policy.endswith("-lfu"):
+            entry.lru = lfu_touch(entry.lru)
+        else:
+            entry.lru = lru_clock()
+
+    def perform_evictions(self) -> bool:
+        """Evict keys until under maxmemory; False if that is not possible"""
+        maxmemory = self.config.maxmemory
+        if not maxmemory or self.used_memory <= maxmemory:
+            return True
+        if self.config.maxmemory_policy == "noeviction":
+            return False
+        while self.used_memory > maxmemory:
+            key = self._eviction_candidate()
+            if key is None:
+                return False
+            self.delete(key)
+            self.evicted_keys += 1
+            self._propagate_deletion(key)
+        return True
+
+    def _eviction_candidate(self):
+        """Sample keys into the eviction pool and pop its best live entry"""
+        policy = self.config.maxmemory_policy
+        volatile = policy.startswith("volatile-")
+        source = self.expires if volatile else self.memory
+        if not source:
+            return None
+        pool = self._eviction_pool
+        for key in source.sample(self.config.maxmemory_samples):
+            entry = self.memory.get(key)
+            if entry is None:
+                continue
+            score = eviction_score(policy, entry.lru, self.expires.get(key))
+            if len(pool) >= EVICTION_POOL_SIZE and score <= pool[0][0]:
+                continue
+            pool[:] = [item for item in pool if item[1] != key]
+            pool.append((score, key))
+            pool.sort(key=lambda item: item[0])
+            if len(pool) > EVICTION_POOL_SIZE:
+                del pool[0]
+        # Pool entries can be stale: the key may be gone or lost its TTL
+        while pool:
+            _, key = pool.pop()
+            if key in self.memory and (not volatile or key in self.expires):
+                return key
+        return None
+
+    def fetch_all_keys(self, pattern: bytes = b"*"):
+        """Every live key matching a glob pattern, for KEYS"""
+        match = compile_glob(pattern)
+        if self.expires:
+            # Expire lazily first, so the single pass below only sees live keys
+            now = get_current_time()
+            for key in [key for key, when in self.expires.items() if is_expired(when, now)]:
+                self._expire(key)
+        if match is None:
+            return list(self.memory.keys())
+        return [key for key in self.memory.keys() if match(key)]
+
+    def scan(self, cursor: int, count: int, pattern: bytes = None, type_name: str = None):
+        """One SCAN step: (next cursor, live keys among `count` visited slots)"""
+        cursor, keys = self.memory.scan(cursor, count)
+        match = compile_glob(pattern) if pattern is not None else None
+        result = []
+        for key in keys:
+            # Expiring reorders slots, but only within the part already visited
+            if self.expires and self.expire_if_needed(key):
+                continue
+            if match is not None and not match(key):
+                continue
+            if type_name is not None and self.type_of(key) != type_name:
+                continue
+            result.append(key)
+        return cursor, result
+
+    def type_of(self, key: bytes) -> str:
+        entry = self.memory.get(key)
+        if entry is None:
+            return "none"
+        return "string" if isinstance(entry.value, bytes) else entry.value.type_name
+
+    def delete(self, key: bytes) -> bool:
+        return self._remove(key) is not None
+
+    def unlink(self, key: bytes) -> bool:
+        """Delete key, releasing a big value in slices from the event loop"""
+        entry = self._remove(key)
+        if entry is None:
+            return False
+        free_object(entry.value)
+        return True
+
+    def _remove(self, key: bytes):
+        entry = self.memory.pop(key)
+        if entry is None:
+            return None
+        self.used_memory -= estimate_size(key, entry.value)
+        self.dirty += 1
+        self._touch_watched(key)
+        if self.expires.pop(key) is not None:
+            self.used_memory -= EXPIRE_OVERHEAD
+        return entry
+
+    def fetch_many(self, keys: list) -> list:
+        """String values for keys in one pass, None where missing or not a string"""
+        memory = self.memory
+        expires = self.expires
+        touch = self._touch
+        values = []
+        for key in keys:
+            if expires and self.expire_if_needed(key):
+                values.append(None)
+                continue
+            entry = memory.get(key)
+            if entry is None or not isinstance(entry.value, bytes):
+                values.append(None)
+            else:
+                touch(entry)
+                values.append(entry.value)
+        misses = values.count(None)
+        self.keyspace_misses += misses
+        self.keyspace_hits += len(values) - misses
+        return values
+
+    def count_existing(self, keys: list) -> int:
+        """How many of keys exist; repeated keys count each time"""
+        expires = self.expires
+        count = 0
+        for key in keys:
+            if expires and self.expire_if_needed(key):
+                continue
+            count += key in self.memory
+        self.keyspace_hits += count
+        self.keyspace_misses += len(keys) - count
+        return count
+
+    def expire_if_needed(self, key: bytes) -> bool:
+        """Lazily delete key if its TTL has passed; True if it was expired"""
+        if is_expired(self.expires.get(key)):
+            self._expire(key)
+            return True
+        return False
+
+    def _expire(self, key: bytes):
+        self.delete(key)
+        self.expired_keys += 1
+        self._propagate_deletion(key)
+
+    def _propagate_deletion(self, key: bytes):
+        if self.propagate is not None:
+            self.propagate([b"DEL", key])
+
+    def active_expire(self, time_limit_ms: float) -> int:
+        """Sample keys with a TTL and delete expired ones within time_limit_ms"""
+        start = get_current_time()
+        reclaimed = 0
+        while self.expires:
+            now = get_current_time()
+            sampled = self.expires.sample(ACTIVE_EXPIRE_CYCLE_KEYS_PER_LOOP)
+            expired = 0
+            for key in sampled:
+                if is_expired(self.expires.get(key), now):
+                    self._expire(key)
+                    expired += 1
+            reclaimed += expired
+            # Stop once the sample is mostly live keys or the budget is spent
+            if expired * 100 <= len(sampled) * ACTIVE_EXPIRE_CYCLE_ACCEPTABLE_STALE:
+                break
+            if get_current_time() - start > time_limit_ms:
+                break
+        return reclaimed
+
+def _human_bytes(n: int) -> str:
+    for unit in ("B", "K", "M", "G"):
+        if n < 1024 or unit == "G":
+            return f"{n}{unit}" if unit == "B" else f"{n:.2f}{unit}"
+        n /= 1024
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
@@ -1,3 +1,4 @@
+from app.data.backlog import ReplicationBacklog
 from app.decorators.singleton import singleton
 
 @singleton
@@ -6,8 +7,53 @@ class ServerMetadata:
         self.replicaof = replicaof
         self.role = "slave" if replicaof is not None else "master"
         self.master_replid = master_replid
+        # On a master: bytes fed to the replication stream. On a replica: bytes
+        # of that stream applied so far, reported back in REPLCONF ACK
         self.master_repl_offset = master_repl_offset
-        self.replica_writers = []
+        # ReplicaLink per replica, from its PSYNC until it disconnects
+        self.replicas = []
+        # writer -> what it told us with REPLCONF (listening-port, capa), until its PSYNC
+        self.replica_handshakes = {}
+        # FullSync that replicas asking for a full resync can still join
+        self.full_sync = None
+        # Created when the first replica syncs, like Redis
+        self.backlog = None
+        # Replica side: set once a full sync gave us a replid/offset to resume from
+        self.master_synced = False
+        self.master_link_status = "down"
+        # ClusterLayout when running as one worker of a sharded server
+        self.cluster = None
+
+    def create_backlog(self, size: int) -> ReplicationBacklog:
+        if self.backlog is None:
+            self.backlog = ReplicationBacklog(size, self.master_repl_offset)
+        else:
+            self.backlog.resize(size)
+        return self.backlog
+
+    def feed_replication_stream(self, data: bytes):
+        """Account for bytes sent to replicas and keep them in the backlog"""
+        if self.backlog is None:
+            return
+        self.backlog.feed(data)
+        self.master_repl_offset += len(data)
 
     def to_str(self) -> str:
-        return f"role:{self.role}\nmaster_replid:{self.master_replid}\nmaster_repl_offset:{self.master_repl_offset}"
+        lines = [f"role:{self.role}"]
+        if self.role == "slave":
+            host, port = self.replicaof.split(" ")
+            lines += [f"master_host:{host}", f"master_port:{port}", f"master_link_status:{self.master_link_status}"]
+        else:
+            lines.append(f"connected_slaves:{len(self.replicas)}")
+            for i, link in enumerate(self.replicas):
+                lines.append(f"slave{i}:{link.info(self.master_repl_offset)}")
+        lines += [f"master_replid:{self.master_replid}", f"master_repl_offset:{self.master_repl_offset}"]
+        backlog = self.backlog
+        lines.append(f"repl_backlog_active:{int(backlog is not None)}")
+        if backlog is not None:
+            lines += [
+                f"repl_backlog_size:{backlog.size}",
+                f"repl_backlog_first_byte_offset:{backlog.first_offset()}",
+                f"repl_backlog_histlen:{backlog.histlen}",
+            ]
+        return "\n".join(lines)
@@ -0,0 +1,82 @@
+import re
+from functools import lru_cache
+
+_SPECIAL = frozenset(b"*?[\\")
+
+
+@lru_cache(maxsize=256)
+def compile_glob(pattern: bytes):
+    """Compile a Redis glob into a predicate over bytes.
+
+    Supports ``*``, ``?``, ``[abc]``, ``[^abc]``, ``[a-z]`` and ``\\``
+    escapes, like stringmatchlen(). Returns None for ``*`` so callers can
+    skip matching altogether.
+    """
+    if pattern.strip(b"*") == b"" and pattern:
+        return None
+    if not _SPECIAL.intersection(pattern):
+        return pattern.__eq__
+    return re.compile(_translate(pattern), re.DOTALL).fullmatch
+
+
+def literal_prefix(pattern: bytes) -> bytes:
+    """The part of a glob before its first special character"""
+    for i, c in enumerate(pattern):
+        if c in _SPECIAL:
+            return pattern[:i]
+    return pattern
+
+
+def _translate(pattern: bytes) -> bytes:
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i:i + 1]
+        i += 1
+        if c == b"*":
+            while i < n and pattern[i:i + 1] == b"*":
+                i += 1
+            out.append(b".*")
+        elif c == b"?":
+            out.append(b".")
+        elif c == b"\\" and i < n:
+            out.append(re.escape(pattern[i:i + 1]))
+            i += 1
+        elif c == b"[":
+            end, group = _translate_class(pattern, i)
+            if group is None:
+                # No closing bracket: match it literally
+                out.append(re.escape(c))
+            else:
+                out.append(group)
+                i = end
+        else:
+            out.append(re.escape(c))
+    return b"".join(out)
+
+
+def _translate_class(pattern: bytes, i: int):
+    """Translate the [...] starting after '[' at i; returns (end, regex)"""
+    n = len(pattern)
+    negate = i < n and pattern[i:i + 1] == b"^"
+    if negate:
+        i += 1
+    items = []
+    while i < n and pattern[i:i + 1] != b"]":
+        c = pattern[i:i + 1]
+        if c == b"\\" and i + 1 < n:
+            c = pattern[i + 1:i + 2]
+            i += 1
+        if pattern[i + 1:i + 2] == b"-" and i + 2 < n and pattern[i + 2:i + 3] != b"]":
+            low, high = sorted((c, pattern[i + 2:i + 3]))
+            items.append(re.escape(low) + b"-" + re.escape(high))
+            i += 3
+        else:
+            items.append(re.escape(c))
+            i += 1
+    if i >= n:
+        return i, None
+    if not items:
+        # [] matches nothing, [^] anything
+        return i + 1, b"(?s:.)" if negate else b"(?!)"
+    return i + 1, b"[" + (b"^" if negate else b"") + b"".join(items) + b"]"
@@ -0,0 +1,1019 @@
+import asyncio
+import functools
+import logging
+import mmap
+import os
+import struct
+import time
+
+from app.data.datatypes import (
+    STREAM_ITEM_FLAG_DELETED,
+    STREAM_ITEM_FLAG_SAMEFIELDS,
+    HashValue,
+    ListValue,
+    SetValue,
+    StreamValue,
+    ZSetValue,
+)
+from app.data.expiry import get_current_time, is_expired
+
+logger = logging.getLogger(__name__)
+
+RDB_VERSION = 11
+
+# Oldest and newest format versions the loader accepts
+RDB_MIN_VERSION = 1
+RDB_MAX_VERSION = 12
+
+# Opcodes
+RDB_OPCODE_SLOT_INFO = 0xF4
+RDB_OPCODE_MODULE_AUX = 0xF5
+RDB_OPCODE_FUNCTION2 = 0xF6
+RDB_OPCODE_FUNCTION_PRE_GA = 0xF7
+RDB_OPCODE_IDLE = 0xF8
+RDB_OPCODE_FREQ = 0xF9
+RDB_OPCODE_AUX = 0xFA
+RDB_OPCODE_RESIZEDB = 0xFB
+RDB_OPCODE_EXPIRETIME_MS = 0xFC
+RDB_OPCODE_EXPIRETIME = 0xFD
+RDB_OPCODE_SELECTDB = 0xFE
+RDB_OPCODE_EOF = 0xFF
+
+# Value types
+RDB_TYPE_STRING = 0
+RDB_TYPE_LIST = 1
+RDB_TYPE_SET = 2
+RDB_TYPE_ZSET = 3
+RDB_TYPE_HASH = 4
+RDB_TYPE_ZSET_2 = 5
+RDB_TYPE_HASH_ZIPMAP = 9
+RDB_TYPE_LIST_ZIPLIST = 10
+RDB_TYPE_SET_INTSET = 11
+RDB_TYPE_ZSET_ZIPLIST = 12
+RDB_TYPE_HASH_ZIPLIST = 13
+RDB_TYPE_LIST_QUICKLIST = 14
+RDB_TYPE_STREAM_LISTPACKS = 15
+RDB_TYPE_HASH_LISTPACK = 16
+RDB_TYPE_ZSET_LISTPACK = 17
+RDB_TYPE_LIST_QUICKLIST_2 = 18
+RDB_TYPE_STREAM_LISTPACKS_2 = 19
+RDB_TYPE_SET_LISTPACK = 20
+RDB_TYPE_STREAM_LISTPACKS_3 = 21
+
+# Special string encodings flagged by the top two bits of a length
+RDB_ENC_INT8 = 0
+RDB_ENC_INT16 = 1
+RDB_ENC_INT32 = 2
+RDB_ENC_LZF = 3
+
+# Quicklist 2 node containers
+QUICKLIST_NODE_CONTAINER_PLAIN = 1
+
+# Report load progress at most this often (seconds), checked every N records
+RDB_LOAD_PROGRESS_INTERVAL = 1.0
+RDB_LOAD_PROGRESS_RECORDS = 1024
+
+# How often the save cron looks at children and save points
+RDB_CRON_PERIOD = 0.1
+
+
+def encode_length(n: int) -> bytes:
+    """Length prefix in the 6, 14, 32 or 64 bit form"""
+    if n < 1 << 6:
+        return bytes((n,))
+    if n < 1 << 14:
+        return bytes((0x40 | (n >> 8), n & 0xFF))
+    if n < 1 << 32:
+        return b'\x80' + n.to_bytes(4, 'big')
+    return b'\x81' + n.to_bytes(8, 'big')
+
+
+def encode_string(value: bytes) -> bytes:
+    return encode_length(len(value)) + value
+
+
+class RDBWriter:
+    """Streams an RDB file to a binary file object in bounded chunks.
+
+    Records are appended to a small buffer that is flushed to the file each
+    time it grows past chunk_size, so memory use does not depend on the size
+    of the keyspace.
+    """
+
+    def __init__(self, fileobj, chunk_size: int = 64 * 1024):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.written = 0
+
+    def _emit(self, data: bytes):
+        self.buffer += data
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.fileobj.write(self.buffer)
+            self.written += len(self.buffer)
+            self.buffer = bytearray()
+
+    def write_header(self):
+        self._emit(b'REDIS%04d' % RDB_VERSION)
+
+    def write_aux(self, name: str, value: str):
+        self._emit(bytes((RDB_OPCODE_AUX,)) + encode_string(name.encode()) + encode_string(value.encode()))
+
+    def write_select_db(self, db: int, size: int, expires: int):
+        self._emit(bytes((RDB_OPCODE_SELECTDB,)) + encode_length(db))
+        self._emit(bytes((RDB_OPCODE_RESIZEDB,)) + encode_length(size) + encode_length(expires))
+
+    def write_entry(self, key: bytes, value, when=None):
+        if when is not None and when > 0:
+            self._emit(bytes((RDB_OPCODE_EXPIRETIME_MS,)) + struct.pack('<Q', int(when)))
+        if isinstance(value, bytes):
+            self._emit(bytes((RDB_TYPE_STRING,)) + encode_string(key) + encode_string(value))
+            return
+        if isinstance(value, StreamValue):
+            self._write_stream(key, value)
+            return
+        # Collections use the plain (not listpack) encodings, one element at a
+        # time, so a big value never has to be serialized in one piece
+        if isinstance(value, ListValue):
+            rdb_type, items = RDB_TYPE_LIST, iter(value)
+        elif isinstance(value, SetValue):
+            rdb_type, items = RDB_TYPE_SET, value.members()
+        elif isinstance(value, HashValue):
+            rdb_type, items = RDB_TYPE_HASH, (encode_string(f) + encode_string(v) for f, v in value.items())
+        else:
+            rdb_type, items = RDB_TYPE_ZSET_2, (encode_string(m) + struct.pack('<d', s) for m, s in value.items())
+        self._emit(bytes((rdb_type,)) + encode_string(key) + encode_length(len(value)))
+        for item in items:
+            self._emit(encode_string(item) if rdb_type in (RDB_TYPE_LIST, RDB_TYPE_SET) else item)
+
+    def _write_stream(self, key: bytes, stream: StreamValue):
+        """One listpack per node, laid out as Redis does: a master entry with
+        the node's fields, then each entry as flags and ID deltas followed by
+        its values (or its own fields and values), then its element count"""
+        self._emit(bytes((RDB_TYPE_STREAM_LISTPACKS,)) + encode_string(key) + encode_length(len(stream.nodes)))
+        for node in stream.nodes:
+            master_ms, master_seq = node.id_at(0)
+            fields = node.master_fields
+            items = [len(node), 0, len(fields), *fields, 0]
+            for i in range(len(node)):
+                ms, seq = node.id_at(i)
+                flags = node.flags[i]
+                items += (flags, ms - master_ms, seq - master_seq)
+                stored = node.entries[i]
+                if flags & STREAM_ITEM_FLAG_SAMEFIELDS:
+                    items += stored
+                    items.append(len(stored) + 3)
+                else:
+                    items.append(len(stored) // 2)
+                    items += stored
+                    items.append(len(stored) + 4)
+            master_id = master_ms.to_bytes(8, 'big') + master_seq.to_bytes(8, 'big')
+            self._emit(encode_string(master_id) + encode_string(encode_listpack(items)))
+        last_ms, last_seq = stream.last_id
+        # No consumer groups
+        self._emit(encode_length(len(stream)) + encode_length(last_ms) + encode_length(last_seq) + encode_length(0))
+
+    def write_footer(self):
+        # A zero checksum tells loaders that checksumming is disabled
+        self._emit(bytes((RDB_OPCODE_EOF,)) + b'\x00' * 8)
+        self.flush()
+
+
+def write_snapshot(storage, fileobj, chunk_size: int = 64 * 1024) -> int:
+    """Write the whole keyspace as RDB to fileobj, returning bytes written"""
+    writer = RDBWriter(fileobj, chunk_size)
+    writer.write_header()
+    writer.write_aux("redis-ver", "7.2.0")
+    writer.write_aux("redis-bits", "64")
+    writer.write_aux("ctime", str(int(time.time())))
+    writer.write_aux("used-mem", str(storage.used_memory))
+    if storage.memory:
+        writer.write_select_db(0, len(storage.memory), len(storage.expires))
+        now = get_current_time()
+        expires = storage.expires
+        for key, entry in storage.memory.items():
+            when = expires.get(key)
+            if is_expired(when, now):
+                continue
+            writer.write_entry(key, entry.value, when)
+    writer.write_footer()
+    return writer.written
+
+
+def save_rdb(storage, path: str) -> int:
+    """Write a snapshot to a temp file next to path, then atomically rename"""
+    directory = os.path.dirname(path) or "."
+    temp_path = os.path.join(directory, f"temp-{os.getpid()}.rdb")
+    try:
+        with open(temp_path, "wb") as f:
+            written = write_snapshot(storage, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    return written
+
+
+def fork_save_rdb(storage, path: str) -> int:
+    """Fork a child that writes the snapshot from its copy-on-write memory"""
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            save_rdb(storage, path)
+        except BaseException as e:
+            logger.error("Background save failed: %s", e)
+            status = 1
+        # Skip interpreter teardown: the parent owns the event loop and files
+        os._exit(status)
+    return pid
+
+
+def fork_write_rdb_pipe(storage) -> tuple[int, int]:
+    """Fork a child that streams the snapshot into a pipe.
+
+    Returns the child's pid and the read end of the pipe, which reaches EOF
+    when the child is done; its exit status tells whether the RDB is whole.
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        status = 0
+        try:
+            with os.fdopen(write_fd, "wb") as f:
+                write_snapshot(storage, f)
+        except BaseException as e:
+            logger.error("Diskless snapshot failed: %s", e)
+            status = 1
+        os._exit(status)
+    os.close(write_fd)
+    return pid, read_fd
+
+
+async def rdb_save_cron(storage):
+    """Reap finished BGSAVE children and fire `save <seconds> <changes>` points"""
+    while True:
+        await asyncio.sleep(RDB_CRON_PERIOD)
+        try:
+            storage.check_background_save()
+            if storage.rdb_child_pid is None and storage.save_point_reached():
+                logger.info("Save point reached, starting background save")
+                storage.bgsave()
+        except Exception:
+            logger.exception("RDB save cron failed")
+
+
+class Incomplete(Exception):
+    """The buffer ends in the middle of a record.
+
+    ``needed`` is the buffer length the failed read asked for; ``resume_at``
+    is set when parsing can pick up again past the start of the record.
+    """
+
+    def __init__(self, needed: int = 0):
+        super().__init__(needed)
+        self.needed = needed
+        self.resume_at = None
+
+
+class RDBFormatError(Exception):
+    """The data is not a valid or supported RDB file."""
+    pass
+
+
+# What decoding corrupt or truncated data runs into, reported as RDBFormatError
+_DECODE_ERRORS = (IndexError, ValueError, OverflowError, struct.error)
+
+
+def _need(data, pos: int, n: int):
+    if pos + n > len(data):
+        raise Incomplete(pos + n)
+
+
+def read_length(data, pos: int) -> tuple[int, bool, int]:
+    """Decode a length; returns (value, is_special_encoding, new_pos)"""
+    _need(data, pos, 1)
+    b = data[pos]
+    kind = b >> 6
+    if kind == 0:
+        return b & 0x3F, False, pos + 1
+    if kind == 1:
+        _need(data, pos, 2)
+        return ((b & 0x3F) << 8) | data[pos + 1], False, pos + 2
+    if kind == 3:
+        return b & 0x3F, True, pos + 1
+    if b == 0x80:
+        _need(data, pos, 5)
+        return int.from_bytes(data[pos + 1:pos + 5], 'big'), False, pos + 5
+    if b == 0x81:
+        _need(data, pos, 9)
+        return int.from_bytes(data[pos + 1:pos + 9], 'big'), False, pos + 9
+    raise RDBFormatError(f"Unknown length encoding 0x{b:02x}")
+
+
+def read_plain_length(data, pos: int) -> tuple[int, int]:
+    value, special, pos = read_length(data, pos)
+    if special:
+        raise RDBFormatError("Unexpected string encoding where a length was expected")
+    return value, pos
+
+
+def read_string(data, pos: int) -> tuple[bytes, int]:
+    length, special, pos = read_length(data, pos)
+    if not special:
+        _need(data, pos, length)
+        return bytes(data[pos:pos + length]), pos + length
+    if length == RDB_ENC_INT8:
+        _need(data, pos, 1)
+        return str(int.from_bytes(data[pos:pos + 1], 'little', signed=True)).encode(), pos + 1
+    if length == RDB_ENC_INT16:
+        _need(data, pos, 2)
+        return str(int.from_bytes(data[pos:pos + 2], 'little', signed=True)).encode(), pos + 2
+    if length == RDB_ENC_INT32:
+        _need(data, pos, 4)
+        return str(int.from_bytes(data[pos:pos + 4], 'little', signed=True)).encode(), pos + 4
+    if length == RDB_ENC_LZF:
+        compressed_len, pos = read_plain_length(data, pos)
+        raw_len, pos = read_plain_length(data, pos)
+        _need(data, pos, compressed_len)
+        return lzf_decompress(data[pos:pos + compressed_len], raw_len), pos + compressed_len
+    raise RDBFormatError(f"Unknown string encoding {length}")
+
+
+def read_double(data, pos: int) -> tuple[float, int]:
+    """Old-style ZSET score: a length byte followed by the ASCII number"""
+    _need(data, pos, 1)
+    length = data[pos]
+    if length == 253:
+        return float("nan"), pos + 1
+    if length == 254:
+        return float("inf"), pos + 1
+    if length == 255:
+        return float("-inf"), pos + 1
+    _need(data, pos + 1, length)
+    return float(bytes(data[pos + 1:pos + 1 + length])), pos + 1 + length
+
+
+def read_binary_double(data, pos: int) -> tuple[float, int]:
+    _need(data, pos, 8)
+    return struct.unpack('<d', data[pos:pos + 8])[0], pos + 8
+
+
+def lzf_decompress(data, expected_len: int) -> bytes:
+    out = bytearray()
+    i = 0
+    n = len(data)
+    while i < n:
+        ctrl = data[i]
+        i += 1
+        if ctrl < 32:
+            # Literal run of ctrl + 1 bytes
+            out += data[i:i + ctrl + 1]
+            i += ctrl + 1
+            continue
+        length = ctrl >> 5
+        if length == 7:
+            length += data[i]
+            i += 1
+        ref = len(out) - ((ctrl & 0x1F) << 8) - data[i] - 1
+        i += 1
+        length += 2
+        if ref < 0:
+            raise RDBFormatError("Invalid LZF back reference")
+        if ref + length <= len(out):
+            out += out[ref:ref + length]
+        else:
+            # Overlapping copy repeats the bytes it is still producing
+            for j in range(length):
+                out.append(out[ref + j])
+    if len(out) != expected_len:
+        raise RDBFormatError("LZF decompressed length mismatch")
+    return bytes(out)
+
+
+def _int_bytes(value: int) -> bytes:
+    return str(value).encode()
+
+
+def parse_ziplist(blob: bytes) -> list[bytes]:
+    entries = []
+    pos = 10  # zlbytes, zltail, zllen
+    while blob[pos] != 0xFF:
+        pos += 5 if blob[pos] == 0xFE else 1  # prevlen
+        enc = blob[pos]
+        kind = enc >> 6
+        if kind == 0:
+            length = enc & 0x3F
+            entries.append(blob[pos + 1:pos + 1 + length])
+            pos += 1 + length
+        elif kind == 1:
+            length = ((enc & 0x3F) << 8) | blob[pos + 1]
+            entries.append(blob[pos + 2:pos + 2 + length])
+            pos += 2 + length
+        elif kind == 2:
+            length = int.from_bytes(blob[pos + 1:pos + 5], 'big')
+            entries.append(blob[pos + 5:pos + 5 + length])
+            pos += 5 + length
+        elif enc == 0xC0:
+            entries.append(_int_bytes(int.from_bytes(blob[pos + 1:pos + 3], 'little', signed=True)))
+            pos += 3
+        elif enc == 0xD0:
+            entries.append(_int_bytes(int.from_bytes(blob[pos + 1:pos + 5], 'little', signed=True)))
+            pos += 5
+        elif enc == 0xE0:
+            entries.append(_int_bytes(int.from_bytes(blob[pos + 1:pos + 9], 'little', signed=True)))
+            pos += 9
+        elif enc == 0xF0:
+            entries.append(_int_bytes(int.from_bytes(blob[pos + 1:pos + 4], 'little', signed=True)))
+            pos += 4
+        elif enc == 0xFE:
+            entries.append(_int_bytes(int.from_bytes(blob[pos + 1:pos + 2], 'little', signed=True)))
+            pos += 2
+        elif 0xF1 <= enc <= 0xFD:
+            entries.append(_int_bytes((enc & 0x0F) - 1))
+            pos += 1
+        else:
+            raise RDBFormatError(f"Unknown ziplist encoding 0x{enc:02x}")
+    return entries
+
+
+def _listpack_backlen_size(entry_len: int) -> int:
+    # Same cut-offs as lpEncodeBacklen
+    if entry_len < 128:
+        return 1
+    if entry_len < 16383:
+        return 2
+    if entry_len < 2097151:
+        return 3
+    if entry_len < 268435455:
+        return 4
+    return 5
+
+
+def _encode_listpack_entry(item) -> bytes:
+    if isinstance(item, int):
+        if 0 <= item < 128:
+            entry = bytes((item,))
+        elif -4096 <= item < 4096:
+            item &= 0x1FFF
+            entry = bytes((0xC0 | (item >> 8), item & 0xFF))
+        else:
+            for marker, width in ((0xF1, 2), (0xF2, 3), (0xF3, 4), (0xF4, 8)):
+                if -(1 << (8 * width - 1)) <= item < 1 << (8 * width - 1):
+                    entry = bytes((marker,)) + item.to_bytes(width, 'little', signed=True)
+                    break
+    elif len(item) < 64:
+        entry = bytes((0x80 | len(item),)) + item
+    elif len(item) < 4096:
+        entry = bytes((0xE0 | (len(item) >> 8), len(item) & 0xFF)) + item
+    else:
+        entry = b'\xF0' + len(item).to_bytes(4, 'little') + item
+    # The back length lets readers walk the listpack from its end
+    n = len(entry)
+    size = _listpack_backlen_size(n)
+    backlen = [n >> (7 * (size - 1))] + [((n >> (7 * k)) & 127) | 128 for k in range(size - 2, -1, -1)]
+    return entry + bytes(backlen)
+
+
+def encode_listpack(items) -> bytes:
+    """Serialize ints and byte strings as a listpack blob"""
+    body = b''.join(map(_encode_listpack_entry, items))
+    count = len(items) if len(items) < 65535 else 65535
+    return (len(body) + 7).to_bytes(4, 'little') + count.to_bytes(2, 'little') + body + b'\xFF'
+
+
+def parse_listpack(blob: bytes) -> list[bytes]:
+    entries = []
+    pos = 6  # total bytes, element count
+    while True:
+        enc = blob[pos]
+        if enc == 0xFF:
+            return entries
+        if enc < 0x80:  # 7 bit unsigned int
+            value, header, size = _int_bytes(enc), 1, 0
+        elif enc < 0xC0:  # 6 bit string length
+            header, size = 1, enc & 0x3F
+            value = blob[pos + 1:pos + 1 + size]
+        elif enc < 0xE0:  # 13 bit signed int
+            number = ((enc & 0x1F) << 8) | blob[pos + 1]
+            if number >= 1 << 12:
+                number -= 1 << 13
+            value, header, size = _int_bytes(number), 2, 0
+        elif enc < 0xF0:  # 12 bit string length
+            header, size = 2, ((enc & 0x0F) << 8) | blob[pos + 1]
+            value = blob[pos + 2:pos + 2 + size]
+        elif enc == 0xF0:  # 32 bit string length
+            header, size = 5, int.from_bytes(blob[pos + 1:pos + 5], 'little')
+            value = blob[pos + 5:pos + 5 + size]
+        elif 0xF1 <= enc <= 0xF4:
+            width = {0xF1: 2, 0xF2: 3, 0xF3: 4, 0xF4: 8}[enc]
+            value = _int_bytes(int.from_bytes(blob[pos + 1:pos + 1 + width], 'little', signed=True))
+            header, size = 1 + width, 0
+        else:
+            raise RDBFormatError(f"Unknown listpack encoding 0x{enc:02x}")
+        entry_len = header + size
+        pos += entry_len + _listpack_backlen_size(entry_len)
+        entries.append(value)
+
+
+def parse_intset(blob: bytes) -> list[bytes]:
+    width = int.from_bytes(blob[0:4], 'little')
+    count = int.from_bytes(blob[4:8], 'little')
+    if width not in (2, 4, 8) or len(blob) < 8 + count * width:
+        raise RDBFormatError("Truncated or invalid intset")
+    return [
+        _int_bytes(int.from_bytes(blob[8 + i * width:8 + (i + 1) * width], 'little', signed=True))
+        for i in range(count)
+    ]
+
+
+def parse_zipmap(blob: bytes) -> dict:
+    result = {}
+    pos = 1  # zmlen
+    while blob[pos] != 0xFF:
+        items = []
+        for is_value in (False, True):
+            length = blob[pos]
+            if length == 254:
+                length = int.from_bytes(blob[pos + 1:pos + 5], 'little')
+                pos += 5
+            else:
+                pos += 1
+            free = 0
+            if is_value:
+                free = blob[pos]
+                pos += 1
+            items.append(blob[pos:pos + length])
+            pos += length + free
+        result[items[0]] = items[1]
+    return result
+
+
+def _pairs_to_zset(items: list[bytes]) -> dict:
+    return {member: float(score) for member, score in zip(items[::2], items[1::2])}
+
+
+def _read_stream_node(data, pos: int) -> tuple[tuple, int]:
+    master_id, pos = read_string(data, pos)
+    listpack, pos = read_string(data, pos)
+    return (master_id, listpack), pos
+
+
+def read_stream_tail(data, pos: int, nodes: list, rdb_type: int) -> tuple[dict, int]:
+    """Walk the metadata after a stream's listpack nodes; returns the nodes
+    and metadata"""
+    stream = {"nodes": nodes}
+    stream["length"], pos = read_plain_length(data, pos)
+    last_ms, pos = read_plain_length(data, pos)
+    last_seq, pos = read_plain_length(data, pos)
+    stream["last_id"] = (last_ms, last_seq)
+    if rdb_type >= RDB_TYPE_STREAM_LISTPACKS_2:
+        for _ in range(4):  # first id, max deleted id
+            _, pos = read_plain_length(data, pos)
+        _, pos = read_plain_length(data, pos)  # entries added
+    groups, pos = read_plain_length(data, pos)
+    for _ in range(groups):
+        _, pos = read_string(data, pos)  # group name
+        for _ in range(2):  # last delivered id
+            _, pos = read_plain_length(data, pos)
+        if rdb_type >= RDB_TYPE_STREAM_LISTPACKS_2:
+            _, pos = read_plain_length(data, pos)  # entries read
+        pending, pos = read_plain_length(data, pos)
+        for _ in range(pending):
+            _need(data, pos, 24)  # raw id + delivery time
+            pos += 24
+            _, pos = read_plain_length(data, pos)  # delivery count
+        consumers, pos = read_plain_length(data, pos)
+        for _ in range(consumers):
+            _, pos = read_string(data, pos)  # consumer name
+            seen = 16 if rdb_type >= RDB_TYPE_STREAM_LISTPACKS_3 else 8
+            _need(data, pos, seen)
+            pos += seen
+            pending, pos = read_plain_length(data, pos)
+            _need(data, pos, 16 * pending)
+            pos += 16 * pending
+    return stream, pos
+
+
+def _read_zset_item(data, pos: int) -> tuple[tuple, int]:
+    member, pos = read_string(data, pos)
+    score, pos = read_double(data, pos)
+    return (member, score), pos
+
+
+def _read_zset_2_item(data, pos: int) -> tuple[tuple, int]:
+    member, pos = read_string(data, pos)
+    score, pos = read_binary_double(data, pos)
+    return (member, score), pos
+
+
+def _read_hash_item(data, pos: int) -> tuple[tuple, int]:
+    field, pos = read_string(data, pos)
+    value, pos = read_string(data, pos)
+    return (field, value), pos
+
+
+def _read_quicklist_node(data, pos: int) -> tuple[list, int]:
+    blob, pos = read_string(data, pos)
+    return parse_ziplist(blob), pos
+
+
+def _read_quicklist_2_node(data, pos: int) -> tuple[list, int]:
+    container, pos = read_plain_length(data, pos)
+    blob, pos = read_string(data, pos)
+    if container == QUICKLIST_NODE_CONTAINER_PLAIN:
+        return [blob], pos
+    return parse_listpack(blob), pos
+
+
+def _finish_list(data, pos: int, items: list):
+    return items, pos
+
+
+def _finish_set(data, pos: int, items: list):
+    return set(items), pos
+
+
+def _finish_dict(data, pos: int, items: list):
+    return dict(items), pos
+
+
+def _finish_quicklist(data, pos: int, nodes: list):
+    return [item for node in nodes for item in node], pos
+
+
+# Values stored as a count followed by that many items:
+# rdb type -> (read_item(data, pos), finish(data, pos, items)). finish builds
+# the value and reads whatever follows the items.
+_COLLECTION_READERS = {
+    RDB_TYPE_LIST: (read_string, _finish_list),
+    RDB_TYPE_SET: (read_string, _finish_set),
+    RDB_TYPE_ZSET: (_read_zset_item, _finish_dict),
+    RDB_TYPE_ZSET_2: (_read_zset_2_item, _finish_dict),
+    RDB_TYPE_HASH: (_read_hash_item, _finish_dict),
+    RDB_TYPE_LIST_QUICKLIST: (_read_quicklist_node, _finish_quicklist),
+    RDB_TYPE_LIST_QUICKLIST_2: (_read_quicklist_2_node, _finish_quicklist),
+    **{
+        rdb_type: (_read_stream_node, functools.partial(read_stream_tail, rdb_type=rdb_type))
+        for rdb_type in (RDB_TYPE_STREAM_LISTPACKS, RDB_TYPE_STREAM_LISTPACKS_2, RDB_TYPE_STREAM_LISTPACKS_3)
+    },
+}
+
+
+def read_value(data, pos: int, rdb_type: int):
+    """Decode one value into plain Python structures"""
+    if rdb_type == RDB_TYPE_STRING:
+        return read_string(data, pos)
+    if rdb_type in _COLLECTION_READERS:
+        read_item, finish = _COLLECTION_READERS[rdb_type]
+        count, pos = read_plain_length(data, pos)
+        items = []
+        for _ in range(count):
+            item, pos = read_item(data, pos)
+            items.append(item)
+        return finish(data, pos, items)
+
+    # Everything else is a single encoded blob
+    blob, pos = read_string(data, pos)
+    if rdb_type == RDB_TYPE_HASH_ZIPMAP:
+        return parse_zipmap(blob), pos
+    if rdb_type == RDB_TYPE_LIST_ZIPLIST:
+        return parse_ziplist(blob), pos
+    if rdb_type == RDB_TYPE_SET_INTSET:
+        return set(parse_intset(blob)), pos
+    if rdb_type == RDB_TYPE_SET_LISTPACK:
+        return set(parse_listpack(blob)), pos
+    if rdb_type in (RDB_TYPE_ZSET_ZIPLIST, RDB_TYPE_ZSET_LISTPACK):
+        items = parse_ziplist(blob) if rdb_type == RDB_TYPE_ZSET_ZIPLIST else parse_listpack(blob)
+        return _pairs_to_zset(items), pos
+    if rdb_type in (RDB_TYPE_HASH_ZIPLIST, RDB_TYPE_HASH_LISTPACK):
+        items = parse_ziplist(blob) if rdb_type == RDB_TYPE_HASH_ZIPLIST else parse_listpack(blob)
+        return dict(zip(items[::2], items[1::2])), pos
+    raise RDBFormatError(f"Unsupported RDB value type {rdb_type}")
+
+
+class _PendingValue:
+    """A collection value cut off by the end of the buffer: its key and the
+    items read so far"""
+
+    __slots__ = ("key", "rdb_type", "expire", "remaining", "items", "read_item", "finish")
+
+    def __init__(self, key: bytes, rdb_type: int, expire, count: int, read_item, finish):
+        self.key = key
+        self.rdb_type = rdb_type
+        self.expire = expire
+        self.remaining = count
+        self.items = []
+        self.read_item = read_item
+        self.finish = finish
+
+
+class RDBParser:
+    """Record-at-a-time RDB parser.
+
+    ``parse(data, pos)`` consumes as many whole records as ``data`` holds and
+    returns the offset of the first unparsed byte, so a caller receiving the
+    file in pieces can append more bytes and call again from the returned
+    offset. A record cut off by the end of the buffer is left untouched,
+    except collections, whose whole items are kept and consumed so they are
+    not reparsed from their start on every call. ``needed`` then says how
+    many bytes past the returned offset the next call needs to get further.
+    """
+
+    def __init__(self, on_entry, on_aux=None, on_progress=None):
+        self.on_entry = on_entry
+        self.on_aux = on_aux
+        self.on_progress = on_progress
+        self.version = None
+        self.db = 0
+        self.done = False
+        self.needed = 0
+        self._pending = None
+
+    def parse(self, data, pos: int = 0) -> int:
+        if self.version is None:
+            if len(data) - pos < 9:
+                self.needed = 9
+                return pos
+            if bytes(data[pos:pos + 5]) != b'REDIS':
+                raise RDBFormatError("Invalid RDB header")
+            version = bytes(data[pos + 5:pos + 9])
+            if not version.isdigit():
+                raise RDBFormatError(f"Invalid RDB version {version!r}")
+            version = int(version)
+            if not RDB_MIN_VERSION <= version <= RDB_MAX_VERSION:
+                raise RDBFormatError(f"Unsupported RDB version {version}")
+            self.version = version
+            pos += 9
+        records = 0
+        while not self.done:
+            try:
+                if self._pending is not None:
+                    pos = self._resume(data, pos)
+                else:
+                    pos = self._parse_record(data, pos)
+            except Incomplete as e:
+                if e.resume_at is not None:
+                    pos = e.resume_at
+                self.needed = e.needed - pos
+                break
+            except _DECODE_ERRORS as e:
+                raise RDBFormatError(f"Corrupt record at offset {pos}: {e}") from e
+            records += 1
+            if self.on_progress is not None and records % RDB_LOAD_PROGRESS_RECORDS == 0:
+                self.on_progress(pos)
+        return pos
+
+    def _parse_record(self, data, pos: int) -> int:
+        _need(data, pos, 1)
+        opcode = data[pos]
+        pos += 1
+        if opcode == RDB_OPCODE_EOF:
+            # Versions 5+ end with an 8 byte checksum
+            if self.version >= 5:
+                _need(data, pos, 8)
+                pos += 8
+            self.done = True
+            return pos
+        if opcode == RDB_OPCODE_SELECTDB:
+            self.db, pos = read_plain_length(data, pos)
+            return pos
+        if opcode == RDB_OPCODE_RESIZEDB:
+            _, pos = read_plain_length(data, pos)
+            _, pos = read_plain_length(data, pos)
+            return pos
+        if opcode == RDB_OPCODE_AUX:
+            name, pos = read_string(data, pos)
+            value, pos = read_string(data, pos)
+            if self.on_aux is not None:
+                self.on_aux(name, value)
+            return pos
+        if opcode == RDB_OPCODE_SLOT_INFO:
+            for _ in range(3):
+                _, pos = read_plain_length(data, pos)
+            return pos
+        if opcode == RDB_OPCODE_FUNCTION2:
+            _, pos = read_string(data, pos)
+            return pos
+        if opcode in (RDB_OPCODE_MODULE_AUX, RDB_OPCODE_FUNCTION_PRE_GA):
+            raise RDBFormatError(f"Unsupported RDB opcode 0x{opcode:02x}")
+
+        # Anything else is a key/value pair, optionally preceded by its
+        # expiry and LRU/LFU hints. They are parsed as one unit so a record
+        # never ends up half applied.
+        expire = None
+        while opcode in (RDB_OPCODE_EXPIRETIME_MS, RDB_OPCODE_EXPIRETIME, RDB_OPCODE_IDLE, RDB_OPCODE_FREQ):
+            if opcode == RDB_OPCODE_EXPIRETIME_MS:
+                _need(data, pos, 8)
+                expire = struct.unpack('<Q', data[pos:pos + 8])[0]
+                pos += 8
+            elif opcode == RDB_OPCODE_EXPIRETIME:
+                _need(data, pos, 4)
+                expire = struct.unpack('<I', data[pos:pos + 4])[0] * 1000
+                pos += 4
+            elif opcode == RDB_OPCODE_IDLE:
+                _, pos = read_plain_length(data, pos)
+            else:
+                _need(data, pos, 1)
+                pos += 1
+            _need(data, pos, 1)
+            opcode = data[pos]
+            pos += 1
+        key, pos = read_string(data, pos)
+        reader = _COLLECTION_READERS.get(opcode)
+        if reader is None:
+            try:
+                value, pos = read_value(data, pos, opcode)
+                self.on_entry(self.db, key, opcode, value, expire)
+            except (RDBFormatError, *_DECODE_ERRORS) as e:
+                raise RDBFormatError(f"Corrupt value for key {key!r}: {e}") from e
+            return pos
+        count, pos = read_plain_length(data, pos)
+        self._pending = _PendingValue(key, opcode, expire, count, *reader)
+        return self._resume(data, pos)
+
+    def _resume(self, data, pos: int) -> int:
+        """Read on into the pending collection, applying it once complete. If
+        the buffer runs out, Incomplete says where its last whole item ends."""
+        pending = self._pending
+        try:
+            while pending.remaining:
+                item, pos = pending.read_item(data, pos)
+                pending.items.append(item)
+                pending.remaining -= 1
+            value, pos = pending.finish(data, pos, pending.items)
+            self._pending = None
+            self.on_entry(self.db, pending.key, pending.rdb_type, value, pending.expire)
+        except Incomplete as e:
+            e.resume_at = pos
+            raise
+        except (RDBFormatError, *_DECODE_ERRORS) as e:
+            raise RDBFormatError(f"Corrupt value for key {pending.key!r}: {e}") from e
+        return pos
+
+
+class RDBLoadStats:
+    """Counts what a load did and prints periodic progress"""
+
+    def __init__(self, total_bytes: int = 0):
+        self.total_bytes = total_bytes
+        self.started = time.monotonic()
+        self._last_report = self.started
+        self.loaded = 0
+        self.expired = 0
+        self.skipped = 0
+
+    def progress(self, pos: int):
+        now = time.monotonic()
+        if now - self._last_report < RDB_LOAD_PROGRESS_INTERVAL:
+            return
+        self._last_report = now
+        elapsed = now - self.started
+        percent = f"{100 * pos / self.total_bytes:.1f}%" if self.total_bytes else f"{pos} bytes"
+        logger.info("Loading RDB: %s, %d keys, %.1f MB/s, %.0f keys/s",
+                    percent, self.loaded, pos / elapsed / (1024 * 1024), self.loaded / elapsed)
+
+    def summary(self, pos: int) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return (f"Loaded {self.loaded} keys ({pos} bytes) in {elapsed:.3f}s, "
+                f"{pos / elapsed / (1024 * 1024):.1f} MB/s, {self.loaded / elapsed:.0f} keys/s; "
+                f"skipped {self.expired} expired and {self.skipped} unsupported keys")
+
+
+_LIST_TYPES = (RDB_TYPE_LIST, RDB_TYPE_LIST_ZIPLIST, RDB_TYPE_LIST_QUICKLIST, RDB_TYPE_LIST_QUICKLIST_2)
+_SET_TYPES = (RDB_TYPE_SET, RDB_TYPE_SET_INTSET, RDB_TYPE_SET_LISTPACK)
+_ZSET_TYPES = (RDB_TYPE_ZSET, RDB_TYPE_ZSET_2, RDB_TYPE_ZSET_ZIPLIST, RDB_TYPE_ZSET_LISTPACK)
+_HASH_TYPES = (RDB_TYPE_HASH, RDB_TYPE_HASH_ZIPMAP, RDB_TYPE_HASH_ZIPLIST, RDB_TYPE_HASH_LISTPACK)
+
+
+def stream_from_rdb(stream: dict, config) -> StreamValue:
+    """Rebuild a stream from the listpack nodes read_value returned"""
+    value = StreamValue()
+    for master_id, listpack in stream["nodes"]:
+        master_ms = int.from_bytes(master_id[:8], 'big')
+        master_seq = int.from_bytes(master_id[8:16], 'big')
+        items = parse_listpack(listpack)
+        field_count = int(items[2])
+        fields = items[3:3 + field_count]
+        pos = 4 + field_count
+        while pos < len(items):
+            flags, ms_diff, seq_diff = int(items[pos]), int(items[pos + 1]), int(items[pos + 2])
+            pos += 3
+            if flags & STREAM_ITEM_FLAG_SAMEFIELDS:
+                pairs = [item for pair in zip(fields, items[pos:pos + field_count]) for item in pair]
+                pos += field_count
+            else:
+                count = int(items[pos])
+                pairs = items[pos + 1:pos + 1 + 2 * count]
+                pos += 1 + 2 * count
+            pos += 1  # lp-count
+            if flags & STREAM_ITEM_FLAG_DELETED:
+                continue
+            value.add((master_ms + ms_diff, master_seq + seq_diff), pairs, config)
+    value.last_id = max(value.last_id, stream["last_id"])
+    return value
+
+
+def to_stored_value(rdb_type: int, value, config):
+    """Turn what read_value decoded into the value the keyspace holds, or
+    None for types this server has no commands for (modules)"""
+    if rdb_type == RDB_TYPE_STRING:
+        return value
+    if rdb_type in _LIST_TYPES:
+        return ListValue(value, config)
+    if rdb_type in _SET_TYPES:
+        return SetValue(value, config)
+    if rdb_type in _ZSET_TYPES:
+        return ZSetValue(value, config)
+    if rdb_type in _HASH_TYPES:
+        return HashValue(value, config)
+    if rdb_type in (RDB_TYPE_STREAM_LISTPACKS, RDB_TYPE_STREAM_LISTPACKS_2, RDB_TYPE_STREAM_LISTPACKS_3):
+        return stream_from_rdb(value, config)
+    return None
+
+
+def make_entry_loader(storage, stats: RDBLoadStats, store=None):
+    """Callback for RDBParser that fills storage and updates stats"""
+    store_at = store or storage.store_at
+    config = storage.config
+
+    def on_entry(db, key, rdb_type, value, expire):
+        # Only database 0 exists in this server
+        if db != 0:
+            stats.skipped += 1
+            return
+        if expire is not None and is_expired(expire):
+            stats.expired += 1
+            return
+        value = to_stored_value(rdb_type, value, config)
+        if value is None:
+            stats.skipped += 1
+            return
+        store_at(key, value, expire if expire is not None else -1)
+        stats.loaded += 1
+
+    return on_entry
+
+
+def load_rdb(storage, path: str):
+    """Memory-map an RDB file and load it into storage"""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            logger.info("Empty RDB file, nothing to load")
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            stats = RDBLoadStats(size)
+            parser = RDBParser(make_entry_loader(storage, stats), on_progress=stats.progress)
+            pos = parser.parse(data)
+            if not parser.done:
+                raise RDBFormatError("Unexpected end of RDB file")
+            logger.info("%s", stats.summary(pos))
+
+
+class RDBStreamLoader:
+    """Load an RDB that arrives in pieces, e.g. from a master during sync.
+
+    Bytes are appended with ``feed()``; every whole record is applied right
+    away and only the unparsed tail is kept, so memory stays at about one
+    record plus one chunk whatever the payload size.
+    """
+
+    def __init__(self, storage, store=None, total_bytes: int = 0):
+        self.stats = RDBLoadStats(total_bytes)
+        self.parser = RDBParser(make_entry_loader(storage, self.stats, store), on_progress=self._progress)
+        self.buffer = bytearray()
+        # Payload bytes dropped from the front of buffer
+        self.consumed = 0
+
+    @property
+    def done(self) -> bool:
+        return self.parser.done
+
+    def feed(self, data: bytes):
+        self.buffer += data
+        # Until the bytes the cut off record asked for are in, parsing would
+        # only fail at the same place again
+        if self.parser.done or len(self.buffer) < self.parser.needed:
+            return
+        pos = self.parser.parse(self.buffer)
+        del self.buffer[:pos]
+        self.consumed += pos
+
+    def leftover(self) -> bytes:
+        """Bytes fed after the end of the RDB"""
+        return bytes(self.buffer) if self.parser.done else b""
+
+    def _progress(self, pos: int):
+        self.stats.progress(self.consumed + pos)
+
+    def summary(self) -> str:
+        return self.stats.summary(self.consumed)
@@ -0,0 +1,93 @@
+import random
+
+
+class SampledDict:
+    """Dict that can also hand out random keys in O(1).
+
+    Keys are mirrored in a dense list. Removing a key moves the last key into
+    the freed slot, so the list never has holes and a random index is always
+    a live key.
+
+    The same list backs ``scan()``. It walks positions from the end down to
+    0: new keys are appended past the cursor, and a removal only ever moves
+    the last key down into a freed slot, so a key present for the whole
+    scan can never move from the unvisited part into the visited part.
+    """
+
+    __slots__ = ("_data", "_keys", "_pos")
+
+    def __init__(self):
+        self._data = {}
+        self._keys = []
+        self._pos = {}
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        if key not in self._data:
+            self._pos[key] = len(self._keys)
+            self._keys.append(key)
+        self._data[key] = value
+
+    def __delitem__(self, key):
+        if key not in self._data:
+            raise KeyError(key)
+        self.pop(key)
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def pop(self, key, default=None):
+        if key not in self._data:
+            return default
+        value = self._data.pop(key)
+        pos = self._pos.pop(key)
+        last = self._keys.pop()
+        if pos < len(self._keys):
+            self._keys[pos] = last
+            self._pos[last] = pos
+        return value
+
+    def keys(self):
+        return self._data.keys()
+
+    def items(self):
+        return self._data.items()
+
+    def clear(self):
+        self._data.clear()
+        self._keys.clear()
+        self._pos.clear()
+
+    def random_key(self):
+        if not self._keys:
+            return None
+        return self._keys[random.randrange(len(self._keys))]
+
+    def sample(self, count: int) -> list:
+        """Return up to count random keys; duplicates are possible."""
+        keys = self._keys
+        if not keys:
+            return []
+        size = len(keys)
+        return [keys[random.randrange(size)] for _ in range(min(count, size))]
+
+    def scan(self, cursor: int, count: int) -> tuple[int, list]:
+        """Return (next cursor, up to count keys); cursor 0 starts and ends.
+
+        A non-zero cursor c means positions c-1 down to 0 are still to come.
+        """
+        keys = self._keys
+        end = len(keys) if cursor == 0 else min(cursor - 1, len(keys) - 1) + 1
+        start = max(end - count, 0)
+        return start, keys[start:end][::-1]
@@ -1,22 +1,127 @@
 import asyncio
 import argparse
+import logging
+import multiprocessing
+import os
+import signal
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+from app.data.aof import aof_cron
+from app.data.config import ServerConfig
+from app.data.expiry import active_expire_cycle
 from app.data.memory import RedisStore
+from app.data.rdb import rdb_save_cron
 from app.data.metadata import ServerMetadata
 from app.server.handshake import handshake
+from app.server.cluster import ClusterLayout
+from app.server.clients import ClientRegistry, clients_cron
 from app.server.handler import ServerHandler
-# No direct import from app.commands, but update if needed in future.
+from app.server.stats import ServerStats, stats_cron
 
+# Not __name__: run as a script this module is __main__, outside "app"
+logger = logging.getLogger("app.main")
 
-async def main(storage, port):
+async def main(storage, host, port, unixsocket=None, unixsocketperm=None):
+    loop = asyncio.get_running_loop()
     handler = ServerHandler(storage)
-    server = await asyncio.start_server(handler.respond, "localhost", port)
-    addrs = ', '.join(str(sock.getsockname()) for sock in server.sockets)
-    print(f'Serving on {addrs}')
+    servers = [await loop.create_server(handler, host, port)]
+    if unixsocket:
+        if os.path.exists(unixsocket):
+            # Left over from a previous run that did not shut down cleanly
+            os.unlink(unixsocket)
+        servers.append(await loop.create_unix_server(handler, unixsocket))
+        if unixsocketperm is not None:
+            os.chmod(unixsocket, unixsocketperm)
+    addrs = ', '.join(str(sock.getsockname()) for server in servers for sock in server.sockets)
+    logger.info("Ready to accept connections on %s", addrs)
+
+    asyncio.create_task(handshake(storage.metadata, port, storage))
+    asyncio.create_task(active_expire_cycle(storage))
+    asyncio.create_task(rdb_save_cron(storage))
+    asyncio.create_task(aof_cron(storage))
+    asyncio.create_task(stats_cron(ServerStats(storage.config)))
+    asyncio.create_task(clients_cron(ClientRegistry(storage.config), handler.idle_exempt))
+    try:
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+    finally:
+        if unixsocket and os.path.exists(unixsocket):
+            os.unlink(unixsocket)
+
+
+def shard_filename(name: str, index: int) -> str:
+    """Each shard keeps its own files: dump.rdb -> dump-<index>.rdb"""
+    stem, ext = os.path.splitext(name)
+    return f"{stem}-{index}{ext}"
+
+
+def serve(args, shard: int = None, node_ids=None):
+    """Run one server; with shard set, the worker owning that shard's slots"""
+    port, dbfilename, unixsocket = args.port, args.dbfilename, args.unixsocket
+    # A fresh replid per run: offsets restart at 0, so an old id must not match
+    metadata = ServerMetadata(args.replicaof, os.urandom(20).hex(), 0)
+    config = ServerConfig(
+        maxmemory=args.maxmemory,
+        maxmemory_policy=args.maxmemory_policy,
+        maxmemory_samples=args.maxmemory_samples,
+        save=args.save,
+        appendonly=args.appendonly,
+        appendfilename=args.appendfilename,
+        appendfsync=args.appendfsync,
+        repl_backlog_size=args.repl_backlog_size,
+        loglevel=args.loglevel,
+        maxclients=args.maxclients,
+        timeout=args.timeout,
+        client_output_buffer_limit=args.client_output_buffer_limit,
+    )
+    if shard is not None:
+        metadata.cluster = ClusterLayout.split(args.shards, args.host, args.port, shard, node_ids)
+        port += shard
+        config.appendfilename = shard_filename(config.appendfilename, shard)
+        if dbfilename is not None:
+            dbfilename = shard_filename(dbfilename, shard)
+        if unixsocket is not None:
+            unixsocket = shard_filename(unixsocket, shard)
+    storage = RedisStore(args.dir, dbfilename, metadata, config)
 
-    async with server:
-        asyncio.create_task(handshake(storage.metadata, port, storage))
-        await server.serve_forever()
+    if uvloop is not None:
+        uvloop.install()
+    try:
+        asyncio.run(main(storage, args.host, port, unixsocket, args.unixsocketperm))
+    except KeyboardInterrupt:
+        pass
+
+
+def run_sharded(args):
+    """Start one worker process per shard and wait for them.
+
+    Workers share nothing: each has its own keyspace, files and event loop,
+    so they scale across cores. Clients find the right one through CLUSTER
+    SLOTS or the MOVED replies, as with Redis Cluster.
+    """
+    # Node ids are chosen here so every worker reports the same topology
+    node_ids = [os.urandom(20).hex() for _ in range(args.shards)]
+    workers = [
+        multiprocessing.Process(target=serve, args=(args, shard, node_ids), name=f"shard-{shard}")
+        for shard in range(args.shards)
+    ]
+    for worker in workers:
+        worker.start()
+
+    def stop(signum, frame):
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for worker in workers:
+        worker.join()
+        if worker.exitcode:
+            logger.warning("Worker %s exited with code %s", worker.name, worker.exitcode)
 
 
 if __name__ == "__main__":
@@ -26,10 +131,28 @@ if __name__ == "__main__":
     parser.add_argument('--dbfilename', type=str, help='the name of the RDB file')
     parser.add_argument('--port', type=int, default=6379, help='the port to run the server on')
     parser.add_argument('--host', type=str, default='localhost', help='the host to run the server on')
+    parser.add_argument('--unixsocket', type=str, default=None, help='also listen on this Unix domain socket path')
+    parser.add_argument('--unixsocketperm', type=lambda v: int(v, 8), default=None, help='permissions for the Unix socket, in octal')
     parser.add_argument('--replicaof', type=str, default=None, help='the host and port to replicate from')
+    parser.add_argument('--maxmemory', type=str, default=None, help='memory limit for the dataset, e.g. 100mb (0 for none)')
+    parser.add_argument('--maxmemory-policy', type=str, default=None, help='eviction policy once maxmemory is reached')
+    parser.add_argument('--maxmemory-samples', type=int, default=None, help='keys sampled per eviction')
+    parser.add_argument('--save', type=str, default=None, help='snapshot triggers as "<seconds> <changes> ..."')
+    parser.add_argument('--appendonly', type=str, default=None, help='yes to log every write to the append only file')
+    parser.add_argument('--appendfilename', type=str, default=None, help='name of the append only file inside --dir')
+    parser.add_argument('--appendfsync', type=str, default=None, help='always, everysec or no')
+    parser.add_argument('--repl-backlog-size', type=str, default=None, help='bytes of replication stream kept for partial resyncs, e.g. 1mb')
+    parser.add_argument('--maxclients', type=int, default=None, help='most clients connected at once (default 10000)')
+    parser.add_argument('--timeout', type=int, default=None, help='close clients idle for this many seconds (0, the default, for never)')
+    parser.add_argument('--client-output-buffer-limit', type=str, default=None, help='"<class> <hard> <soft> <seconds> ..." for normal, replica and pubsub clients')
+    parser.add_argument('--loglevel', type=str, default=None, help='debug, verbose, notice (default), warning or nothing')
+    parser.add_argument('--shards', type=int, default=1, help='worker processes, each serving its own share of the hash slots on port + i')
 
     args = parser.parse_args()
-    metadata = ServerMetadata(args.replicaof, "8371b4fb1155b71f4a04d3e1bc3e18c4a990aeeb", 0)
-    storage = RedisStore(args.dir, args.dbfilename, metadata)
-
-    asyncio.run(main(storage, args.port))
+    logging.basicConfig(format="%(process)d %(asctime)s %(levelname)s %(name)s: %(message)s")
+    if args.shards > 1:
+        if args.replicaof:
+            parser.error("--shards cannot be combined with --replicaof")
+        run_sharded(args)
+    else:
+        serve(args)
@@ -7,18 +7,18 @@ class RESPEncoder(IncrementalEncoder):
         if input is None:
             return b'$-1\r\n'
 
+        if isinstance(input, bytes):
+            return b'$%d\r\n%b\r\n' % (len(input), input)
+
         if isinstance(input, str):
             encoded = input.encode('utf-8')
-            return f"${len(encoded)}\r\n{input}\r\n".encode('utf-8')
-
-        if isinstance(input, bytes):
-            return f"${len(input)}\r\n".encode('utf-8') + input + b'\r\n'
+            return b'$%d\r\n%b\r\n' % (len(encoded), encoded)
 
         if isinstance(input, int):
-            return f":{input}\r\n".encode('utf-8')
+            return b':%d\r\n' % input
 
         if isinstance(input, list):
-            parts = [f"*{len(input)}\r\n".encode('utf-8')]
+            parts = [b'*%d\r\n' % len(input)]
             for item in input:
                 parts.append(self.encode(item))
             return b''.join(parts)
@@ -29,92 +29,175 @@ class RESPEncoder(IncrementalEncoder):
         if isinstance(input, SimpleString):
             return f"+{str(input)}\r\n".encode('utf-8')
 
+        if input is NULL_ARRAY:
+            return b'*-1\r\n'
+
         raise ValueError(f"Unsupported type for RESP encoding: {type(input)}")
 
 
 class RESPDecoder(IncrementalDecoder):
+    """Incremental RESP parser over a single growing buffer.
+
+    The buffer is a ``bytearray`` read through a moving offset; consumed bytes
+    are only dropped once enough of them pile up. Partially received arrays
+    and bulk strings keep their progress on a small stack, so a frame split
+    across reads is resumed where it stopped instead of being parsed again.
+
+    Bulk strings are returned as ``bytes`` so binary payloads pass through
+    untouched; simple strings and errors are decoded to ``str``. A line that
+    does not start with a RESP type is an inline command, returned as the
+    list of its words.
+
+    ``consumed`` counts the stream bytes of every complete top-level value
+    returned so far, which replicas use as their replication offset.
+    """
+
+    # Drop consumed bytes from the front of the buffer past this many
+    COMPACT_THRESHOLD = 64 * 1024
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.buffer = b''
+        self.reset()
 
     def decode(self, input: bytes, final: bool = False) -> Optional[Any]:
+        self.feed(input)
+        result = self._next()
+        if result is _INCOMPLETE:
+            if final and self.pending:
+                raise ValueError("Incomplete RESP data")
+            return None
+        return result
+
+    def decode_all(self, input: bytes) -> list[Any]:
+        """Feed input and return every complete value now in the buffer.
+
+        Partial trailing frames stay buffered until the next call.
+        """
+        self.feed(input)
+        results = []
+        buf = self.buffer
+        with memoryview(buf) as view:
+            while True:
+                result = self._parse(buf, view)
+                if result is _INCOMPLETE:
+                    return results
+                results.append(result)
+
+    def decode_all_with_offsets(self, input: bytes) -> list[tuple[Any, int]]:
+        """Like decode_all, pairing each value with ``consumed`` right after it"""
+        self.feed(input)
+        results = []
+        buf = self.buffer
+        with memoryview(buf) as view:
+            while True:
+                result = self._parse(buf, view)
+                if result is _INCOMPLETE:
+                    return results
+                results.append((result, self.consumed))
+
+    @property
+    def pending(self) -> int:
+        """Bytes fed so far that are not part of a complete top-level value"""
+        return self._base + len(self.buffer) - self.consumed
+
+    def feed(self, input: bytes):
+        if self.pos and (self.pos == len(self.buffer) or self.pos >= self.COMPACT_THRESHOLD):
+            del self.buffer[:self.pos]
+            self._base += self.pos
+            self.pos = 0
         self.buffer += input
 
-        if not self.buffer:
-            return None
+    def _next(self) -> Any:
+        """Parse the next top-level value, or return _INCOMPLETE."""
+        # The view must be released before the buffer can be resized again
+        with memoryview(self.buffer) as view:
+            return self._parse(self.buffer, view)
+
+    def _parse(self, buf: bytearray, view: memoryview) -> Any:
+        size = len(buf)
+        pos = self.pos
+        stack = self._stack
+        while True:
+            if self._bulk_len >= 0:
+                # Header already read on an earlier call, wait for the payload
+                end = pos + self._bulk_len
+                if size < end + 2:
+                    self.pos = pos
+                    return _INCOMPLETE
+                if buf[end:end + 2] != b'\r\n':
+                    raise ProtocolError("Missing CRLF after bulk string")
+                value = view[pos:end].tobytes()
+                pos = end + 2
+                self._bulk_len = -1
+            else:
+                end = buf.find(b'\r\n', pos)
+                if end == -1:
+                    self.pos = pos
+                    return _INCOMPLETE
+                prefix = buf[pos]
+                if prefix == 0x24:  # Bulk String
+                    length = int(buf[pos + 1:end])
+                    pos = end + 2
+                    if length >= 0:
+                        self._bulk_len = length
+                        continue
+                    value = None
+                elif prefix == 0x2A:  # Array
+                    count = int(buf[pos + 1:end])
+                    pos = end + 2
+                    if count > 0:
+                        stack.append([count, []])
+                        continue
+                    value = [] if count == 0 else None
+                elif prefix == 0x2B:  # Simple String
+                    value = SimpleString(buf[pos + 1:end].decode('utf-8'))
+                    pos = end + 2
+                elif prefix == 0x2D:  # Error
+                    value = Error(buf[pos + 1:end].decode('utf-8'))
+                    pos = end + 2
+                elif prefix == 0x3A:  # Integer
+                    value = int(buf[pos + 1:end])
+                    pos = end + 2
+                elif not stack:
+                    # Inline command, as typed into telnet: words split on
+                    # whitespace; blank lines are skipped
+                    value = [bytes(word) for word in buf[pos:end].split()]
+                    pos = end + 2
+                    if not value:
+                        self.consumed = self._base + pos
+                        continue
+                else:
+                    raise ProtocolError(f"Invalid RESP data type: {chr(prefix)}")
+
+            # Attach the value to the innermost open array, closing finished ones
+            while stack:
+                frame = stack[-1]
+                frame[1].append(value)
+                frame[0] -= 1
+                if frame[0]:
+                    break
+                value = stack.pop()[1]
+            else:
+                self.pos = pos
+                self.consumed = self._base + pos
+                return value
 
-        try:
-            result, consumed = self._decode_one(self.buffer)
-            self.buffer = self.buffer[consumed:]
-            return result
-        except (IndexError, ValueError):
-            # Not enough data yet
-            if final:
-                # If this is the final chunk, raise the error
-                raise
-            return None
+    def reset(self):
+        self.buffer = bytearray()
+        self.pos = 0
+        # Stream offset of buffer[0], advanced whenever the buffer is compacted
+        self._base = 0
+        self.consumed = 0
+        self._stack = []
+        self._bulk_len = -1
 
-    def _decode_one(self, data: bytes) -> tuple[Any, int]:
-        if not data:
-            return None, 0
-
-        data_type = chr(data[0])
-        pos = 1
-
-        if data_type == '+':  # Simple String
-            end = data.find(b'\r\n', pos)
-            if end == -1:
-                raise ValueError("Incomplete simple string")
-            return SimpleString(data[pos:end].decode('utf-8')), end + 2
-
-        elif data_type == '-':  # Error
-            end = data.find(b'\r\n', pos)
-            if end == -1:
-                raise ValueError("Incomplete error")
-            return Error(data[pos:end].decode('utf-8')), end + 2
-
-        elif data_type == ':':  # Integer
-            end = data.find(b'\r\n', pos)
-            if end == -1:
-                raise ValueError("Incomplete integer")
-            return int(data[pos:end]), end + 2
-
-        elif data_type == '$':  # Bulk String
-            end = data.find(b'\r\n', pos)
-            if end == -1:
-                raise ValueError("Incomplete bulk string length")
-            length = int(data[pos:end])
-            if length == -1:  # Null
-                return None, end + 2
-
-            str_start = end + 2
-            str_end = str_start + length
-            if len(data) < str_end + 2:
-                raise ValueError("Incomplete bulk string data")
-            if data[str_end:str_end + 2] != b'\r\n':
-                raise ValueError("Missing CRLF after bulk string")
-            return data[str_start:str_end].decode('utf-8'), str_end + 2
-
-        elif data_type == '*':  # Array
-            end = data.find(b'\r\n', pos)
-            if end == -1:
-                raise ValueError("Incomplete array length")
-            count = int(data[pos:end])
-            if count == -1:  # Null array
-                return None, end + 2
-
-            pos = end + 2
-            result = []
-            for _ in range(count):
-                value, consumed = self._decode_one(data[pos:])
-                result.append(value)
-                pos += consumed
-            return result, pos
-
-        raise ValueError(f"Invalid RESP data type: {data_type}")
 
-    def reset(self):
-        self.buffer = b''
+_INCOMPLETE = object()
+
+
+class ProtocolError(ValueError):
+    """Raised when the byte stream is not valid RESP."""
+    pass
 
 
 class Error(Exception):
@@ -129,4 +212,12 @@ class SimpleString:
         self.value = value
 
     def __str__(self):
-        return self.value
\ No newline at end of file
+        return self.value
+
+
+class NullArray:
+    """Represents the RESP null array, e.g. a blocking pop that timed out."""
+    pass
+
+
+NULL_ARRAY = NullArray()
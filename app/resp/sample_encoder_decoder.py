@@ -1,4 +1,4 @@
-from RESPCodec import RESPDecoder, RESPEncoder
+from app.resp.RESPCodec import RESPDecoder, RESPEncoder
 
 def encode(s):
     encoder = RESPEncoder()
@@ -8,4 +8,5 @@ def decode(s):
     decoder = RESPDecoder()
     print(f"Decode data --- {decoder.decode(s)}")
 
-decode(b'*2\r\n$3\r\ndir\r\n$16\r\n/tmp/redis-files\r\n')
\ No newline at end of file
+if __name__ == "__main__":
+    decode(b'*2\r\n$3\r\ndir\r\n$16\r\n/tmp/redis-files\r\n')
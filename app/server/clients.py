@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import time
+
+from app.data.config import VERBOSE
+from app.decorators.singleton import singleton
+
+logger = logging.getLogger(__name__)
+
+MAXCLIENTS_ERROR = b"-ERR max number of clients reached\r\n"
+# Idle clients are looked for this often, in seconds
+CLIENTS_CRON_PERIOD = 1
+
+
+def _address(address) -> str:
+    if isinstance(address, tuple):
+        return f"{address[0]}:{address[1]}"
+    # Unix socket connections have no peer address, only the path
+    return f"{address or ''}:0"
+
+
+class ClientState:
+    """What CLIENT LIST reports about one connection, kept up to date as
+    it reads and writes"""
+
+    __slots__ = ("id", "name", "addr", "laddr", "created", "last_interaction",
+                 "bytes_in", "bytes_out", "last_command", "close_after_reply")
+
+    def __init__(self, client_id: int, transport):
+        self.id = client_id
+        self.name = ""
+        self.addr = _address(transport.get_extra_info("peername"))
+        self.laddr = _address(transport.get_extra_info("sockname"))
+        self.created = self.last_interaction = time.monotonic()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # Name of the last command run, as sent
+        self.last_command = b""
+        # Set by CLIENT KILL on the caller itself, so it still gets the reply
+        self.close_after_reply = False
+
+
+@singleton
+class ClientRegistry:
+    """Every client connection by id, for maxclients, the idle timeout and
+    the CLIENT command"""
+
+    def __init__(self, config):
+        self.config = config
+        # id -> Connection, in connection order
+        self.connections = {}
+        self.next_id = 1
+
+    def add(self, connection, transport):
+        """The new connection's ClientState, or None past maxclients"""
+        if len(self.connections) >= self.config.maxclients:
+            return None
+        client = ClientState(self.next_id, transport)
+        self.next_id += 1
+        self.connections[client.id] = connection
+        return client
+
+    def remove(self, connection):
+        if connection.client is not None:
+            self.connections.pop(connection.client.id, None)
+
+    def get(self, client_id: int):
+        return self.connections.get(client_id)
+
+    def close_idle(self, is_exempt) -> int:
+        """Close clients idle for longer than timeout, except those
+        is_exempt(connection) spares; returns how many were closed"""
+        timeout = self.config.timeout
+        if timeout <= 0:
+            return 0
+        deadline = time.monotonic() - timeout
+        idle = [
+            connection for connection in self.connections.values()
+            if connection.client.last_interaction < deadline and not is_exempt(connection)
+        ]
+        for connection in idle:
+            logger.log(VERBOSE, "Closing idle client id=%d addr=%s", connection.client.id, connection.client.addr)
+            connection.close()
+        return len(idle)
+
+
+async def clients_cron(registry, is_exempt):
+    while True:
+        await asyncio.sleep(CLIENTS_CRON_PERIOD)
+        try:
+            registry.close_idle(is_exempt)
+        except Exception:
+            logger.exception("Clients cron failed")
@@ -0,0 +1,111 @@
+import binascii
+import os
+
+from app.resp.RESPCodec import Error
+
+CLUSTER_SLOTS = 16384
+CROSSSLOT_ERROR = "CROSSSLOT Keys in request don't hash to the same slot"
+CLUSTER_DISABLED_ERROR = "ERR This instance has cluster support disabled"
+
+
+def key_hash_slot(key: bytes) -> int:
+    """The Redis Cluster slot of key: CRC16 of its {hash tag}, if it has a
+    non-empty one, else of the whole key, mod 16384"""
+    start = key.find(b"{")
+    if start != -1:
+        end = key.find(b"}", start + 1)
+        if end > start + 1:
+            key = key[start + 1:end]
+    # crc_hqx with a zero seed is CRC16-CCITT (XMODEM), the one Redis uses
+    return binascii.crc_hqx(key, 0) & (CLUSTER_SLOTS - 1)
+
+
+class Shard:
+    """One worker process and the contiguous slot range it owns"""
+
+    def __init__(self, index: int, start: int, end: int, host: str, port: int, node_id: str):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.host = host
+        self.port = port
+        self.node_id = node_id
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}"
+
+
+class ClusterLayout:
+    """The slot map every worker of a sharded server agrees on.
+
+    Worker i listens on base port + i and owns an equal share of the 16384
+    slots; commands for keys in other slots are answered with MOVED, the
+    redirection cluster clients follow and cache.
+    """
+
+    def __init__(self, shards: list, myself: int):
+        self.shards = shards
+        self.myself = shards[myself]
+        # slot -> index of the shard that owns it
+        self.owners = [0] * CLUSTER_SLOTS
+        for shard in shards:
+            for slot in range(shard.start, shard.end + 1):
+                self.owners[slot] = shard.index
+
+    @classmethod
+    def split(cls, count: int, host: str, base_port: int, myself: int = 0, node_ids=None):
+        """count shards on consecutive ports, splitting the slots evenly"""
+        # Clients connect to the address we announce, so a wildcard won't do
+        announced = "127.0.0.1" if host in ("", "0.0.0.0", "::") else host
+        node_ids = node_ids or [os.urandom(20).hex() for _ in range(count)]
+        shards = [
+            Shard(i, i * CLUSTER_SLOTS // count, (i + 1) * CLUSTER_SLOTS // count - 1,
+                  announced, base_port + i, node_ids[i])
+            for i in range(count)
+        ]
+        return cls(shards, myself)
+
+    def check_keys(self, keys: list):
+        """Raise CROSSSLOT unless keys share a slot, MOVED unless it is ours"""
+        slot = None
+        for key in keys:
+            key_slot = key_hash_slot(key)
+            if slot is None:
+                slot = key_slot
+            elif key_slot != slot:
+                raise Error(CROSSSLOT_ERROR)
+        if slot is not None and self.owners[slot] != self.myself.index:
+            raise Error(f"MOVED {slot} {self.shards[self.owners[slot]].address}")
+
+    def slots_reply(self) -> list:
+        """CLUSTER SLOTS: [start, end, [host, port, id]] per range"""
+        return [[shard.start, shard.end, [shard.host, shard.port, shard.node_id]] for shard in self.shards]
+
+    def shards_reply(self) -> list:
+        """CLUSTER SHARDS: each shard's slot ranges and its one node"""
+        return [
+            ["slots", [shard.start, shard.end],
+             "nodes", [["id", shard.node_id, "port", shard.port, "ip", shard.host, "endpoint", shard.host,
+                        "role", "master", "replication-offset", 0, "health", "online"]]]
+            for shard in self.shards
+        ]
+
+    def nodes_reply(self) -> str:
+        """CLUSTER NODES, one line per node"""
+        lines = []
+        for shard in self.shards:
+            flags = "myself,master" if shard is self.myself else "master"
+            lines.append(f"{shard.node_id} {shard.address}@{shard.port + 10000} {flags} - 0 0 "
+                         f"{shard.index + 1} connected {shard.start}-{shard.end}")
+        return "\n".join(lines) + "\n"
+
+    def info(self) -> str:
+        return (
+            "cluster_state:ok\n"
+            f"cluster_slots_assigned:{CLUSTER_SLOTS}\n"
+            f"cluster_slots_ok:{CLUSTER_SLOTS}\n"
+            f"cluster_known_nodes:{len(self.shards)}\n"
+            f"cluster_size:{len(self.shards)}\n"
+            f"cluster_my_epoch:{self.myself.index + 1}"
+        )
@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import socket
+import time
+import types
+from collections import deque
+
+from app.data.config import VERBOSE
+from app.resp.RESPCodec import RESPDecoder, RESPEncoder, Error
+from app.server.clients import MAXCLIENTS_ERROR
+from app.server.output_limits import OutputBufferLimit
+from app.server.pubsub import SUBSCRIPTION_COMMANDS
+
+logger = logging.getLogger(__name__)
+
+# Commands queued behind one that is waiting before we stop reading the socket
+PENDING_COMMANDS_HIGH_WATER = 4096
+# Reply for a command whose handler failed with something other than Error
+INTERNAL_ERROR = b"-ERR internal error while running the command\r\n"
+
+
+def command_name(command) -> bytes:
+    if isinstance(command, list) and command and isinstance(command[0], bytes):
+        return command[0].upper()
+    return b""
+
+
+class Connection(asyncio.Protocol):
+    """One client connection, parsed as it arrives and answered in place.
+
+    Whatever the transport reads is decoded in ``data_received`` and every
+    command whose handler is a plain function runs right there; the batch's
+    replies go out with a single ``transport.write``. The first command that
+    has to wait (a blocking pop, EXEC, PSYNC, an fsync before replying) moves
+    itself and everything received after it to a task, which keeps replies
+    in order and hands back once it has caught up.
+
+    The connection is also the "writer" the rest of the server keys client
+    state by, so it offers the few StreamWriter methods they use.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.storage = server.storage
+        self.decoder = RESPDecoder()
+        self.transport = None
+        # ClientState once accepted; None if turned away by maxclients
+        self.client = None
+        self.output_limit = OutputBufferLimit(server.storage.config, "normal")
+        # Commands received while a task is running, run by it in order
+        self.pending = deque()
+        self.task = None
+        # Seconds the running command spent blocked on keys, which its
+        # latency leaves out
+        self.blocked_time = 0.0
+        self._reading_paused = False
+        self._writing_paused = False
+        self._drain_waiters = []
+        self._lost = False
+        self._closed = None
+
+    # -- asyncio.Protocol --
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self._closed = asyncio.get_running_loop().create_future()
+        stats = self.server.stats
+        self.client = self.server.clients.add(self, transport)
+        if self.client is None:
+            stats.rejected_connections += 1
+            logger.warning("Rejecting %s: max number of clients reached", transport.get_extra_info("peername"))
+            transport.write(MAXCLIENTS_ERROR)
+            transport.close()
+            return
+        sock = transport.get_extra_info("socket")
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            # Replies are written whole, so never hold one back for Nagle
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        stats.connected_clients += 1
+        stats.total_connections_received += 1
+        logger.log(VERBOSE, "Accepted %s", transport.get_extra_info("peername"))
+
+    def data_received(self, data: bytes):
+        client = self.client
+        if client is None:
+            return
+        client.last_interaction = time.monotonic()
+        client.bytes_in += len(data)
+        try:
+            commands = self.decoder.decode_all(data)
+        except ValueError as e:
+            logger.warning("Protocol error from %s: %s", self.get_extra_info("peername"), e)
+            self.transport.write(RESPEncoder().encode(Error(f"ERR Protocol error: {e}")))
+            self.transport.close()
+            return
+        if self.task is not None:
+            self.pending.extend(commands)
+            if len(self.pending) > PENDING_COMMANDS_HIGH_WATER and not self._reading_paused:
+                self._reading_paused = True
+                self.transport.pause_reading()
+            return
+        replies = []
+        for i, command in enumerate(commands):
+            waiting = self._run(command, replies)
+            if waiting is not None:
+                self.pending.extend(commands[i + 1:])
+                self._start_task(replies, waiting)
+                return
+        self._reply(replies)
+
+    def connection_lost(self, exc):
+        self._lost = True
+        if not self._closed.done():
+            self._closed.set_result(None)
+        if self.client is None:
+            return
+        self.server.stats.connected_clients -= 1
+        logger.log(VERBOSE, "Client id=%d addr=%s closed connection", self.client.id, self.client.addr)
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+        self.pending.clear()
+        for waiter in self._drain_waiters:
+            if not waiter.done():
+                waiter.set_exception(ConnectionResetError("Connection lost"))
+        self._drain_waiters.clear()
+        self.server.forget(self)
+
+    def pause_writing(self):
+        self._writing_paused = True
+
+    def resume_writing(self):
+        self._writing_paused = False
+        for waiter in self._drain_waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._drain_waiters.clear()
+
+    # -- the StreamWriter subset used by the rest of the server --
+
+    def write(self, data: bytes):
+        self.client.bytes_out += len(data)
+        self.transport.write(data)
+
+    async def drain(self):
+        if self._lost:
+            raise ConnectionResetError("Connection lost")
+        if not self._writing_paused:
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._drain_waiters.append(waiter)
+        await waiter
+
+    def get_extra_info(self, name, default=None):
+        return self.transport.get_extra_info(name, default)
+
+    def is_closing(self) -> bool:
+        return self.transport.is_closing()
+
+    def close(self):
+        self.transport.close()
+
+    async def wait_closed(self):
+        await self._closed
+
+    # -- running commands --
+
+    def _run(self, command, replies: list):
+        """Run command, adding its reply to replies; returns the coroutine
+        or async generator to wait on if it could not finish here"""
+        if type(command) is list and command:
+            self.client.last_command = command[0]
+        if replies and command_name(command) in SUBSCRIPTION_COMMANDS:
+            # Subscription confirmations are written as they happen, so
+            # send what comes before them first
+            self._write(replies)
+        try:
+            reply = self.server.run(self, command)
+        except Exception:
+            # Still answer it, or every later reply would go to the wrong command
+            logger.exception("Exception while handling command")
+            replies.append(INTERNAL_ERROR)
+            return None
+        if reply is None:
+            return None
+        if type(reply) is bytes:
+            replies.append(reply)
+            return None
+        return reply
+
+    def _reply(self, replies: list):
+        """Send a finished batch, once its writes are in the AOF"""
+        aof = self.storage.aof
+        if aof is not None:
+            aof.write()
+            if aof.fsync_due():
+                self._start_task(replies, None)
+                return
+        self._write(replies)
+
+    def _write(self, replies: list):
+        transport = self.transport
+        if replies and not transport.is_closing():
+            data = b"".join(replies)
+            self.client.bytes_out += len(data)
+            transport.write(data)
+            size = transport.get_write_buffer_size()
+            if size:
+                self._check_output_limit(size)
+        replies.clear()
+        if self.client.close_after_reply:
+            self.pending.clear()
+            transport.close()
+
+    def _check_output_limit(self, size: int):
+        # Subscribers and replicas answer to their own class's limits
+        if self.server.pubsub.in_subscribed_mode(self):
+            return
+        reason = self.output_limit.check(size)
+        if reason is not None:
+            logger.warning("Disconnecting client id=%d addr=%s: %s", self.client.id, self.client.addr, reason)
+            self.transport.abort()
+
+    def _start_task(self, replies: list, waiting):
+        self.task = asyncio.ensure_future(self._run_pending(replies, waiting))
+
+    async def _run_pending(self, replies: list, waiting):
+        try:
+            while True:
+                if waiting is not None:
+                    if isinstance(waiting, types.AsyncGeneratorType):
+                        # Streaming (PSYNC): what is pending goes out first
+                        self._write(replies)
+                        async for chunk in waiting:
+                            self.client.bytes_out += len(chunk)
+                            self.transport.write(chunk)
+                            await self.drain()
+                    else:
+                        try:
+                            reply = await waiting
+                        except ConnectionResetError:
+                            raise
+                        except Exception:
+                            logger.exception("Exception while handling command")
+                            reply = INTERNAL_ERROR
+                        if reply is not None:
+                            replies.append(reply)
+                    waiting = None
+                while self.pending and waiting is None:
+                    waiting = self._run(self.pending.popleft(), replies)
+                if waiting is not None:
+                    continue
+                # Writes must reach the AOF before their replies are sent
+                if self.storage.aof is not None:
+                    await self.storage.aof.flush()
+                self._write(replies)
+                if not self.pending:
+                    break
+        except ConnectionResetError:
+            pass
+        except Exception:
+            # A streamed reply cut short or a failed AOF flush: the replies
+            # no longer line up with the commands, so drop the client
+            logger.exception("Exception while handling command")
+            self.transport.close()
+        finally:
+            self.task = None
+            if self._reading_paused and not self._lost:
+                self._reading_paused = False
+                self.transport.resume_reading()
@@ -1,53 +1,69 @@
 from app.action import RedisAction
-import types
+from app.commands import COMMAND_TABLE
+from app.resp.RESPCodec import RESPEncoder, Error
+from app.server.clients import ClientRegistry
+from app.server.connection import Connection, command_name
+from app.server.pubsub import SUBSCRIBED_MODE_COMMANDS, PubSub
+from app.server.replication import find_replica
+from app.server.stats import ServerStats
+
+LOADING_ERROR = "LOADING Redis is loading the dataset in memory"
+
+
+def subscribed_mode_error(command):
+    """The error for a command a subscribed connection may not run, if any"""
+    name = command_name(command)
+    if name in SUBSCRIBED_MODE_COMMANDS:
+        return None
+    return Error(f"ERR Can't execute '{name.decode('utf-8', 'replace').lower()}': only (P|S)SUBSCRIBE / "
+                 "(P|S)UNSUBSCRIBE / PING / QUIT / RESET are allowed in this context")
+
+
+def is_allowed_while_loading(command) -> bool:
+    """Commands flagged loading are still served while a full sync is
+    loaded into the keyspace"""
+    entry = COMMAND_TABLE.get(command_name(command))
+    return entry is not None and "loading" in entry.flags
 
 
 class ServerHandler:
+    """State shared by all client connections; called by the listeners to
+    make the Connection protocol for each one"""
+
     def __init__(self, storage):
         self.storage = storage
         self.action = RedisAction(self.storage)
+        storage.propagate = self.action.propagate
+        self.pubsub = PubSub(storage.config)
+        self.stats = ServerStats(storage.config)
+        self.clients = ClientRegistry(storage.config)
+
+    def __call__(self) -> Connection:
+        return Connection(self)
+
+    def run(self, connection, command):
+        """Run one command for a connection: its encoded reply, None for no
+        reply, or a coroutine / async generator if it has to wait"""
+        if self.storage.loading and not is_allowed_while_loading(command):
+            return RESPEncoder().encode(Error(LOADING_ERROR))
+        if self.pubsub.in_subscribed_mode(connection):
+            error = subscribed_mode_error(command)
+            if error is not None:
+                return RESPEncoder().encode(error)
+        return self.action.handle_command_nowait(command, connection)
+
+    def idle_exempt(self, connection) -> bool:
+        """Replicas, subscribers and clients waiting on a command are never
+        closed for being idle"""
+        return (connection.task is not None or self.pubsub.in_subscribed_mode(connection)
+                or find_replica(self.storage.metadata, connection) is not None)
 
-    async def respond(self, reader, writer):
-        is_replica_connection = False
-        try:
-            while True:
-                data = await reader.read(1024)
-                print(f"[{self.storage.metadata.role}] Received: {data}")
-
-                if not data:
-                    print(f"[{self.storage.metadata.role}] Client disconnected")
-                    break
-
-                try:
-                    result = await self.action.handle_input(data, writer)
-                    # Handle async generator (streaming)
-                    if isinstance(result, types.AsyncGeneratorType):
-                        async for chunk in result:
-                            print(f"[{self.storage.metadata.role}] Sending chunk from async generator (possibly PSYNC/RDB)")
-                            writer.write(chunk)
-                            await writer.drain()
-                        print(f"[{self.storage.metadata.role}] Finished sending all chunks (PSYNC/RDB or streaming command)")
-                        
-                        # Check if this was a PSYNC command - if so, keep connection open
-                        if b'PSYNC' in data:
-                            is_replica_connection = True
-                            print(f"[{self.storage.metadata.role}] PSYNC completed - keeping connection open for replica")
-                    else:
-                        writer.write(result)
-                        await writer.drain()
-                        print(f"[{self.storage.metadata.role}] Sent response for command")
-                except Exception as e:
-                    print(f"[{self.storage.metadata.role}] Exception while handling command: {e}")
-                    import traceback
-                    traceback.print_exc()
-        finally:
-            if not is_replica_connection:
-                print(f"[{self.storage.metadata.role}] Closing writer and waiting for it to close...")
-                writer.close()
-                await writer.wait_closed()
-                print(f"[{self.storage.metadata.role}] Writer closed.")
-            else:
-                print(f"[{self.storage.metadata.role}] Keeping replica connection open")
-                # Remove from replica_writers list if connection fails
-                if writer in self.storage.metadata.replica_writers:
-                    self.storage.metadata.replica_writers.remove(writer)
\ No newline at end of file
+    def forget(self, connection):
+        """Drop what a closed connection left behind"""
+        self.storage.metadata.replica_handshakes.pop(connection, None)
+        self.pubsub.remove(connection)
+        self.action.discard_transaction(connection)
+        self.clients.remove(connection)
+        link = find_replica(self.storage.metadata, connection)
+        if link is not None:
+            link.close()
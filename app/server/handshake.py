@@ -1,235 +1,255 @@
 import asyncio
+import logging
 
 from app.data.metadata import ServerMetadata
 from app.resp.RESPCodec import RESPEncoder, RESPDecoder
 from app.action import RedisAction
+from app.data.memory import StagedKeyspace
+from app.data.rdb import RDBStreamLoader
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before reconnecting to a master that went away
+REPLICA_RECONNECT_DELAY = 1
+# Bytes read from the master per call while receiving an RDB
+RDB_TRANSFER_CHUNK = 64 * 1024
+# Bytes read per call from the master's command stream
+REPLICATION_READ_SIZE = 64 * 1024
+# Seconds between REPLCONF ACKs, which the master reports as replica lag
+REPLICA_ACK_PERIOD = 1
 
 
 async def handshake(metadata: ServerMetadata, port: int, storage=None):
-    """Complete handshake with master and handle command propagation"""
+    """Keep a link to the master: handshake, sync, then apply its stream.
+
+    When the link drops we reconnect and ask to continue from our offset,
+    so the master only resends what we missed if it still has it.
+    """
     if metadata.role != "slave":
         return
 
     host, master_port = metadata.replicaof.split(" ")
+    while True:
+        await replicate_from_master(metadata, host, int(master_port), port, storage)
+        metadata.master_link_status = "down"
+        await asyncio.sleep(REPLICA_RECONNECT_DELAY)
+
+
+async def replicate_from_master(metadata: ServerMetadata, host: str, master_port: int, port: int, storage=None):
+    """Run one connection to the master until it drops"""
     try:
-        reader, writer = await asyncio.open_connection(host, int(master_port))
+        reader, writer = await asyncio.open_connection(host, master_port)
         
         # Phase 1: Complete handshake sequence
-        print(f"[{metadata.role}] Starting handshake with master {host}:{master_port}")
-        await perform_handshake_sequence(reader, writer, port, metadata.role)
+        logger.info("Connecting to master %s:%s", host, master_port)
+        await perform_handshake_sequence(reader, writer, port, metadata)
         
-        # Phase 2: Handle FULLRESYNC + RDB transfer
-        print(f"[{metadata.role}] Handshake complete, receiving RDB...")
-        remaining_commands = await handle_fullresync_and_rdb(reader, metadata.role)
+        # Phase 2: Handle FULLRESYNC + RDB transfer, or CONTINUE
+        logger.debug("Handshake complete, receiving RDB")
+        remaining_commands = await handle_fullresync_and_rdb(reader, metadata, storage)
+        metadata.master_link_status = "up"
         
         # Phase 3: Command propagation loop
-        print(f"[{metadata.role}] Starting command propagation...")
-        await handle_command_propagation(reader, writer, storage, metadata.role, remaining_commands)
+        logger.info("Master <-> replica sync finished, streaming commands")
+        await handle_command_propagation(reader, writer, storage, remaining_commands)
         
     except Exception as e:
-        print(f"Unable to connect to master: {e}")
+        logger.warning("Unable to connect to master: %s", e)
     finally:
         if 'writer' in locals():
             writer.close()
-            await writer.wait_closed()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
 
 
-async def perform_handshake_sequence(reader, writer, port, role):
+async def perform_handshake_sequence(reader, writer, port, metadata):
     """Phase 1: Send PING, REPLCONF twice, and PSYNC commands"""
     encoder = RESPEncoder()
     
     # Step 1: PING
-    print(f"[{role}] Sending PING...")
+    logger.debug("Sending PING")
     await send_command(reader, writer, encoder, ["PING"])
     
     # Step 2: REPLCONF listening-port
-    print(f"[{role}] Sending REPLCONF listening-port {port}...")
+    logger.debug("Sending REPLCONF listening-port %s", port)
     await send_command(reader, writer, encoder, ["REPLCONF", "listening-port", str(port)])
     
-    # Step 3: REPLCONF capa
-    print(f"[{role}] Sending REPLCONF capa psync2...")
-    await send_command(reader, writer, encoder, ["REPLCONF", "capa", "psync2"])
+    # Step 3: REPLCONF capa; eof lets the master stream diskless payloads
+    logger.debug("Sending REPLCONF capa eof capa psync2")
+    await send_command(reader, writer, encoder, ["REPLCONF", "capa", "eof", "capa", "psync2"])
     
-    # Step 4: PSYNC (no response handling here, done in next phase)
-    print(f"[{role}] Sending PSYNC...")
-    writer.write(encoder.encode(["PSYNC", "?", "-1"]))
+    # Step 4: PSYNC (no response handling here, done in next phase). After a
+    # sync we know the master's replid and can ask for the next byte we need.
+    if metadata.master_synced:
+        psync = ["PSYNC", metadata.master_replid, str(metadata.master_repl_offset + 1)]
+    else:
+        psync = ["PSYNC", "?", "-1"]
+    logger.debug("Sending %s", " ".join(psync))
+    writer.write(encoder.encode(psync))
     await writer.drain()
 
 
-async def handle_fullresync_and_rdb(reader, role):
-    """Phase 2: Handle FULLRESYNC response and RDB transfer"""
-    # Read FULLRESYNC response + RDB data (might contain commands too)
-    data = await reader.read(1024)
-    print(f"[{role}] FULLRESYNC response: {data}")
-    
-    pos = 0
-    
-    # Parse FULLRESYNC message (either +FULLRESYNC or $SIZE\r\nFULLRESYNC format)
-    if data.startswith(b'+'):
-        # Simple string format: +FULLRESYNC ...\r\n
-        crlf_pos = data.find(b'\r\n')
-        if crlf_pos == -1:
-            raise Exception("Invalid FULLRESYNC simple string format")
-        
-        fullresync_msg = data[1:crlf_pos].decode('utf-8')
-        print(f"[{role}] FULLRESYNC message: {fullresync_msg}")
-        pos = crlf_pos + 2
-        
-    elif data.startswith(b'$'):
-        # Bulk string format: $53\r\nFULLRESYNC ...\r\n
-        crlf_pos = data.find(b'\r\n')
-        if crlf_pos == -1:
-            raise Exception("Invalid FULLRESYNC bulk string format")
-        
-        fullresync_size = int(data[1:crlf_pos])
-        pos = crlf_pos + 2
-        fullresync_msg = data[pos:pos + fullresync_size].decode('utf-8')
-        print(f"[{role}] FULLRESYNC message: {fullresync_msg}")
-        pos += fullresync_size + 2  # +2 for trailing \r\n
-    else:
-        raise Exception(f"Unexpected FULLRESYNC format: {data[:10]}")
-    
-    # Parse RDB bulk string - it might be in the same packet or the next one
-    if pos >= len(data):
-        # RDB data is in the next packet, read it
-        print(f"[{role}] RDB data not in FULLRESYNC packet, reading next packet...")
-        rdb_data = await reader.read(1024)
-        if not rdb_data:
-            raise Exception("Connection closed while waiting for RDB data")
-        
-        if rdb_data[0:1] != b'$':
-            raise Exception(f"Expected RDB bulk string, got: {rdb_data[:10]}")
-        
-        rdb_header_end = rdb_data.find(b'\r\n')
-        if rdb_header_end == -1:
-            raise Exception("Invalid RDB bulk string format")
-            
-        rdb_size = int(rdb_data[1:rdb_header_end])
-        rdb_content_start = rdb_header_end + 2
-        
-        print(f"[{role}] RDB size: {rdb_size} bytes")
-        
-        # Extract RDB data
-        if rdb_size > 0:
-            actual_rdb_data = rdb_data[rdb_content_start:rdb_content_start + rdb_size]
-            print(f"[{role}] RDB transfer complete ({len(actual_rdb_data)} bytes received)")
-        else:
-            print(f"[{role}] Empty RDB received - no data to transfer")
-        
-        # Return any remaining commands that came after RDB
-        remaining_pos = rdb_content_start + rdb_size
-        remaining_commands = rdb_data[remaining_pos:] if remaining_pos < len(rdb_data) else b''
-        
-    elif data[pos:pos+1] != b'$':
-        raise Exception(f"Expected RDB bulk string after FULLRESYNC, got: {data[pos:pos+10]}")
+async def handle_fullresync_and_rdb(reader, metadata, storage=None):
+    """Phase 2: Handle the PSYNC reply and, on a full resync, load the RDB.
+
+    Returns bytes of the replication stream that were read along with the
+    payload; everything after them is still in the reader.
+    """
+    # +FULLRESYNC <replid> <offset> or +CONTINUE [<replid>]; older masters
+    # sent it as a bulk string
+    line = await read_line(reader)
+    if line.startswith(b'$'):
+        line = await read_line(reader)
+    fullresync_msg = line.lstrip(b'+').decode('utf-8')
+    logger.info("Master replied: %s", fullresync_msg)
+
+    if fullresync_msg.startswith("CONTINUE"):
+        # Partial resync: no RDB, the missed stream follows right away
+        parts = fullresync_msg.split()
+        if len(parts) > 1:
+            metadata.master_replid = parts[1]
+        logger.info("Continuing replication from offset %d", metadata.master_repl_offset)
+        return b''
+    if not fullresync_msg.startswith("FULLRESYNC"):
+        raise Exception(f"Unexpected PSYNC reply: {fullresync_msg}")
+
+    # FULLRESYNC <replid> <offset>: the RDB that follows is the master at that offset
+    _, replid, offset = fullresync_msg.split()
+    metadata.master_synced = False
+    remaining_commands = await receive_rdb(reader, storage)
+    metadata.master_replid = replid
+    metadata.master_repl_offset = int(offset)
+    metadata.master_synced = True
+    return remaining_commands
+
+
+async def receive_rdb(reader, storage):
+    """Stream the `$<len>` or `$EOF:<mark>` payload into the keyspace.
+
+    With repl-diskless-load swapdb the keys load beside the current ones
+    and are swapped in at the end, so clients keep reading the old data;
+    otherwise the keyspace is emptied first and clients get -LOADING.
+    """
+    # Masters send newlines as keep-alives while the snapshot is prepared
+    header = b''
+    while not header:
+        header = await read_line(reader)
+    if not header.startswith(b'$'):
+        raise Exception(f"Expected RDB payload, got: {header[:20]}")
+    eof_mark = header[5:] if header.startswith(b'$EOF:') else None
+    length = None if eof_mark is not None else int(header[1:])
+    logger.info("Receiving RDB (%s)", "diskless, until EOF mark" if eof_mark else f"{length} bytes")
+
+    staged = None
+    if storage is not None and storage.config.repl_diskless_load == "swapdb":
+        staged = StagedKeyspace(storage)
+        loader = RDBStreamLoader(storage, staged.store_at, length or 0)
+    elif storage is not None:
+        storage.flush()
+        storage.loading = True
+        loader = RDBStreamLoader(storage, total_bytes=length or 0)
     else:
-        # RDB data is in the same packet
-        rdb_header_end = data.find(b'\r\n', pos)
-        if rdb_header_end == -1:
-            raise Exception("Invalid RDB bulk string format")
-            
-        rdb_size = int(data[pos+1:rdb_header_end])
-        pos = rdb_header_end + 2
-        
-        print(f"[{role}] RDB size: {rdb_size} bytes")
-        
-        # Extract RDB data
-        if rdb_size > 0:
-            rdb_data = data[pos:pos + rdb_size]
-            pos += rdb_size
-            print(f"[{role}] RDB transfer complete ({rdb_size} bytes received)")
+        loader = None
+
+    tail = b''
+    try:
+        if length is not None:
+            remaining = length
+            while remaining:
+                chunk = await reader.read(min(remaining, RDB_TRANSFER_CHUNK))
+                if not chunk:
+                    raise Exception("Connection closed during RDB transfer")
+                remaining -= len(chunk)
+                if loader is not None:
+                    loader.feed(chunk)
         else:
-            print(f"[{role}] Empty RDB received - no data to transfer")
-        
-        # Return any remaining commands that came with RDB
-        remaining_commands = data[pos:] if pos < len(data) else b''
-    
-    if remaining_commands:
-        print(f"[{role}] Found commands after RDB: {remaining_commands}")
-    
-    return remaining_commands
+            # Bytes past the RDB's EOF opcode are the mark, then the stream
+            while True:
+                chunk = await reader.read(RDB_TRANSFER_CHUNK)
+                if not chunk:
+                    raise Exception("Connection closed during RDB transfer")
+                loader.feed(chunk)
+                if loader.done and len(loader.buffer) >= len(eof_mark):
+                    break
+            tail = loader.leftover()
+            if tail[:len(eof_mark)] != eof_mark:
+                raise Exception("RDB payload does not end with the EOF mark")
+            tail = tail[len(eof_mark):]
+        if loader is not None and not loader.done:
+            raise Exception("RDB payload ended before its EOF opcode")
+    finally:
+        if storage is not None:
+            storage.loading = False
 
+    if loader is not None:
+        if staged is not None:
+            storage.swap_keyspace(staged)
+        logger.info("%s", loader.summary())
+        if storage.aof is not None and storage.aof.rewrite_child_pid is None:
+            # The old log describes a dataset we just threw away
+            storage.bgrewriteaof()
+    return tail
 
-async def handle_command_propagation(reader, writer, storage, role, initial_commands=b''):
-    """Phase 3: Handle ongoing command propagation from master"""
+
+async def read_line(reader) -> bytes:
+    line = await reader.readline()
+    if not line:
+        raise Exception("Connection closed by master")
+    return line.rstrip(b'\r\n')
+
+
+async def handle_command_propagation(reader, writer, storage, initial_commands=b''):
+    """Phase 3: Apply the master's command stream.
+
+    Each read is parsed once and the batch goes straight to the handlers;
+    replies the master asked for (GETACK) go back in one write.
+    """
     decoder = RESPDecoder()
-    action = RedisAction(storage) if storage else None
+    action = RedisAction(storage)
+    # decoder.consumed counts from here; the offset comes from FULLRESYNC or our last run
+    offset_base = storage.metadata.master_repl_offset
+    ack_task = asyncio.create_task(send_acks(writer, storage.metadata))
     
     # Process any commands that came with the RDB
-    command_buffer = initial_commands
-    
-    while True:
-        try:
-            # Get data to process
-            if command_buffer:
-                data = command_buffer
-                command_buffer = b''  # Clear buffer after use
-            else:
-                data = await reader.read(1024)
-                if not data:
-                    print(f"[{role}] Master disconnected")
-                    break
-            
-            print(f"[{role}] Received command from master: {data}")
-            
-            # Process all commands in the data (bulk or single)
-            await process_commands_from_stream(decoder, action, data, role, writer)
-            
-        except Exception as e:
-            print(f"[{role}] Error in command propagation: {e}")
-            import traceback
-            traceback.print_exc()
-            break
-
-
-async def process_commands_from_stream(decoder, action, data, role, writer=None):
-    """Process all RESP commands from a data stream (handles bulk commands)"""
-    if not action:
-        return
-    
+    data = initial_commands
     try:
-        # Feed data to decoder and process first command
-        first_command = decoder.decode(data)
-        if first_command:
-            await execute_command(action, first_command, role, writer)
-        
-        # Process all remaining commands from decoder buffer
         while True:
-            command = decoder.decode(b'')  # Process from internal buffer
-            if command is None:
-                break
-            await execute_command(action, command, role, writer)
-            
-    except Exception as e:
-        print(f"[{role}] Error processing commands: {e}")
-        import traceback
-        traceback.print_exc()
+            if not data:
+                data = await reader.read(REPLICATION_READ_SIZE)
+                if not data:
+                    logger.warning("Master disconnected")
+                    break
+            frames = decoder.decode_all_with_offsets(data)
+            data = b''
+            replies = await action.apply_replicated(frames, offset_base)
+            if replies:
+                writer.write(b''.join(replies))
+                await writer.drain()
+    except Exception:
+        logger.exception("Error in command propagation")
+    finally:
+        ack_task.cancel()
 
 
-async def execute_command(action, command, role, writer=None):
-    """Execute a single command on the replica"""
-    print(f"[{role}] Parsed command: {command}")
-    
-    # Convert command back to RESP format for action.handle_input
+async def send_acks(writer, metadata):
+    """Tell the master how far we got, once per REPLICA_ACK_PERIOD"""
     encoder = RESPEncoder()
-    command_bytes = encoder.encode(command)
-    
-    # Execute the command and get response
-    result = await action.handle_input(command_bytes, writer=writer)
-    
-    # Send any response back to master (RedisAction decides what needs responses)
-    if result and writer:
-        writer.write(result)
+    while True:
+        await asyncio.sleep(REPLICA_ACK_PERIOD)
+        writer.write(encoder.encode(["REPLCONF", "ACK", str(metadata.master_repl_offset)]))
         await writer.drain()
-        print(f"[{role}] Sent response back to master")
-    
-    print(f"[{role}] Command executed successfully")
 
 
 async def send_command(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, encoder: RESPEncoder, command: list[str]):
     """Send a command and wait for response during handshake"""
     writer.write(encoder.encode(command))
     await writer.drain()
-    response = await reader.read(1024)
-    print(f"[slave] Handshake response: {response}")
-    return response
\ No newline at end of file
+    # Handshake replies are single lines; reading exactly one leaves
+    # whatever follows for the next phase
+    response = await reader.readline()
+    if response.startswith(b'$') and not response.startswith(b'$-1'):
+        response += await reader.readline()
+    logger.debug("Handshake response: %r", response)
+    return response
@@ -0,0 +1,30 @@
+import time
+
+
+class OutputBufferLimit:
+    """client-output-buffer-limit enforcement for one connection.
+
+    ``check(size)`` is called with the bytes the connection has pending
+    after each write and returns why it should be dropped, if it should:
+    at once past the hard limit, or after staying past the soft limit for
+    its number of seconds.
+    """
+
+    def __init__(self, config, client_class: str):
+        self.config = config
+        self.client_class = client_class
+        self._soft_limit_since = None
+
+    def check(self, size: int):
+        hard, soft, soft_seconds = self.config.client_output_buffer_limit[self.client_class]
+        if hard and size >= hard:
+            return f"output buffer {size} bytes over hard limit {hard}"
+        if soft and size >= soft:
+            now = time.monotonic()
+            if self._soft_limit_since is None:
+                self._soft_limit_since = now
+            elif now - self._soft_limit_since >= soft_seconds:
+                return f"output buffer over soft limit {soft} for {soft_seconds}s"
+        else:
+            self._soft_limit_since = None
+        return None
@@ -0,0 +1,195 @@
+import logging
+
+from app.data.pattern import compile_glob, literal_prefix
+from app.decorators.singleton import singleton
+from app.resp.RESPCodec import RESPEncoder
+from app.server.output_limits import OutputBufferLimit
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIPTION_COMMANDS = (b"SUBSCRIBE", b"PSUBSCRIBE", b"UNSUBSCRIBE", b"PUNSUBSCRIBE")
+# All a connection may run while it has subscriptions
+SUBSCRIBED_MODE_COMMANDS = SUBSCRIPTION_COMMANDS + (b"PING", b"QUIT", b"RESET")
+
+
+class Subscriber:
+    """A connection's subscriptions and the writes pushed to it.
+
+    Messages go straight to the transport, which buffers whatever the socket
+    does not take; nothing awaits the client, and one whose buffer stays
+    over the pubsub output limits is disconnected instead.
+    """
+
+    def __init__(self, pubsub, writer):
+        self.pubsub = pubsub
+        self.writer = writer
+        self.channels = set()
+        self.patterns = set()
+        self.closed = False
+        self.output_limit = OutputBufferLimit(pubsub.config, "pubsub")
+
+    def subscriptions(self) -> int:
+        return len(self.channels) + len(self.patterns)
+
+    def send(self, data: bytes):
+        transport = self.writer.transport
+        if self.closed or transport is None or transport.is_closing():
+            return
+        self.writer.client.bytes_out += len(data)
+        transport.write(data)
+        reason = self.output_limit.check(transport.get_write_buffer_size())
+        if reason is not None:
+            self.close(reason)
+
+    def close(self, reason: str = ""):
+        if self.closed:
+            return
+        self.closed = True
+        if reason:
+            peer = self.writer.get_extra_info("peername") or ("?", 0)
+            logger.warning("Disconnecting subscriber %s:%s: %s", peer[0], peer[1], reason)
+        self.pubsub.remove(self.writer)
+        transport = self.writer.transport
+        if transport is not None:
+            transport.abort()
+
+
+class PatternIndex:
+    """Pattern subscriptions bucketed by their literal prefix.
+
+    A channel is only tested against buckets whose prefix it starts with,
+    found with one dict lookup per distinct prefix length. Patterns that are
+    a prefix followed by ``*`` need no matching at all; the others run the
+    matcher compiled when the pattern was first subscribed.
+    """
+
+    def __init__(self):
+        # prefix -> {pattern: (matcher or None, {Subscriber: None})}
+        self.buckets = {}
+        # prefix length -> number of buckets with a prefix that long
+        self.prefix_lengths = {}
+        self.count = 0
+
+    def add(self, pattern: bytes, subscriber) -> bool:
+        prefix = literal_prefix(pattern)
+        bucket = self.buckets.get(prefix)
+        if bucket is None:
+            bucket = self.buckets[prefix] = {}
+            self.prefix_lengths[len(prefix)] = self.prefix_lengths.get(len(prefix), 0) + 1
+        entry = bucket.get(pattern)
+        if entry is None:
+            rest = pattern[len(prefix):]
+            matcher = None if rest and not rest.strip(b"*") else compile_glob(pattern)
+            entry = bucket[pattern] = (matcher, {})
+            self.count += 1
+        if subscriber in entry[1]:
+            return False
+        entry[1][subscriber] = None
+        return True
+
+    def remove(self, pattern: bytes, subscriber) -> bool:
+        prefix = literal_prefix(pattern)
+        bucket = self.buckets.get(prefix)
+        entry = bucket.get(pattern) if bucket is not None else None
+        if entry is None or subscriber not in entry[1]:
+            return False
+        del entry[1][subscriber]
+        if not entry[1]:
+            del bucket[pattern]
+            self.count -= 1
+            if not bucket:
+                del self.buckets[prefix]
+                self.prefix_lengths[len(prefix)] -= 1
+                if not self.prefix_lengths[len(prefix)]:
+                    del self.prefix_lengths[len(prefix)]
+        return True
+
+    def matches(self, channel: bytes):
+        """(pattern, subscribers) for every pattern matching channel"""
+        for length in list(self.prefix_lengths):
+            if length > len(channel):
+                continue
+            bucket = self.buckets.get(channel[:length])
+            if bucket is None:
+                continue
+            for pattern, (matcher, subscribers) in list(bucket.items()):
+                if matcher is None or matcher(channel):
+                    yield pattern, subscribers
+
+
+@singleton
+class PubSub:
+    """Channel and pattern subscriptions of every connection"""
+
+    def __init__(self, config):
+        self.config = config
+        # channel -> {Subscriber: None}, a dict as an ordered set
+        self.channels = {}
+        self.patterns = PatternIndex()
+        # writer -> Subscriber, for connections with subscriptions
+        self.subscribers = {}
+
+    def subscriber(self, writer) -> Subscriber:
+        subscriber = self.subscribers.get(writer)
+        if subscriber is None:
+            subscriber = self.subscribers[writer] = Subscriber(self, writer)
+        return subscriber
+
+    def in_subscribed_mode(self, writer) -> bool:
+        subscriber = self.subscribers.get(writer)
+        return subscriber is not None and subscriber.subscriptions() > 0
+
+    def subscribe(self, subscriber: Subscriber, channel: bytes):
+        if channel not in subscriber.channels:
+            subscriber.channels.add(channel)
+            self.channels.setdefault(channel, {})[subscriber] = None
+
+    def unsubscribe(self, subscriber: Subscriber, channel: bytes):
+        if channel not in subscriber.channels:
+            return
+        subscriber.channels.discard(channel)
+        subscribers = self.channels.get(channel)
+        subscribers.pop(subscriber, None)
+        if not subscribers:
+            del self.channels[channel]
+
+    def psubscribe(self, subscriber: Subscriber, pattern: bytes):
+        if pattern not in subscriber.patterns:
+            subscriber.patterns.add(pattern)
+            self.patterns.add(pattern, subscriber)
+
+    def punsubscribe(self, subscriber: Subscriber, pattern: bytes):
+        if pattern in subscriber.patterns:
+            subscriber.patterns.discard(pattern)
+            self.patterns.remove(pattern, subscriber)
+
+    def remove(self, writer):
+        """Drop every subscription of a connection that is going away"""
+        subscriber = self.subscribers.pop(writer, None)
+        if subscriber is None:
+            return
+        for channel in list(subscriber.channels):
+            self.unsubscribe(subscriber, channel)
+        for pattern in list(subscriber.patterns):
+            self.punsubscribe(subscriber, pattern)
+
+    def publish(self, channel: bytes, message: bytes) -> int:
+        """Send message to channel's subscribers; returns how many got it.
+
+        Each message is encoded once and the same bytes go to every
+        subscriber of the channel (or of one pattern).
+        """
+        encoder = RESPEncoder()
+        receivers = 0
+        subscribers = self.channels.get(channel)
+        if subscribers:
+            data = encoder.encode([b"message", channel, message])
+            for subscriber in list(subscribers):
+                subscriber.send(data)
+                receivers += 1
+        for pattern, subscribers in self.patterns.matches(channel):
+            data = encoder.encode([b"pmessage", pattern, channel, message])
+            for subscriber in list(subscribers):
+                subscriber.send(data)
+                receivers += 1
+        return receivers
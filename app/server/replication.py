@@ -0,0 +1,292 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+from app.data.rdb import RDB_CRON_PERIOD, fork_save_rdb, fork_write_rdb_pipe
+from app.server.output_limits import OutputBufferLimit
+
+logger = logging.getLogger(__name__)
+
+# Bytes per chunk when streaming a snapshot to replicas
+SYNC_CHUNK_SIZE = 64 * 1024
+# Diskless chunks buffered per replica before the pipe stops being read
+SYNC_QUEUE_CHUNKS = 4
+# Length of the random delimiter closing a `$EOF:` diskless payload
+RDB_EOF_MARK_SIZE = 40
+
+
+class ReplicaLink:
+    """Master side of one connected replica.
+
+    Propagated commands are encoded once by the master and the same bytes
+    object is queued on every link; each link drains its queue from a sender
+    task of its own, so a client's write never waits on a replica socket.
+    Until ``start()`` the link only queues, which keeps the stream behind the
+    sync payload sent on the same socket.
+    """
+
+    def __init__(self, metadata, config, writer, listening_port=None, capabilities=()):
+        self.metadata = metadata
+        self.config = config
+        self.writer = writer
+        peer = writer.get_extra_info("peername") or ("?", 0)
+        self.ip = peer[0]
+        self.port = listening_port if listening_port is not None else peer[1]
+        # From REPLCONF capa; "eof" means it accepts diskless `$EOF:` payloads
+        self.capabilities = set(capabilities)
+        self.state = "wait_bgsave"
+        # FullSync this replica is receiving, if any
+        self.sync = None
+        self.queue = deque()
+        self.queued_bytes = 0
+        # Last offset the replica acknowledged with REPLCONF ACK, and when
+        self.ack_offset = 0
+        self.ack_time = time.time()
+        self.closed = False
+        self.output_limit = OutputBufferLimit(config, "replica")
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        """The sync payload is out; stream everything queued from now on"""
+        if self.closed:
+            return
+        self.state = "online"
+        self.sync = None
+        self._task = asyncio.create_task(self._send_loop())
+        self._wakeup.set()
+
+    def feed(self, data: bytes):
+        if self.closed:
+            return
+        self.queue.append(data)
+        self.queued_bytes += len(data)
+        if self._task is not None:
+            self._wakeup.set()
+        self._check_limits()
+
+    def ack(self, offset: int):
+        self.ack_offset = offset
+        self.ack_time = time.time()
+
+    def output_buffer_size(self) -> int:
+        """Bytes queued here plus bytes the transport has not sent yet"""
+        transport = self.writer.transport
+        pending = transport.get_write_buffer_size() if transport is not None else 0
+        return self.queued_bytes + pending
+
+    def _check_limits(self):
+        reason = self.output_limit.check(self.output_buffer_size())
+        if reason is not None:
+            self.close(reason)
+
+    async def _send_loop(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self.queue:
+                    # Coalesce everything queued into one write
+                    chunks = list(self.queue)
+                    self.queue.clear()
+                    self.queued_bytes = 0
+                    self.writer.write(b"".join(chunks))
+                    await self.writer.drain()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Failed to write to replica %s:%s: %s", self.ip, self.port, e)
+            self.close("write failed")
+
+    def close(self, reason: str = ""):
+        if self.closed:
+            return
+        self.closed = True
+        if reason:
+            logger.warning("Disconnecting replica %s:%s: %s", self.ip, self.port, reason)
+        if self in self.metadata.replicas:
+            self.metadata.replicas.remove(self)
+        self.queue.clear()
+        self.queued_bytes = 0
+        if self.sync is not None:
+            self.sync.detach(self)
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+        transport = self.writer.transport
+        if transport is not None:
+            transport.abort()
+
+    def info(self, master_offset: int) -> str:
+        return (
+            f"ip={self.ip},port={self.port},state={self.state},offset={self.ack_offset},"
+            f"lag={int(time.time() - self.ack_time)},lag_bytes={max(master_offset - self.ack_offset, 0)},"
+            f"output_buffer={self.output_buffer_size()}"
+        )
+
+
+def find_replica(metadata, writer):
+    for link in metadata.replicas:
+        if link.writer is writer:
+            return link
+    return None
+
+
+class FullSync:
+    """One snapshot of the keyspace sent to every replica attached to it.
+
+    A forked child produces the RDB, so it is consistent as of ``offset``
+    while the master keeps serving writes; each attached link queues the
+    stream from that offset on. Diskless syncs pipe the child's output to
+    all replicas at once, paced by the slowest; disk syncs write a temp file
+    first that each replica then reads at its own pace. Either way only a
+    few chunks per replica are held in memory.
+    """
+
+    def __init__(self, storage, diskless: bool):
+        self.storage = storage
+        self.diskless = diskless
+        self.links = []
+        # Replication offset the snapshot corresponds to, set at fork time
+        self.offset = None
+        self.started = asyncio.Event()
+        # Disk syncs: the RDB file is complete (or failed)
+        self.saved = asyncio.Event()
+        self.failed = False
+        self.path = None
+        # Diskless: link -> bounded queue of chunks, None terminates
+        self.queues = {}
+        self.task = asyncio.create_task(self._run())
+
+    def can_attach(self, diskless: bool) -> bool:
+        if self.failed or diskless != self.diskless:
+            return False
+        if self.offset is None:
+            return True
+        # Once the child runs, late replicas copy the stream queued on the
+        # first one (as Redis does); a diskless stream cannot be rewound
+        return not self.diskless and not self.saved.is_set() and bool(self.links)
+
+    def attach(self, link):
+        if self.offset is not None:
+            first = self.links[0]
+            link.queue = deque(first.queue)
+            link.queued_bytes = first.queued_bytes
+        link.sync = self
+        self.links.append(link)
+        if self.diskless:
+            self.queues[link] = asyncio.Queue(maxsize=SYNC_QUEUE_CHUNKS)
+
+    def detach(self, link):
+        if link in self.links:
+            self.links.remove(link)
+        queue = self.queues.pop(link, None)
+        if queue is not None:
+            # Unblock a fan-out waiting on this replica's full queue, and the
+            # replica's stream() waiting on an empty one
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+        self._remove_file_when_unused()
+
+    async def stream(self, link):
+        """Yield the RDB payload for link once the snapshot is available"""
+        link.state = "send_bulk"
+        if self.diskless:
+            queue = self.queues.get(link)
+            while queue is not None:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                yield chunk
+        else:
+            await self.saved.wait()
+            if not self.failed:
+                with open(self.path, "rb") as f:
+                    yield b"$%d\r\n" % os.fstat(f.fileno()).st_size
+                    while chunk := f.read(SYNC_CHUNK_SIZE):
+                        yield chunk
+        if self.failed:
+            link.close("snapshot for full sync failed")
+        elif link in self.links:
+            self.links.remove(link)
+            self.queues.pop(link, None)
+            self._remove_file_when_unused()
+
+    def _fork(self):
+        self.offset = self.storage.metadata.master_repl_offset
+        # Anything queued before the fork is already in the snapshot
+        for link in self.links:
+            link.queue.clear()
+            link.queued_bytes = 0
+        if self.diskless:
+            pid, read_fd = fork_write_rdb_pipe(self.storage)
+        else:
+            self.path = os.path.join(self.storage.dir or ".", f"temp-repl-{os.getpid()}-{id(self)}.rdb")
+            pid, read_fd = fork_save_rdb(self.storage, self.path), None
+        self.started.set()
+        return pid, read_fd
+
+    async def _run(self):
+        if self.diskless:
+            await asyncio.sleep(self.storage.config.repl_diskless_sync_delay)
+        try:
+            pid, read_fd = self._fork()
+        except OSError as e:
+            logger.warning("Unable to start full sync: %s", e)
+            self._fail()
+            return
+        logger.info("Full sync started for %d replica(s) at offset %d (%s)",
+                    len(self.links), self.offset, "diskless" if self.diskless else "disk")
+        try:
+            if self.diskless:
+                mark = os.urandom(RDB_EOF_MARK_SIZE // 2).hex().encode()
+                await self._fan_out(b"$EOF:%b\r\n" % mark)
+                await self._pipe_to_replicas(read_fd)
+            while True:
+                reaped, status = os.waitpid(pid, os.WNOHANG)
+                if reaped:
+                    break
+                await asyncio.sleep(RDB_CRON_PERIOD)
+        except Exception:
+            logger.exception("Full sync failed")
+            self._fail()
+            return
+        if os.waitstatus_to_exitcode(status) != 0:
+            # Without the closing mark the replicas never accept the payload
+            self._fail()
+            return
+        if self.diskless:
+            await self._fan_out(mark)
+            await self._fan_out(None)
+        self.saved.set()
+        self._remove_file_when_unused()
+
+    async def _pipe_to_replicas(self, read_fd: int):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=SYNC_CHUNK_SIZE)
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(read_fd, "rb", buffering=0))
+        try:
+            while chunk := await reader.read(SYNC_CHUNK_SIZE):
+                await self._fan_out(chunk)
+        finally:
+            transport.close()
+
+    async def _fan_out(self, chunk):
+        await asyncio.gather(*(queue.put(chunk) for queue in list(self.queues.values())))
+
+    def _fail(self):
+        self.failed = True
+        self.started.set()
+        self.saved.set()
+        for link in list(self.links):
+            link.close("snapshot for full sync failed")
+        self._remove_file_when_unused()
+
+    def _remove_file_when_unused(self):
+        if self.path is not None and self.saved.is_set() and not self.links:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            self.path = None
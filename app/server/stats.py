@@ -0,0 +1,145 @@
+import asyncio
+import time
+from collections import deque
+
+from app.decorators.singleton import singleton
+
+# Instantaneous ops/sec is the mean of this many samples taken STATS_PERIOD apart
+STATS_SAMPLES = 16
+STATS_PERIOD = 0.1
+# Slow log entries keep this many arguments, each cut to this many bytes
+SLOWLOG_ENTRY_MAX_ARGC = 32
+SLOWLOG_ENTRY_MAX_STRING = 128
+# Latency buckets are powers of two in usec; bucket i counts calls that
+# took at most 2**i, so 64 covers anything a clock can measure
+LATENCY_BUCKETS = 64
+
+
+class CommandStats:
+    """Calls and time spent in one command, kept on its table entry"""
+
+    __slots__ = ("calls", "usec", "rejected_calls", "failed_calls", "histogram")
+
+    def __init__(self):
+        self.calls = 0
+        self.usec = 0
+        # Refused before running (wrong arity, MOVED...) / ran and errored
+        self.rejected_calls = 0
+        self.failed_calls = 0
+        self.histogram = None
+
+    def record(self, usec: int):
+        self.calls += 1
+        self.usec += usec
+        if self.histogram is None:
+            self.histogram = [0] * LATENCY_BUCKETS
+        self.histogram[(usec - 1).bit_length() if usec > 1 else 0] += 1
+
+    def info(self) -> str:
+        return (f"calls={self.calls},usec={self.usec},usec_per_call={self.usec / self.calls:.2f},"
+                f"rejected_calls={self.rejected_calls},failed_calls={self.failed_calls}")
+
+    def histogram_reply(self) -> list:
+        """LATENCY HISTOGRAM's cumulative count at each bucket bound"""
+        buckets = []
+        total = 0
+        if self.histogram is not None:
+            last = max(i for i, count in enumerate(self.histogram) if count)
+            for i in range(last + 1):
+                total += self.histogram[i]
+                buckets += [1 << i, total]
+        return ["calls", self.calls, "histogram_usec", buckets]
+
+
+def _slowlog_args(argv: list) -> list:
+    args = argv[:SLOWLOG_ENTRY_MAX_ARGC]
+    if len(argv) > SLOWLOG_ENTRY_MAX_ARGC:
+        args[-1] = b"... (%d more arguments)" % (len(argv) - SLOWLOG_ENTRY_MAX_ARGC + 1)
+    return [
+        arg if len(arg) <= SLOWLOG_ENTRY_MAX_STRING
+        else arg[:SLOWLOG_ENTRY_MAX_STRING] + b"... (%d more bytes)" % (len(arg) - SLOWLOG_ENTRY_MAX_STRING)
+        for arg in args
+    ]
+
+
+@singleton
+class ServerStats:
+    """Server wide counters behind INFO stats/clients/commandstats, SLOWLOG
+    and LATENCY HISTOGRAM. Per command numbers live on each command's
+    table entry so recording a call costs no lookups."""
+
+    def __init__(self, config):
+        self.config = config
+        self.start_time = time.time()
+        self.total_commands_processed = 0
+        self.total_connections_received = 0
+        self.connected_clients = 0
+        self.rejected_connections = 0
+        # Newest first, as SLOWLOG GET returns them
+        self.slowlog = deque()
+        self.slowlog_next_id = 0
+        self._ops_samples = deque([0] * STATS_SAMPLES, maxlen=STATS_SAMPLES)
+        self._last_sample = (time.monotonic(), 0)
+
+    def call(self, command, argv: list, usec: int, writer=None):
+        """Account for one command run that took usec"""
+        command.stats.record(usec)
+        self.total_commands_processed += 1
+        threshold = self.config.slowlog_log_slower_than
+        if 0 <= threshold <= usec and "skip-slowlog" not in command.flags:
+            self.log_slow(argv, usec, writer)
+
+    def log_slow(self, argv: list, usec: int, writer=None):
+        # Commands from the AOF or the master stream have no client
+        client = writer.client if writer is not None else None
+        address, name = (client.addr, client.name) if client is not None else ("", "")
+        self.slowlog.appendleft([self.slowlog_next_id, int(time.time()), usec, _slowlog_args(argv), address, name])
+        self.slowlog_next_id += 1
+        while len(self.slowlog) > max(self.config.slowlog_max_len, 0):
+            self.slowlog.pop()
+
+    def reset(self, storage, commands):
+        """CONFIG RESETSTAT: zero the counters, keeping the slow log"""
+        for command in commands:
+            command.stats = CommandStats()
+        self.total_commands_processed = 0
+        self.total_connections_received = 0
+        self.rejected_connections = 0
+        storage.expired_keys = storage.evicted_keys = 0
+        storage.keyspace_hits = storage.keyspace_misses = 0
+        self._last_sample = (time.monotonic(), 0)
+
+    def sample(self):
+        """Take an ops/sec sample; called every STATS_PERIOD"""
+        now = time.monotonic()
+        last_time, last_count = self._last_sample
+        if now > last_time:
+            self._ops_samples.append((self.total_commands_processed - last_count) / (now - last_time))
+        self._last_sample = (now, self.total_commands_processed)
+
+    def instantaneous_ops_per_sec(self) -> int:
+        return int(sum(self._ops_samples) / len(self._ops_samples))
+
+    def clients_info(self, storage) -> str:
+        return (
+            f"connected_clients:{self.connected_clients}\n"
+            f"blocked_clients:{storage.blocking.blocked_clients()}"
+        )
+
+    def info(self, storage) -> str:
+        return (
+            f"total_connections_received:{self.total_connections_received}\n"
+            f"total_commands_processed:{self.total_commands_processed}\n"
+            f"instantaneous_ops_per_sec:{self.instantaneous_ops_per_sec()}\n"
+            f"rejected_connections:{self.rejected_connections}\n"
+            f"expired_keys:{storage.expired_keys}\n"
+            f"evicted_keys:{storage.evicted_keys}\n"
+            f"keyspace_hits:{storage.keyspace_hits}\n"
+            f"keyspace_misses:{storage.keyspace_misses}"
+        )
+
+
+async def stats_cron(stats):
+    while True:
+        await asyncio.sleep(STATS_PERIOD)
+        stats.sample()
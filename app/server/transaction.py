@@ -0,0 +1,45 @@
+EXECABORT_ERROR = "EXECABORT Transaction discarded because of previous errors."
+# Run straight away inside MULTI instead of being queued
+TRANSACTION_COMMANDS = ("multi", "exec", "discard", "watch")
+
+
+class Transaction:
+    """A connection's MULTI queue and WATCHed keys.
+
+    Watching a key remembers its version in the store; EXEC goes ahead
+    only if none of those versions moved since.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        # Commands queued since MULTI, None outside of one
+        self.queued = None
+        # A queued command was rejected, so EXEC must refuse to run
+        self.failed = False
+        # key -> version when it was watched
+        self.watched = {}
+
+    @property
+    def in_multi(self) -> bool:
+        return self.queued is not None
+
+    def watch(self, key: bytes):
+        if key in self.watched:
+            return
+        # Expire it now so an already stale key does not look modified later
+        self.storage.expire_if_needed(key)
+        self.watched[key] = self.storage.watch_key(key)
+
+    def modified(self) -> bool:
+        """Whether a watched key was written, or expired, since WATCH"""
+        storage = self.storage
+        for key, version in self.watched.items():
+            storage.expire_if_needed(key)
+            if storage.key_version(key) != version:
+                return True
+        return False
+
+    def unwatch(self):
+        for key in self.watched:
+            self.storage.unwatch_key(key)
+        self.watched = {}
@@ -0,0 +1,86 @@
+import socket
+
+import pytest
+
+from app.benchmark.load import free_port, start_server, stop_server
+from app.resp.RESPCodec import RESPDecoder, RESPEncoder
+
+HOST = "127.0.0.1"
+
+
+class Client:
+    """Blocking RESP client: send commands, read back decoded replies"""
+
+    def __init__(self, port: int):
+        self.sock = socket.create_connection((HOST, port), timeout=10)
+        self.encoder = RESPEncoder()
+        self.decoder = RESPDecoder()
+        self.replies = []
+
+    def send(self, *commands):
+        """Write each command (a list of arguments) without waiting"""
+        self.sock.sendall(b"".join(
+            self.encoder.encode([arg if isinstance(arg, bytes) else str(arg).encode() for arg in argv])
+            for argv in commands
+        ))
+
+    def send_raw(self, data: bytes):
+        self.sock.sendall(data)
+
+    def read(self, count: int = 1) -> list:
+        while len(self.replies) < count:
+            data = self.sock.recv(64 * 1024)
+            if not data:
+                raise ConnectionError("server closed the connection")
+            self.replies += self.decoder.decode_all(data)
+        replies, self.replies = self.replies[:count], self.replies[count:]
+        return replies
+
+    def call(self, *argv):
+        self.send(argv)
+        return self.read()[0]
+
+    def call_raw(self, *argv) -> bytes:
+        """The reply as sent, for what decoding would blur (null bulk and
+        null array both decode to None)"""
+        self.send(argv)
+        return self.sock.recv(64 * 1024)
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def start(tmp_path):
+    """start(*server_args) runs a server in tmp_path and returns its port;
+    every server started is stopped after the test"""
+    processes = []
+
+    def start(*args) -> int:
+        port = free_port(HOST)
+        processes.append(start_server(HOST, port, ["--dir", str(tmp_path), *map(str, args)]))
+        return port
+
+    yield start
+    for process in processes:
+        stop_server(process)
+
+
+@pytest.fixture
+def connect():
+    """connect(port) opens a Client, closed after the test"""
+    clients = []
+
+    def connect(port: int) -> Client:
+        clients.append(Client(port))
+        return clients[-1]
+
+    yield connect
+    for client in clients:
+        client.close()
+
+
+@pytest.fixture
+def client(start, connect) -> Client:
+    """A client of a fresh server with the default configuration"""
+    return connect(start())
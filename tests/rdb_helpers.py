@@ -0,0 +1,29 @@
+"""Hand-encoded RDB payloads for the loader tests"""
+import struct
+
+from app.data.rdb import (
+    RDB_OPCODE_EOF,
+    RDB_OPCODE_EXPIRETIME_MS,
+    RDB_OPCODE_SELECTDB,
+    encode_length,
+    encode_string,
+)
+
+
+def build_rdb(records, version: int = 11) -> bytes:
+    """An RDB holding records, each (rdb_type, key, encoded value, expire)"""
+    out = [b"REDIS%04d" % version, bytes([RDB_OPCODE_SELECTDB]), encode_length(0)]
+    for rdb_type, key, value, expire in records:
+        if expire is not None:
+            out.append(bytes([RDB_OPCODE_EXPIRETIME_MS]) + struct.pack("<Q", expire))
+        out.append(bytes([rdb_type]) + encode_string(key) + value)
+    out.append(bytes([RDB_OPCODE_EOF]) + b"\0" * 8)
+    return b"".join(out)
+
+
+def encode_list(items) -> bytes:
+    return encode_length(len(items)) + b"".join(encode_string(item) for item in items)
+
+
+def encode_hash(pairs) -> bytes:
+    return encode_length(len(pairs)) + b"".join(encode_string(field) + encode_string(value) for field, value in pairs)
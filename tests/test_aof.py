@@ -0,0 +1,124 @@
+import logging
+
+import pytest
+
+from app.data.aof import AppendOnlyFile, absolute_expiry_argv, replay_aof, rewrite_aof
+from app.data.config import ServerConfig
+from app.data.datatypes import HashValue, ListValue, SetValue, StreamValue, ZSetValue
+from app.data.expiry import get_current_time
+from app.data.memory import RedisStore
+from app.data.metadata import ServerMetadata
+from app.resp.RESPCodec import RESPDecoder, RESPEncoder
+
+FAR_FUTURE = 4102444800000
+
+
+def new_store() -> RedisStore:
+    return RedisStore(None, None, ServerMetadata(None, "0" * 40, 0))
+
+
+def snapshot(store) -> dict:
+    """key -> (value as builtins, expiry) for every live key"""
+    result = {}
+    for key, entry in store.memory.items():
+        value = entry.value
+        if isinstance(value, ListValue):
+            value = list(value)
+        elif isinstance(value, SetValue):
+            value = sorted(value.members())
+        elif isinstance(value, (HashValue, ZSetValue)):
+            value = dict(value.items())
+        elif isinstance(value, StreamValue):
+            value = list(value.entries()), value.last_id
+        result[key] = value, store.expires.get(key)
+    return result
+
+
+@pytest.mark.parametrize("argv, option, ttl_ms", [
+    ([b"SET", b"k", b"v", b"EX", b"100"], 3, 100_000),
+    ([b"SET", b"k", b"v", b"px", b"2500"], 3, 2500),
+    ([b"set", b"k", b"v", b"NX", b"GET", b"Ex", b"7"], 5, 7000),
+    (["SET", "k", "v", "PX", "10"], 3, 10),
+])
+def test_relative_set_expiry_becomes_pxat(argv, option, ttl_ms):
+    before = int(get_current_time())
+    rewritten = absolute_expiry_argv(argv)
+    after = get_current_time()
+    assert rewritten[:option] == argv[:option]
+    assert rewritten[option] == b"PXAT"
+    assert before + ttl_ms <= int(rewritten[option + 1]) <= after + ttl_ms
+    assert len(rewritten) == len(argv)
+
+
+@pytest.mark.parametrize("argv", [
+    [b"SET", b"k", b"v"],
+    [b"SET", b"k", b"EX"],
+    [b"SET", b"EX", b"PX", b"PXAT", b"100"],
+    [b"SET", b"k", b"v", b"PXAT", b"100"],
+    [b"PEXPIREAT", b"k", b"100"],
+    [b"RPUSH", b"k", b"a", b"EX", b"5"],
+])
+def test_other_commands_are_logged_as_is(argv):
+    assert absolute_expiry_argv(argv) == argv
+
+
+def test_feed_writes_absolute_expiry(tmp_path):
+    aof = AppendOnlyFile(str(tmp_path / "appendonly.aof"), ServerConfig())
+    aof.feed([b"SET", b"k", b"v", b"EX", b"60"])
+    aof.write()
+    [logged] = RESPDecoder().decode_all((tmp_path / "appendonly.aof").read_bytes())
+    assert logged[:4] == [b"SET", b"k", b"v", b"PXAT"]
+    assert int(logged[4]) > get_current_time() + 59_000
+
+
+def test_rewrite_then_replay_rebuilds_the_keyspace(tmp_path):
+    store = new_store()
+    config = store.config
+    stream = StreamValue()
+    for i in range(1, 151):
+        stream.add((i, 0), [b"field", b"v%d" % i], config)
+    stream.add((200, 3), [b"other", b"shape"], config)
+    stream.last_id = (500, 9)
+    trimmed = StreamValue()
+    trimmed.last_id = (42, 1)
+    values = {
+        b"string": b"hello",
+        b"binary": bytes(range(256)),
+        b"list": ListValue([b"item:%d" % i for i in range(300)], config),
+        b"set": SetValue([b"%d" % i for i in range(200)] + [b"x"], config),
+        b"hash": HashValue({b"f%d" % i: b"v%d" % i for i in range(150)}, config),
+        b"zset": ZSetValue({b"m%d" % i: i / 3 for i in range(150)} | {b"top": float("inf")}, config),
+        b"stream": stream,
+        b"trimmed": trimmed,
+    }
+    for key, value in values.items():
+        store.store_at(key, value, -1)
+    store.store_at(b"string-ttl", b"v", FAR_FUTURE)
+    store.store_at(b"list-ttl", ListValue([b"a"], config), FAR_FUTURE + 1)
+    store.store_at(b"expired", b"v", 1000)
+    path = str(tmp_path / "appendonly.aof")
+    rewrite_aof(store, path)
+
+    replayed = new_store()
+    replay_aof(replayed, path)
+    expected = snapshot(store)
+    del expected[b"expired"]
+    assert snapshot(replayed) == expected
+    assert replayed.expires.get(b"string-ttl") == FAR_FUTURE
+    assert replayed.expires.get(b"list-ttl") == FAR_FUTURE + 1
+    assert replayed.lookup(b"trimmed").last_id == (42, 1)
+
+
+def test_truncated_tail_is_ignored(tmp_path, caplog):
+    encoder = RESPEncoder()
+    commands = [[b"SET", b"a", b"1"], [b"RPUSH", b"l", b"x", b"y"], [b"SET", b"b", b"2"]]
+    payload = b"".join(encoder.encode(command) for command in commands)
+    path = tmp_path / "appendonly.aof"
+    path.write_bytes(payload[:-3])
+    store = new_store()
+    with caplog.at_level(logging.WARNING):
+        assert replay_aof(store, str(path)) == 2
+    assert "truncated" in caplog.text
+    assert store.lookup(b"a") == b"1"
+    assert list(store.lookup(b"l")) == [b"x", b"y"]
+    assert store.lookup(b"b") is None
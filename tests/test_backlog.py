@@ -0,0 +1,50 @@
+import random
+
+import pytest
+
+from app.data.backlog import ReplicationBacklog
+
+
+def check_history(backlog: ReplicationBacklog, stream: bytes, start_offset: int):
+    """Everything still held reads back as the same bytes of stream"""
+    assert backlog.end == start_offset + len(stream)
+    assert backlog.histlen == min(len(stream), backlog.size)
+    first = backlog.first_offset()
+    for offset in range(first, backlog.end + 2):
+        assert backlog.can_serve(offset)
+        assert backlog.read_from(offset) == stream[offset - start_offset - 1:]
+    assert not backlog.can_serve(first - 1)
+    assert not backlog.can_serve(backlog.end + 2)
+
+
+def test_empty_backlog_serves_only_the_next_byte():
+    backlog = ReplicationBacklog(16, 100)
+    assert backlog.first_offset() == 101
+    assert backlog.can_serve(101)
+    assert backlog.read_from(101) == b""
+    assert not backlog.can_serve(100)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_feeds_wrap_around_the_ring(seed):
+    rng = random.Random(seed)
+    backlog = ReplicationBacklog(32, 1000)
+    stream = b""
+    for i in range(60):
+        data = bytes(rng.randrange(256) for _ in range(rng.choice((1, 5, 31, 32, 33, 70))))
+        backlog.feed(data)
+        stream += data
+        check_history(backlog, stream, 1000)
+
+
+@pytest.mark.parametrize("size", [8, 20, 32, 64])
+def test_resize_keeps_the_newest_history(size):
+    backlog = ReplicationBacklog(32, 0)
+    stream = bytes(range(50))
+    backlog.feed(stream[:30])
+    backlog.feed(stream[30:])
+    backlog.resize(size)
+    assert backlog.size == size
+    check_history(backlog, stream[-min(size, 32):], 50 - min(size, 32))
+    backlog.feed(b"tail")
+    assert backlog.read_from(backlog.end - 3) == b"tail"
@@ -0,0 +1,56 @@
+import pytest
+
+from app.server.cluster import CLUSTER_SLOTS, key_hash_slot
+
+
+def crc16(data: bytes) -> int:
+    """Bit-by-bit CRC16-CCITT (XMODEM), as in Redis's crc16.c"""
+    crc = 0
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021 if crc & 0x8000 else crc << 1) & 0xFFFF
+    return crc
+
+
+# Slots reported by CLUSTER KEYSLOT on Redis
+@pytest.mark.parametrize("key, slot", [
+    (b"foo", 12182),
+    (b"bar", 5061),
+    (b"hello", 866),
+    (b"somekey", 11058),
+    (b"123456789", 12739),
+    (b"user1000", 3443),
+    (b"{user1000}.following", 3443),
+    (b"{user1000}.followers", 3443),
+    (b"foo{bar}{zap}", 5061),
+])
+def test_known_redis_slots(key, slot):
+    assert key_hash_slot(key) == slot
+
+
+@pytest.mark.parametrize("key, hashed", [
+    # An empty tag does not count: the whole key is hashed
+    (b"foo{}{bar}", b"foo{}{bar}"),
+    (b"{}", b"{}"),
+    (b"{}x", b"{}x"),
+    # The tag runs from the first { to the first } after it
+    (b"foo{{bar}}zap", b"{bar"),
+    (b"{a}{b}", b"a"),
+    (b"x{a}", b"a"),
+    # No closing brace
+    (b"{", b"{"),
+    (b"foo{bar", b"foo{bar"),
+    (b"}foo{", b"}foo{"),
+    (b"", b""),
+    (b"\xff\x00binary", b"\xff\x00binary"),
+    # 0x7b 0x7c 0x7d is {|}
+    (bytes(range(256)), b"|"),
+])
+def test_hash_tags(key, hashed):
+    assert key_hash_slot(key) == crc16(hashed) % CLUSTER_SLOTS
+
+
+def test_cluster_keyslot_command(client):
+    assert client.call("CLUSTER", "KEYSLOT", "foo") == 12182
+    assert client.call("CLUSTER", "KEYSLOT", "{user1000}.following") == 3443
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from app.action import RedisAction
+from app.commands import Command
+from app.data.memory import RedisStore
+from app.data.metadata import ServerMetadata
+from app.resp.RESPCodec import Error, RESPDecoder, RESPEncoder
+from app.server.handler import ServerHandler
+
+HOST = "127.0.0.1"
+
+
+def boom(self, args, writer=None):
+    raise ValueError("boom")
+
+
+async def async_boom(self, args, writer=None):
+    await asyncio.sleep(0)
+    raise ValueError("boom")
+
+
+@pytest.fixture
+def handler(monkeypatch):
+    monkeypatch.setitem(RedisAction.commands, b"BOOM", Command("boom", boom, 1))
+    monkeypatch.setitem(RedisAction.commands, b"ASYNCBOOM", Command("asyncboom", async_boom, 1))
+    return ServerHandler(RedisStore(None, None, ServerMetadata(None, "0" * 40, 0)))
+
+
+def pipeline(handler, *commands) -> list:
+    """Send commands in one write and return their replies"""
+
+    async def run():
+        server = await asyncio.get_running_loop().create_server(handler, HOST, 0)
+        reader, writer = await asyncio.open_connection(HOST, server.sockets[0].getsockname()[1])
+        encoder, decoder = RESPEncoder(), RESPDecoder()
+        writer.write(b"".join(encoder.encode(list(argv)) for argv in commands))
+        replies = []
+        while len(replies) < len(commands):
+            replies += decoder.decode_all(await asyncio.wait_for(reader.read(64 * 1024), 5))
+        writer.close()
+        server.close()
+        return replies
+
+    return asyncio.run(run())
+
+
+def assert_internal_error(reply):
+    assert isinstance(reply, Error) and str(reply).startswith("ERR ")
+
+
+def test_failing_command_is_answered_in_order(handler):
+    first, failed, last = pipeline(handler, [b"ECHO", b"a"], [b"BOOM"], [b"ECHO", b"b"])
+    assert first == b"a"
+    assert_internal_error(failed)
+    assert last == b"b"
+
+
+def test_failing_async_command_is_answered_in_order(handler):
+    first, failed, last = pipeline(handler, [b"ECHO", b"a"], [b"ASYNCBOOM"], [b"ECHO", b"b"])
+    assert first == b"a"
+    assert_internal_error(failed)
+    assert last == b"b"
+
+
+def test_failure_while_draining_pending_keeps_going(handler):
+    # Everything after ASYNCBOOM is queued and run by the connection's task
+    replies = pipeline(handler, [b"ASYNCBOOM"], [b"BOOM"], [b"ECHO", b"a"], [b"ASYNCBOOM"], [b"ECHO", b"b"])
+    assert_internal_error(replies[0])
+    assert_internal_error(replies[1])
+    assert replies[2] == b"a"
+    assert_internal_error(replies[3])
+    assert replies[4] == b"b"
+
+
+def test_bad_arguments_get_a_reply(client):
+    client.send(["SET", "a", "1"], ["SET", "b", "x", "EX", "abc"], ["SCAN", "0", "COUNT", "x"], ["GET", "a"])
+    set_a, set_b, scan, get = client.read(4)
+    assert not isinstance(set_a, Error)
+    assert isinstance(set_b, Error)
+    assert isinstance(scan, Error)
+    assert get == b"1"
@@ -0,0 +1,100 @@
+import pytest
+
+
+def encoding(client, key: str) -> bytes:
+    return client.call("OBJECT", "ENCODING", key)
+
+
+def configure(client, **settings):
+    for name, value in settings.items():
+        assert str(client.call("CONFIG", "SET", name.replace("_", "-"), str(value))) == "OK"
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("12345", b"int"),
+    ("-9223372036854775808", b"int"),
+    ("x" * 44, b"embstr"),
+    ("x" * 45, b"raw"),
+    ("012", b"embstr"),
+])
+def test_string_encodings(client, value, expected):
+    client.call("SET", "k", value)
+    assert encoding(client, "k") == expected
+
+
+def test_list_converts_past_list_max_listpack_size(client):
+    configure(client, list_max_listpack_size=4)
+    client.call("RPUSH", "l", "a", "b", "c", "d")
+    assert encoding(client, "l") == b"listpack"
+    client.call("RPUSH", "l", "e")
+    assert encoding(client, "l") == b"quicklist"
+    client.call("LPUSH", "left", "a", "b", "c", "d")
+    assert encoding(client, "left") == b"listpack"
+    client.call("LPUSH", "left", "e")
+    assert encoding(client, "left") == b"quicklist"
+    assert client.call("LRANGE", "left", "0", "-1") == [b"e", b"d", b"c", b"b", b"a"]
+
+
+def test_hash_converts_past_entries_or_value_size(client):
+    configure(client, hash_max_listpack_entries=4, hash_max_listpack_value=8)
+    client.call("HSET", "h", "f1", "v", "f2", "v", "f3", "v", "f4", "v")
+    assert encoding(client, "h") == b"listpack"
+    # Overwriting a field does not add an entry
+    client.call("HSET", "h", "f4", "12345678")
+    assert encoding(client, "h") == b"listpack"
+    client.call("HSET", "h", "f5", "v")
+    assert encoding(client, "h") == b"hashtable"
+    assert client.call("HGET", "h", "f4") == b"12345678"
+    client.call("HSET", "longvalue", "f", "123456789")
+    assert encoding(client, "longvalue") == b"hashtable"
+    client.call("HSET", "longfield", "123456789", "v")
+    assert encoding(client, "longfield") == b"hashtable"
+
+
+def test_set_intset_listpack_and_hashtable(client):
+    configure(client, set_max_intset_entries=4, set_max_listpack_entries=6, set_max_listpack_value=20)
+    client.call("SADD", "ints", "1", "-2", "3", "9223372036854775807")
+    assert encoding(client, "ints") == b"intset"
+    client.call("SADD", "ints", "5")
+    assert encoding(client, "ints") == b"hashtable"
+
+    # Strings that are not canonical int64s leave the intset
+    for i, member in enumerate(["a", "01", "+1", "9223372036854775808", " 1"]):
+        client.call("SADD", f"mixed{i}", "1", member)
+        assert encoding(client, f"mixed{i}") == b"listpack", member
+
+    client.call("SADD", "small", *"abcdef")
+    assert encoding(client, "small") == b"listpack"
+    client.call("SADD", "small", "g")
+    assert encoding(client, "small") == b"hashtable"
+    client.call("SADD", "long", "x" * 21)
+    assert encoding(client, "long") == b"hashtable"
+    # An intset too big for a listpack goes straight to a hashtable
+    client.call("SADD", "wide", "1", "2", "3", "4")
+    configure(client, set_max_listpack_entries=3)
+    client.call("SADD", "wide", "x")
+    assert encoding(client, "wide") == b"hashtable"
+    assert sorted(client.call("SMEMBERS", "wide")) == [b"1", b"2", b"3", b"4", b"x"]
+
+
+def test_zset_converts_past_entries_or_value_size(client):
+    configure(client, zset_max_listpack_entries=3, zset_max_listpack_value=8)
+    client.call("ZADD", "z", "1", "a", "2", "b", "3", "c")
+    assert encoding(client, "z") == b"listpack"
+    client.call("ZADD", "z", "4", "c")
+    assert encoding(client, "z") == b"listpack"
+    client.call("ZADD", "z", "0", "d")
+    assert encoding(client, "z") == b"skiplist"
+    assert client.call("ZRANGE", "z", "0", "-1") == [b"d", b"a", b"b", b"c"]
+    client.call("ZADD", "long", "1", "123456789")
+    assert encoding(client, "long") == b"skiplist"
+
+
+def test_conversions_are_one_way(client):
+    configure(client, list_max_listpack_size=2, hash_max_listpack_entries=2)
+    client.call("RPUSH", "l", "a", "b", "c")
+    client.call("RPOP", "l", "2")
+    assert encoding(client, "l") == b"quicklist"
+    client.call("HSET", "h", "a", "1", "b", "2", "c", "3")
+    client.call("HDEL", "h", "a", "b")
+    assert encoding(client, "h") == b"hashtable"
@@ -0,0 +1,117 @@
+import pytest
+
+from app.data.eviction import LRU_CLOCK_MAX, lfu_time_in_minutes, lru_clock
+from app.data.memory import OOM_ERROR, RedisStore
+from app.data.metadata import ServerMetadata
+from app.resp.RESPCodec import Error
+
+VALUE = b"v" * 100
+FAR_FUTURE = 4102444800000
+
+
+@pytest.fixture
+def store():
+    store = RedisStore(None, None, ServerMetadata(None, "0" * 40, 0))
+    config = store.config
+    saved = config.maxmemory, config.maxmemory_policy, config.maxmemory_samples
+    # Sampling well past the key count makes missing every cold key
+    # vanishingly unlikely, so the tests below are not flaky
+    config.maxmemory_samples = 64
+    yield store
+    config.maxmemory, config.maxmemory_policy, config.maxmemory_samples = saved
+
+
+def fill(store, policy: str, cold_ttl=None, hot_ttl=None):
+    """20 cold and 20 hot keys, with maxmemory just under what they use:
+    like Redis, eviction runs before a write once memory is over the limit"""
+    store.config.maxmemory_policy = policy
+    for group, ttl in (("cold", cold_ttl), ("hot", hot_ttl)):
+        for i in range(20):
+            store.store(b"%s:%d" % (group.encode(), i), VALUE, ttl or -1, absolute=ttl is not None)
+    store.config.maxmemory = store.used_memory - 1
+    return [b"cold:%d" % i for i in range(20)], [b"hot:%d" % i for i in range(20)]
+
+
+def add_keys(store, count: int):
+    for i in range(count):
+        store.store(b"new:%d" % i, VALUE, -1)
+    # Each write evicts what the one before it pushed over the limit
+    assert store.evicted_keys >= count - 1
+
+
+def test_noeviction_refuses_writes(store):
+    fill(store, "noeviction")
+    with pytest.raises(Error, match=OOM_ERROR):
+        store.store(b"new", VALUE, -1)
+    assert store.evicted_keys == 0
+    assert store.lookup(b"cold:0") == VALUE
+
+
+def test_allkeys_lru_evicts_the_least_recently_used(store):
+    cold, hot = fill(store, "allkeys-lru")
+    now = lru_clock()
+    for i, key in enumerate(cold):
+        store.memory[key].lru = (now - 1000 - i) & LRU_CLOCK_MAX
+    add_keys(store, 5)
+    assert store.evicted_keys < 20
+    assert all(key in store.memory for key in hot)
+    assert sum(key in store.memory for key in cold) == 20 - store.evicted_keys
+
+
+def test_allkeys_lfu_evicts_the_least_frequently_used(store):
+    cold, hot = fill(store, "allkeys-lfu")
+    minutes = lfu_time_in_minutes() << 8
+    for key in cold:
+        store.memory[key].lru = minutes | 1
+    for key in hot:
+        store.memory[key].lru = minutes | 200
+    add_keys(store, 5)
+    assert all(key in store.memory for key in hot)
+    assert sum(key in store.memory for key in cold) == 20 - store.evicted_keys
+
+
+def test_volatile_lru_only_evicts_keys_with_a_ttl(store):
+    cold, hot = fill(store, "volatile-lru", hot_ttl=FAR_FUTURE)
+    # The keys without a TTL are the oldest, but are never candidates
+    for key in cold:
+        store.memory[key].lru = (lru_clock() - 5000) & LRU_CLOCK_MAX
+    add_keys(store, 5)
+    assert all(key in store.memory for key in cold)
+    # Once the volatile keys are gone, writes fail
+    with pytest.raises(Error, match=OOM_ERROR):
+        for i in range(40):
+            store.store(b"more:%d" % i, VALUE, -1)
+    assert not any(key in store.memory for key in hot)
+
+
+def test_volatile_ttl_evicts_the_nearest_expiry(store):
+    store.config.maxmemory_policy = "volatile-ttl"
+    for i in range(40):
+        store.store(b"k%d" % i, VALUE, FAR_FUTURE - i * 1000, absolute=True)
+    store.config.maxmemory = store.used_memory - 1
+    add_keys(store, 5)
+    survivors = [i for i in range(40) if b"k%d" % i in store.memory]
+    evicted = [i for i in range(40) if i not in survivors]
+    # The biggest i expire soonest
+    assert min(evicted) > max(survivors) - 20
+
+
+def test_policy_change_applies_to_the_next_eviction(store):
+    cold, hot = fill(store, "noeviction", hot_ttl=FAR_FUTURE)
+    with pytest.raises(Error):
+        store.store(b"new", VALUE, -1)
+    store.config.set("maxmemory-policy", "volatile-ttl")
+    add_keys(store, 3)
+    assert all(key in store.memory for key in cold)
+
+
+def test_replica_does_not_evict(store):
+    fill(store, "allkeys-lru")
+    store.metadata.role = "slave"
+    try:
+        for i in range(5):
+            store.store(b"new:%d" % i, VALUE, -1)
+    finally:
+        store.metadata.role = "master"
+    assert store.evicted_keys == 0
+    assert store.used_memory > store.config.maxmemory
@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+from app.data.sampled_dict import SampledDict
+from app.resp.RESPCodec import Error
+
+
+@pytest.mark.parametrize("args, message", [
+    (["x"], "ERR invalid cursor"),
+    (["-1"], "ERR invalid cursor"),
+    ([str(2 ** 64)], "ERR invalid cursor"),
+    (["0", "COUNT", "x"], "ERR value is not an integer or out of range"),
+    (["0", "COUNT", "0"], "ERR syntax error"),
+    (["0", "COUNT", "-3"], "ERR syntax error"),
+    (["0", "COUNT"], "ERR syntax error"),
+    (["0", "BOGUS", "1"], "ERR syntax error"),
+])
+def test_scan_rejects_bad_arguments(client, args, message):
+    reply = client.call("SCAN", *args)
+    assert isinstance(reply, Error) and str(reply) == message
+
+
+def test_scan_returns_every_key_present_throughout_despite_resizes():
+    rng = random.Random(7)
+    keys = SampledDict()
+    for i in range(500):
+        keys[b"stable:%d" % i] = i
+    churn = [b"churn:%d" % i for i in range(500)]
+    for key in churn:
+        keys[key] = 0
+    seen, cursor, added = set(), 0, 0
+    while True:
+        cursor, batch = keys.scan(cursor, 9)
+        seen.update(batch)
+        # Grow and shrink between calls
+        for _ in range(rng.randrange(40)):
+            keys[b"new:%d" % added] = 0
+            added += 1
+        for _ in range(rng.randrange(30)):
+            if churn:
+                del keys[churn.pop(rng.randrange(len(churn)))]
+        if cursor == 0:
+            break
+    assert {b"stable:%d" % i for i in range(500)} <= seen
+
+
+def test_scan_without_changes_returns_each_key_once():
+    keys = SampledDict()
+    for i in range(1000):
+        keys[b"k%d" % i] = i
+    returned, cursor = [], 0
+    while True:
+        cursor, batch = keys.scan(cursor, 33)
+        assert len(batch) <= 33
+        returned += batch
+        if cursor == 0:
+            break
+    assert sorted(returned) == sorted(keys.keys())
+
+
+def scan_all(client, *options) -> list:
+    found, cursor = [], b"0"
+    while True:
+        cursor, batch = client.call("SCAN", cursor, *options)
+        found += batch
+        if cursor == b"0":
+            return found
+
+
+def test_scan_match_and_type_over_the_wire(client):
+    client.call("MSET", *[x for i in range(200) for x in (f"user:{i}", "v")])
+    client.call("MSET", "user:x", "v", "user:[1]", "v", "other", "v")
+    client.call("RPUSH", "user:list", "a")
+    assert sorted(scan_all(client, "MATCH", "user:1?")) == sorted(b"user:1%d" % i for i in range(10))
+    assert sorted(scan_all(client, "MATCH", "user:[^0-9]*", "COUNT", "7")) == [b"user:[1]", b"user:list", b"user:x"]
+    assert scan_all(client, "MATCH", "user:\\[1]") == [b"user:[1]"]
+    assert scan_all(client, "TYPE", "list") == [b"user:list"]
+    assert sorted(client.call("KEYS", "user:?[05]")) == sorted(b"user:%d" % i for i in range(10, 100) if i % 5 == 0)
@@ -0,0 +1,47 @@
+import asyncio
+import threading
+
+from app.data.datatypes import HashValue, ListValue, ZSetValue
+from app.data.lazyfree import LAZYFREE_CHUNK, free_object, pending_objects
+
+
+def big_values():
+    count = 5 * LAZYFREE_CHUNK
+    return [
+        ListValue([b"item:%d" % i for i in range(count)]),
+        HashValue({b"f%d" % i: b"v" for i in range(count)}),
+        ZSetValue({b"m%d" % i: float(i) for i in range(count)}),
+    ]
+
+
+def test_big_values_are_released_in_slices_on_the_loop():
+    async def run():
+        values = big_values()
+        for value in values:
+            free_object(value)
+        assert pending_objects() > 0
+        # One callback releases at most a chunk
+        await asyncio.sleep(0)
+        assert sum(map(len, values)) >= 3 * 5 * LAZYFREE_CHUNK - LAZYFREE_CHUNK
+        while pending_objects():
+            await asyncio.sleep(0)
+        return values
+
+    assert all(len(value) == 0 for value in asyncio.run(run()))
+
+
+def test_released_without_a_loop_at_once():
+    for value in big_values():
+        free_object(value)
+    assert pending_objects() == 0
+
+
+def test_no_thread_is_started():
+    async def run():
+        free_object(big_values()[0])
+        while pending_objects():
+            await asyncio.sleep(0)
+
+    before = threading.active_count()
+    asyncio.run(run())
+    assert threading.active_count() == before
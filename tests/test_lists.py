@@ -0,0 +1,12 @@
+import pytest
+
+
+@pytest.mark.parametrize("command", ["BLPOP", "BRPOP"])
+def test_blocking_pop_timeout_is_a_null_array(client, command):
+    assert client.call_raw(command, "missing", "0.05") == b"*-1\r\n"
+
+
+@pytest.mark.parametrize("command, popped", [("BLPOP", b"a"), ("BRPOP", b"c")])
+def test_blocking_pop_returns_key_and_element(client, command, popped):
+    client.call("RPUSH", "list", "a", "b", "c")
+    assert client.call(command, "missing", "list", "0") == [b"list", popped]
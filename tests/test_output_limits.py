@@ -0,0 +1,74 @@
+import types
+
+import pytest
+
+from app.data.config import ServerConfig
+from app.server import output_limits
+from app.server.output_limits import OutputBufferLimit
+from app.server.replication import ReplicaLink
+
+
+class FakeTransport:
+    def __init__(self):
+        self.buffered = 0
+        self.aborted = False
+
+    def get_write_buffer_size(self):
+        return self.buffered
+
+    def abort(self):
+        self.aborted = True
+
+
+@pytest.fixture
+def limits():
+    config = ServerConfig()
+    saved = config.client_output_buffer_limit
+    yield config
+    config.client_output_buffer_limit = saved
+
+
+def new_link(config):
+    metadata = types.SimpleNamespace(replicas=[])
+    writer = types.SimpleNamespace(transport=FakeTransport(), get_extra_info=lambda name: ("127.0.0.1", 5000))
+    link = ReplicaLink(metadata, config, writer)
+    metadata.replicas.append(link)
+    return link, metadata, writer.transport
+
+
+def test_hard_limit_disconnects_the_replica(limits):
+    limits.set("client-output-buffer-limit", "replica 1000 0 0")
+    link, metadata, transport = new_link(limits)
+    link.feed(b"x" * 600)
+    transport.buffered = 399
+    link.feed(b"")
+    assert not link.closed
+    transport.buffered = 400
+    link.feed(b"")
+    assert link.closed and transport.aborted
+    assert metadata.replicas == []
+    assert link.queued_bytes == 0
+
+
+def test_soft_limit_needs_to_last(limits, monkeypatch):
+    limits.set("client-output-buffer-limit", "slave 0 100 10")
+    now = [1000.0]
+    monkeypatch.setattr(output_limits.time, "monotonic", lambda: now[0])
+    limit = OutputBufferLimit(limits, "replica")
+    assert limit.check(100) is None
+    now[0] += 9
+    assert limit.check(500) is None
+    # Dropping under the soft limit restarts the clock
+    assert limit.check(99) is None
+    now[0] += 5
+    assert limit.check(100) is None
+    now[0] += 9.9
+    assert limit.check(100) is None
+    now[0] += 0.1
+    assert "soft limit" in limit.check(100)
+
+
+def test_other_classes_keep_their_limits(limits):
+    limits.set("client-output-buffer-limit", "replica 1000 0 0")
+    assert limits.client_output_buffer_limit["pubsub"] == (32 * 1024 ** 2, 8 * 1024 ** 2, 60)
+    assert OutputBufferLimit(limits, "normal").check(10 ** 9) is None
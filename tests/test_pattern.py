@@ -0,0 +1,48 @@
+import pytest
+
+from app.data.pattern import compile_glob, literal_prefix
+
+
+@pytest.mark.parametrize("pattern, matching, other", [
+    (b"h?llo", [b"hello", b"hallo", b"h\nllo"], [b"hllo", b"heello"]),
+    (b"h*llo", [b"hllo", b"heeeello"], [b"hellox", b"ello"]),
+    (b"a*b*c", [b"abc", b"aXbYc", b"abbbc"], [b"acb", b"ab"]),
+    (b"h[ae]llo", [b"hello", b"hallo"], [b"hillo", b"hllo", b"haello"]),
+    (b"h[^e]llo", [b"hallo", b"hbllo"], [b"hello", b"hllo"]),
+    (b"h[a-c]llo", [b"hallo", b"hbllo", b"hcllo"], [b"hdllo", b"h-llo"]),
+    (b"h[c-a]llo", [b"hbllo"], [b"hdllo"]),
+    (b"[0-9][0-9]", [b"42"], [b"4x", b"423"]),
+    (b"h\\*llo", [b"h*llo"], [b"hello", b"hllo"]),
+    (b"h\\?", [b"h?"], [b"hx"]),
+    (b"\\[x]", [b"[x]"], [b"x"]),
+    (b"[\\]]", [b"]"], [b"\\"]),
+    (b"[\\^a]", [b"^", b"a"], [b"b"]),
+    (b"[]x", [], [b"x", b"]x"]),
+    (b"a.b(c)+", [b"a.b(c)+"], [b"axb(c)+", b"a.bc"]),
+    (b"\x00*\xff", [b"\x00\xff", b"\x00abc\xff"], [b"\xff"]),
+])
+def test_glob(pattern, matching, other):
+    match = compile_glob(pattern)
+    for key in matching:
+        assert match(key), key
+    for key in other:
+        assert not match(key), key
+
+
+def test_match_all_and_literal_shortcuts():
+    assert compile_glob(b"*") is None
+    assert compile_glob(b"***") is None
+    match = compile_glob(b"plain:key")
+    assert match(b"plain:key") and not match(b"plain:keys")
+    assert compile_glob(b"")(b"") and not compile_glob(b"")(b"x")
+
+
+@pytest.mark.parametrize("pattern, prefix", [
+    (b"user:*", b"user:"),
+    (b"user:[ab]", b"user:"),
+    (b"a\\*", b"a"),
+    (b"exact", b"exact"),
+    (b"?x", b""),
+])
+def test_literal_prefix(pattern, prefix):
+    assert literal_prefix(pattern) == prefix
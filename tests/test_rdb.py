@@ -0,0 +1,176 @@
+import io
+import pathlib
+import types
+
+import pytest
+
+from app.data.config import ServerConfig
+from app.data.datatypes import HashValue, ListValue, SetValue, StreamValue, ZSetValue
+from app.data.memory import RedisStore
+from app.data.metadata import ServerMetadata
+from app.data.rdb import (
+    RDB_TYPE_LIST_ZIPLIST,
+    RDB_TYPE_SET_INTSET,
+    RDB_TYPE_SET_LISTPACK,
+    RDB_TYPE_STREAM_LISTPACKS,
+    RDB_TYPE_STRING,
+    RDB_TYPE_ZSET,
+    RDBFormatError,
+    encode_length,
+    encode_string,
+    load_rdb,
+    write_snapshot,
+)
+from rdb_helpers import build_rdb
+
+DATA = pathlib.Path(__file__).parent / "data"
+
+
+def load_file(tmp_path, payload: bytes) -> dict:
+    """Load payload with load_rdb; returns key -> (value, expire)"""
+    path = tmp_path / "dump.rdb"
+    path.write_bytes(payload)
+    loaded = {}
+    storage = types.SimpleNamespace(config=ServerConfig(), store_at=lambda key, value, when: loaded.update({key: (value, when)}))
+    load_rdb(storage, str(path))
+    return loaded
+
+
+def lzf_string(compressed: bytes, raw_len: int) -> bytes:
+    return b"\xC3" + encode_length(len(compressed)) + encode_length(raw_len) + compressed
+
+
+@pytest.mark.parametrize("rdb_type, value", [
+    (RDB_TYPE_LIST_ZIPLIST, encode_string(b"\x0f\x00\x00\x00\x0a\x00\x00\x00\x02\x00\x00\x05ab")),
+    (RDB_TYPE_SET_LISTPACK, encode_string(b"\x0b\x00\x00\x00\x01\x00")),
+    (RDB_TYPE_SET_INTSET, encode_string(b"\x03\x00\x00\x00\x01\x00\x00\x00abc")),
+    (RDB_TYPE_SET_INTSET, encode_string(b"\x02\x00\x00\x00\x05\x00\x00\x00ab")),
+    (RDB_TYPE_ZSET, encode_length(1) + encode_string(b"member") + b"\x03abc"),
+    (RDB_TYPE_STREAM_LISTPACKS, encode_length(1) + encode_string(b"\0" * 16) + encode_string(b"\x07\x00\x00\x00\x01\x00\xc1")
+     + encode_length(0) * 4),
+    (RDB_TYPE_STRING, lzf_string(b"\xe0", 10)),
+])
+def test_corrupt_value_is_reported_with_its_key(tmp_path, rdb_type, value):
+    with pytest.raises(RDBFormatError, match="b'broken'"):
+        load_file(tmp_path, build_rdb([(rdb_type, b"broken", value, None)]))
+
+
+@pytest.mark.parametrize("header", [b"REDISabcd", b"REDIS 011", b"NOTREDIS0"])
+def test_bad_header_is_a_format_error(tmp_path, header):
+    with pytest.raises(RDBFormatError):
+        load_file(tmp_path, header + build_rdb([])[9:])
+
+
+def test_truncated_file_is_a_format_error(tmp_path):
+    payload = build_rdb([(RDB_TYPE_STRING, b"k", encode_string(b"v" * 100), None)])
+    with pytest.raises(RDBFormatError):
+        load_file(tmp_path, payload[:50])
+
+
+def test_server_starts_despite_corrupt_dump(tmp_path, start, connect):
+    (tmp_path / "dump.rdb").write_bytes(
+        build_rdb([(RDB_TYPE_LIST_ZIPLIST, b"broken", encode_string(b"\x0f\x00\x00\x00\x0a\x00\x00"), None)]))
+    client = connect(start("--dbfilename", "dump.rdb"))
+    assert str(client.call("PING")) == "PONG"
+
+
+def plain(value):
+    """A value as builtins, so values and encodings compare across a reload"""
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, ListValue):
+        return value.encoding, list(value)
+    if isinstance(value, SetValue):
+        return value.encoding, sorted(value.members())
+    if isinstance(value, (HashValue, ZSetValue)):
+        return value.encoding, dict(value.items())
+    return list(value.entries()), value.last_id
+
+
+def new_store() -> RedisStore:
+    return RedisStore(None, None, ServerMetadata(None, "0" * 40, 0))
+
+
+def sample_values(config) -> dict:
+    stream = StreamValue()
+    for i in range(1, 251):
+        stream.add((i, i % 3), [b"field", b"v%d" % i, b"n", b"%d" % i], config)
+    stream.add((300, 0), [b"other", b"shape"], config)
+    stream.last_id = (400, 7)
+    return {
+        b"string": b"hello",
+        b"int": b"12345",
+        b"empty": b"",
+        b"binary": bytes(range(256)) * 40,
+        b"list": ListValue([b"a", b"1", b"-200", b"x" * 100], config),
+        b"biglist": ListValue([b"item:%d" % i for i in range(1000)], config),
+        b"intset": SetValue([b"1", b"-3", b"10000000000"], config),
+        b"smallset": SetValue([b"a", b"b", b"c"], config),
+        b"bigset": SetValue([b"m%d" % i for i in range(500)], config),
+        b"hash": HashValue({b"f1": b"v1", b"f2": b"2"}, config),
+        b"bighash": HashValue({b"f%d" % i: b"v%d" % i for i in range(600)}, config),
+        b"zset": ZSetValue({b"a": 1.5, b"b": -2.0, b"c": float("inf")}, config),
+        b"bigzset": ZSetValue({b"m%d" % i: i / 4 for i in range(200)}, config),
+        b"stream": stream,
+    }
+
+
+def test_snapshot_round_trips_every_type_and_encoding(tmp_path):
+    store = new_store()
+    values = sample_values(store.config)
+    encodings = {value.encoding for value in values.values() if not isinstance(value, (bytes, StreamValue))}
+    assert encodings == {"listpack", "quicklist", "intset", "hashtable", "skiplist"}
+    for key, value in values.items():
+        store.store_at(key, value, -1)
+    store.store_at(b"ttl", b"future", 4102444800000)
+    store.store_at(b"gone", b"past", 1000)
+    buffer = io.BytesIO()
+    write_snapshot(store, buffer, chunk_size=256)
+
+    loaded = load_file(tmp_path, buffer.getvalue())
+    assert b"gone" not in loaded
+    assert loaded.pop(b"ttl") == (b"future", 4102444800000)
+    assert {key: plain(value) for key, (value, _) in loaded.items()} == {key: plain(value) for key, value in values.items()}
+    assert {when for _, when in loaded.values()} == {-1}
+
+
+def test_loader_skips_expired_keys(tmp_path):
+    loaded = load_file(tmp_path, build_rdb([
+        (RDB_TYPE_STRING, b"old", encode_string(b"v"), 1000),
+        (RDB_TYPE_STRING, b"new", encode_string(b"v"), 4102444800000),
+        (RDB_TYPE_STRING, b"forever", encode_string(b"v"), None),
+    ]))
+    assert loaded == {b"new": (b"v", 4102444800000), b"forever": (b"v", -1)}
+
+
+def test_loads_a_real_redis_dump(tmp_path):
+    # Written by Redis 6.2 (RDB version 9) with list-compress-depth 1: ziplist
+    # hashes and zsets, intsets of every width, compressed quicklist nodes,
+    # LZF strings, a stream with a deleted entry and a consumer group, and a
+    # key in database 1
+    payload = (DATA / "redis-6.2.rdb").read_bytes()
+    assert payload.startswith(b"REDIS0009")
+    loaded = load_file(tmp_path, payload)
+    values = {key: plain(value) for key, (value, _) in loaded.items()}
+    stream_entries, last_id = values.pop(b"stream")
+    assert values == {
+        b"string": b"hello",
+        b"int": b"12345",
+        b"negative": b"-70000",
+        b"compressible": b"a" * 200,
+        b"ttl": b"future",
+        b"list": ("listpack", [b"a", b"1", b"-200", b"70000", b"5000000000", b"x" * 100]),
+        b"biglist": ("quicklist", [b"item:%d" % i for i in range(200)]),
+        b"intset16": ("intset", [b"-3", b"1", b"2"]),
+        b"intset32": ("intset", [b"1", b"100000"]),
+        b"intset64": ("intset", [b"1", b"10000000000"]),
+        b"set": ("listpack", [b"a", b"b", b"c"]),
+        b"zset": ("listpack", {b"b": -2.0, b"a": 1.5, b"c": 3.0}),
+        b"bigzset": ("skiplist", {b"m%d" % i: i / 4 for i in range(200)}),
+        b"hash": ("listpack", {b"f1": b"v1", b"f2": b"2", b"f3": b"x" * 40}),
+        b"bighash": ("hashtable", {b"f%d" % i: b"v%d" % i for i in range(600)}),
+    }
+    assert loaded[b"ttl"][1] == 4102444800000
+    assert stream_entries == [((i, i), [b"field", b"v%d" % i, b"n", b"%d" % i]) for i in (1, 3, 4, 5)] + [
+        ((6, 0), [b"other", b"shape"])]
+    assert last_id == (6, 0)
@@ -0,0 +1,77 @@
+import struct
+import time
+import types
+import unittest
+
+from app.data.rdb import (
+    RDB_TYPE_HASH,
+    RDB_TYPE_LIST,
+    RDB_TYPE_STRING,
+    RDB_TYPE_ZSET_2,
+    RDBStreamLoader,
+    encode_length,
+    encode_string,
+)
+from rdb_helpers import build_rdb, encode_hash, encode_list
+
+CHUNK_SIZE = 64 * 1024
+FAR_FUTURE_MS = 2 ** 62
+
+
+def load(payload: bytes, chunk_size: int) -> tuple[RDBStreamLoader, dict]:
+    loaded = {}
+
+    def store_at(key, value, expire):
+        loaded[key] = (value, expire)
+
+    loader = RDBStreamLoader(types.SimpleNamespace(config=None), store_at)
+    for start in range(0, len(payload), chunk_size):
+        loader.feed(payload[start:start + chunk_size])
+    return loader, loaded
+
+
+class RDBStreamLoaderTest(unittest.TestCase):
+
+    def test_records_cut_at_every_byte(self):
+        payload = build_rdb([
+            (RDB_TYPE_STRING, b"s", encode_string(b"x" * 100), None),
+            (RDB_TYPE_LIST, b"l", encode_list([b"a", b"bb", b"12345"]), FAR_FUTURE_MS),
+            (RDB_TYPE_HASH, b"h", encode_hash([(b"f1", b"v1"), (b"f2", b"v2")]), None),
+            (RDB_TYPE_ZSET_2, b"z", encode_length(2) + encode_string(b"m1") + struct.pack("<d", 1.5)
+             + encode_string(b"m2") + struct.pack("<d", -2.0), None),
+        ]) + b"+leftover"
+        loader, loaded = load(payload, 1)
+        self.assertTrue(loader.done)
+        self.assertEqual(loader.leftover(), b"+leftover")
+        self.assertEqual(loaded[b"s"], (b"x" * 100, -1))
+        self.assertEqual(loaded[b"l"][0].items, [b"a", b"bb", b"12345"])
+        self.assertEqual(loaded[b"l"][1], FAR_FUTURE_MS)
+        self.assertEqual(set(loaded[b"h"][0].items()), {(b"f1", b"v1"), (b"f2", b"v2")})
+        self.assertEqual(set(loaded[b"z"][0].items()), {(b"m1", 1.5), (b"m2", -2.0)})
+
+    def test_big_string_waits_for_its_bytes(self):
+        value = b"v" * (5 * CHUNK_SIZE)
+        loader, loaded = load(build_rdb([(RDB_TYPE_STRING, b"big", encode_string(value), None)]), CHUNK_SIZE)
+        self.assertTrue(loader.done)
+        self.assertEqual(loaded[b"big"], (value, -1))
+
+    def test_collection_spanning_many_chunks_loads_in_linear_time(self):
+        def load_list(count: int) -> float:
+            items = [b"item:%d" % i for i in range(count)]
+            payload = build_rdb([(RDB_TYPE_LIST, b"list", encode_list(items), None)])
+            started = time.perf_counter()
+            loader, loaded = load(payload, CHUNK_SIZE)
+            elapsed = time.perf_counter() - started
+            self.assertTrue(loader.done)
+            self.assertEqual(loaded[b"list"][0].items, items)
+            return elapsed
+
+        small = min(load_list(50_000) for _ in range(3))
+        large = min(load_list(200_000) for _ in range(3))
+        # Four times the elements; reparsing the record on every chunk made
+        # this about sixteen times slower
+        self.assertLess(large / small, 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
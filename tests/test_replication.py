@@ -0,0 +1,119 @@
+import time
+
+import pytest
+
+from app.resp.RESPCodec import Error
+
+
+def info_fields(client, section: str) -> dict:
+    text = client.call("INFO", section).decode()
+    return dict(line.split(":", 1) for line in text.splitlines() if ":" in line)
+
+
+def read_line(client) -> bytes:
+    """The first line of the reply, read raw: a full sync's payload that
+    follows is not RESP"""
+    data = b""
+    while b"\r\n" not in data:
+        chunk = client.sock.recv(4096)
+        assert chunk, "server closed the connection"
+        data += chunk
+    return data.split(b"\r\n", 1)[0]
+
+
+@pytest.mark.parametrize("offset", ["abc", "", "1.5"])
+def test_psync_with_malformed_offset_gets_full_resync(start, connect, offset):
+    port = start()
+    replid = info_fields(connect(port), "replication")["master_replid"]
+    replica = connect(port)
+    replica.send(["PSYNC", replid, offset])
+    assert read_line(replica).startswith(b"+FULLRESYNC " + replid.encode())
+
+
+def wait_for(predicate, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+def test_replica_rejects_client_writes(start, connect):
+    master_port = start()
+    master = connect(master_port)
+    replica = connect(start("--replicaof", f"127.0.0.1 {master_port}"))
+    master.call("SET", "k", "from master")
+    wait_for(lambda: replica.call("GET", "k") == b"from master")
+
+    reply = replica.call("SET", "k", "from client")
+    assert isinstance(reply, Error) and str(reply).startswith("READONLY ")
+    reply = replica.call("RPUSH", "list", "a")
+    assert isinstance(reply, Error) and str(reply).startswith("READONLY ")
+    replica.call("MULTI")
+    assert isinstance(replica.call("SET", "k", "queued"), Error)
+    reply = replica.call("EXEC")
+    assert isinstance(reply, Error) and str(reply).startswith("EXECABORT")
+    assert replica.call("GET", "k") == b"from master"
+    assert replica.call("EXISTS", "list") == 0
+
+
+def psync(connect, port: int, replid: str, offset: int) -> tuple:
+    """Ask for a resync; returns the reply line, what followed it and the
+    replica connection"""
+    replica = connect(port)
+    replica.send(["PSYNC", replid, offset])
+    data = b""
+    while b"\r\n" not in data:
+        data += replica.sock.recv(64 * 1024)
+    line, rest = data.split(b"\r\n", 1)
+    return line, rest, replica
+
+
+def test_psync_continues_from_the_backlog_or_falls_back_to_full_sync(start, connect):
+    port = start("--repl-backlog-size", "16kb")
+    master = connect(port)
+    replid = info_fields(master, "replication")["master_replid"]
+    line, _, first = psync(connect, port, "?", -1)
+    assert line.startswith(b"+FULLRESYNC " + replid.encode())
+    synced = int(line.split()[2])
+    first.close()
+
+    master.call("SET", "a", "1")
+    master.call("RPUSH", "l", "x")
+    offset = int(info_fields(master, "replication")["master_repl_offset"])
+
+    line, stream, replica = psync(connect, port, replid, synced + 1)
+    assert line == b"+CONTINUE " + replid.encode()
+    while len(stream) < offset - synced:
+        stream += replica.sock.recv(64 * 1024)
+    assert stream.endswith(b"*3\r\n$3\r\nSET\r\n$1\r\na\r\n$1\r\n1\r\n*3\r\n$5\r\nRPUSH\r\n$1\r\nl\r\n$1\r\nx\r\n")
+
+    # Caught up exactly: nothing to send but still a partial resync
+    line, _, _ = psync(connect, port, replid, offset + 1)
+    assert line == b"+CONTINUE " + replid.encode()
+    for wrong_replid, wrong_offset in [("0" * 40, synced + 1), (replid, offset + 2)]:
+        line, _, _ = psync(connect, port, wrong_replid, wrong_offset)
+        assert line.startswith(b"+FULLRESYNC ")
+
+    # Writes past the backlog size drop the history the first replica needs
+    for i in range(8):
+        master.call("SET", f"big{i}", "x" * 4096)
+    line, _, _ = psync(connect, port, replid, synced + 1)
+    assert line.startswith(b"+FULLRESYNC ")
+
+
+def test_stalled_replica_is_dropped_at_the_output_buffer_limit(start, connect):
+    port = start("--client-output-buffer-limit", "replica 256kb 0 0")
+    master = connect(port)
+    line, _, replica = psync(connect, port, "?", -1)
+    assert line.startswith(b"+FULLRESYNC ")
+    assert info_fields(master, "replication")["connected_slaves"] == "1"
+    # The replica never reads: once the socket buffers are full the stream
+    # piles up on the master until it passes the hard limit
+    value = "x" * 64 * 1024
+    for i in range(400):
+        master.call("SET", f"k{i}", value)
+        if info_fields(master, "replication")["connected_slaves"] == "0":
+            break
+    assert info_fields(master, "replication")["connected_slaves"] == "0"
+    # Other clients are unaffected
+    assert master.call("GET", "k0") == value.encode()
@@ -0,0 +1,110 @@
+import pytest
+
+from app.resp.RESPCodec import NULL_ARRAY, Error, ProtocolError, RESPDecoder, RESPEncoder, SimpleString
+
+encoder = RESPEncoder()
+
+# Wire bytes and what the decoder returns for them
+FRAMES = [
+    (b"*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$5\r\nvalue\r\n", [b"SET", b"k", b"value"]),
+    (b"*2\r\n$4\r\nECHO\r\n$6\r\na\r\nb\r\n\r\n", [b"ECHO", b"a\r\nb\r\n"]),
+    (b"*1\r\n$0\r\n\r\n", [b""]),
+    (b"$-1\r\n", None),
+    (b"*-1\r\n", None),
+    (b"*0\r\n", []),
+    (b"*3\r\n*2\r\n:1\r\n*0\r\n$-1\r\n*1\r\n*1\r\n$1\r\nx\r\n", [[1, []], None, [[b"x"]]]),
+    (b":-42\r\n", -42),
+    (b"PING\r\n", [b"PING"]),
+    (b"SET  k \t v\r\n", [b"SET", b"k", b"v"]),
+]
+PAYLOAD = b"".join(wire for wire, _ in FRAMES)
+EXPECTED = [value for _, value in FRAMES]
+
+
+def normalize(values):
+    """Compare SimpleString/Error by type and text"""
+    if isinstance(values, list):
+        return [normalize(value) for value in values]
+    if isinstance(values, (SimpleString, Error)):
+        return type(values).__name__, str(values)
+    return values
+
+
+def test_whole_payload_in_one_chunk():
+    assert RESPDecoder().decode_all(PAYLOAD) == EXPECTED
+
+
+@pytest.mark.parametrize("split", range(1, len(PAYLOAD)))
+def test_split_at_every_byte(split):
+    decoder = RESPDecoder()
+    assert decoder.decode_all(PAYLOAD[:split]) + decoder.decode_all(PAYLOAD[split:]) == EXPECTED
+
+
+def test_one_byte_at_a_time():
+    decoder = RESPDecoder()
+    values = []
+    for i in range(len(PAYLOAD)):
+        values += decoder.decode_all(PAYLOAD[i:i + 1])
+    assert values == EXPECTED
+    assert decoder.consumed == len(PAYLOAD)
+
+
+def test_offsets_count_each_frame():
+    decoder = RESPDecoder()
+    offsets = [offset for _, offset in decoder.decode_all_with_offsets(PAYLOAD)]
+    ends, end = [], 0
+    for wire, _ in FRAMES:
+        end += len(wire)
+        ends.append(end)
+    assert offsets == ends
+
+
+def test_inline_blank_lines_are_skipped():
+    assert RESPDecoder().decode_all(b"\r\n  \r\nPING\r\n\r\n") == [[b"PING"]]
+
+
+def test_simple_strings_and_errors():
+    values = RESPDecoder().decode_all(b"+OK\r\n-ERR bad\r\n*2\r\n+a\r\n-b\r\n")
+    assert normalize(values) == [("SimpleString", "OK"), ("Error", "ERR bad"),
+                                 [("SimpleString", "a"), ("Error", "b")]]
+
+
+def test_big_bulk_across_compactions():
+    value = bytes(range(256)) * 1024
+    wire = encoder.encode([value, value])
+    decoder = RESPDecoder()
+    values = []
+    for i in range(0, len(wire), 1000):
+        values += decoder.decode_all(wire[i:i + 1000])
+    assert values == [[value, value]]
+
+
+@pytest.mark.parametrize("wire", [b"*1\r\n!x\r\n", b"$3\r\nabcde\r\n"])
+def test_protocol_errors(wire):
+    with pytest.raises(ProtocolError):
+        RESPDecoder().decode_all(wire)
+
+
+def test_encoder_round_trip():
+    value = [b"a", 1, [b"", None, []], "text"]
+    assert RESPDecoder().decode_all(encoder.encode(value)) == [[b"a", 1, [b"", None, []], b"text"]]
+    assert encoder.encode(None) == b"$-1\r\n"
+    assert encoder.encode(NULL_ARRAY) == b"*-1\r\n"
+    assert encoder.encode(SimpleString("OK")) == b"+OK\r\n"
+    assert encoder.encode(Error("ERR x")) == b"-ERR x\r\n"
+
+
+def test_inline_commands_reach_the_server(client):
+    client.send_raw(b"SET k v\r\nGET k\r\n")
+    set_reply, get_reply = client.read(2)
+    assert str(set_reply) == "OK"
+    assert get_reply == b"v"
+
+
+def test_pending_counts_a_partly_parsed_frame():
+    decoder = RESPDecoder()
+    assert decoder.decode_all(b"*1\r\n$4\r\nPING\r\n*2\r\n$3\r\nGET\r\n") == [[b"PING"]]
+    # The header and first element are already parsed onto the stack
+    assert decoder.pending == 13
+    assert decoder.decode_all(b"$1\r\nk\r\n\r\n") == [[b"GET", b"k"]]
+    assert decoder.pending == 0
@@ -0,0 +1,113 @@
+import time
+
+import pytest
+
+from app.resp.RESPCodec import Error
+
+
+def wait_for(predicate, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+def test_xread_without_entries_is_a_null_array(client):
+    client.call("XADD", "s", "1-1", "f", "v")
+    assert client.call_raw("XREAD", "STREAMS", "s", "1-1") == b"*-1\r\n"
+    assert client.call_raw("XREAD", "BLOCK", "50", "STREAMS", "s", "$") == b"*-1\r\n"
+
+
+def entry_ids(reply) -> list:
+    return [stream_id for stream_id, _ in reply]
+
+
+@pytest.fixture
+def stream(client):
+    for stream_id in ["1-0", "1-1", "2-0", "2-5", "3-0"]:
+        client.call("XADD", "s", stream_id, "f", stream_id)
+    return client
+
+
+@pytest.mark.parametrize("first, last, expected", [
+    ("-", "+", [b"1-0", b"1-1", b"2-0", b"2-5", b"3-0"]),
+    # A bare milliseconds time covers every sequence number in it
+    ("2", "2", [b"2-0", b"2-5"]),
+    ("1", "2", [b"1-0", b"1-1", b"2-0", b"2-5"]),
+    ("1-1", "2-0", [b"1-1", b"2-0"]),
+    ("(1-1", "(2-5", [b"2-0"]),
+    ("(1", "+", [b"1-1", b"2-0", b"2-5", b"3-0"]),
+    # As in Redis, an incomplete exclusive end only drops <ms>-<max seq>
+    ("-", "(3", [b"1-0", b"1-1", b"2-0", b"2-5", b"3-0"]),
+    ("-", "(3-0", [b"1-0", b"1-1", b"2-0", b"2-5"]),
+    ("3-0", "1-0", []),
+    ("4", "+", []),
+    ("0-0", "0-0", []),
+])
+def test_xrange_bounds(stream, first, last, expected):
+    assert entry_ids(stream.call("XRANGE", "s", first, last)) == expected
+    assert entry_ids(stream.call("XREVRANGE", "s", last, first)) == expected[::-1]
+
+
+def test_xrange_count(stream):
+    assert entry_ids(stream.call("XRANGE", "s", "-", "+", "COUNT", "2")) == [b"1-0", b"1-1"]
+    assert entry_ids(stream.call("XREVRANGE", "s", "+", "-", "COUNT", "2")) == [b"3-0", b"2-5"]
+    assert stream.call("XRANGE", "s", "-", "+", "COUNT", "0") == []
+    assert stream.call("XRANGE", "s", "-", "+", "COUNT", "-1") == []
+
+
+@pytest.mark.parametrize("first, last, message", [
+    ("x", "+", "ERR Invalid stream ID specified as stream command argument"),
+    ("1-x", "+", "ERR Invalid stream ID specified as stream command argument"),
+    ("-1", "+", "ERR Invalid stream ID specified as stream command argument"),
+    ("1_000", "+", "ERR Invalid stream ID specified as stream command argument"),
+    (" 1", "+", "ERR Invalid stream ID specified as stream command argument"),
+    ("18446744073709551616", "+", "ERR Invalid stream ID specified as stream command argument"),
+    ("(-", "+", "ERR Invalid stream ID specified as stream command argument"),
+    ("(18446744073709551615-18446744073709551615", "+", "ERR invalid start ID for the interval"),
+    ("-", "(0-0", "ERR invalid end ID for the interval"),
+])
+def test_xrange_rejects_bad_ids(stream, first, last, message):
+    reply = stream.call("XRANGE", "s", first, last)
+    assert isinstance(reply, Error) and str(reply) == message
+
+
+def test_xadd_ids(client):
+    assert client.call("XADD", "s", "5", "f", "v") == b"5-0"
+    assert client.call("XADD", "s", "5-*", "f", "v") == b"5-1"
+    assert client.call("XADD", "s", "7-*", "f", "v") == b"7-0"
+    for stream_id in ["7-0", "6-9", "6-*", "5"]:
+        reply = client.call("XADD", "s", stream_id, "f", "v")
+        assert isinstance(reply, Error) and "equal or smaller" in str(reply), stream_id
+    reply = client.call("XADD", "other", "0-0", "f", "v")
+    assert isinstance(reply, Error) and "greater than 0-0" in str(reply)
+    assert client.call("EXISTS", "other") == 0
+    ms, seq = map(int, client.call("XADD", "s", "*", "f", "v").split(b"-"))
+    assert ms > 7 and seq == 0
+
+    top = "18446744073709551615"
+    assert client.call("XADD", "full", f"{top}-{top}", "f", "v") == f"{top}-{top}".encode()
+    reply = client.call("XADD", "full", "*", "f", "v")
+    assert isinstance(reply, Error) and "exhausted" in str(reply)
+    reply = client.call("XADD", "full", f"{top}-*", "f", "v")
+    assert isinstance(reply, Error) and "equal or smaller" in str(reply)
+
+
+def test_xread_after_incomplete_and_full_ids(stream):
+    reply = stream.call("XREAD", "STREAMS", "s", "2")
+    assert entry_ids(reply[0][1]) == [b"2-5", b"3-0"]
+    reply = stream.call("XREAD", "COUNT", "1", "STREAMS", "s", "1-0")
+    assert entry_ids(reply[0][1]) == [b"1-1"]
+    reply = stream.call("XREAD", "STREAMS", "s", "missing", "0", "0")
+    assert [key for key, _ in reply] == [b"s"]
+
+
+def test_xread_dollar_only_sees_new_entries(start, connect):
+    port = start()
+    reader, writer = connect(port), connect(port)
+    writer.call("XADD", "s", "1-0", "f", "old")
+    reader.send(["XREAD", "BLOCK", "0", "STREAMS", "s", "fresh", "$", "$"])
+    wait_for(lambda: writer.call("INFO", "clients").find(b"blocked_clients:1") != -1)
+    writer.call("XADD", "fresh", "1-0", "f", "new")
+    [reply] = reader.read()
+    assert reply == [[b"fresh", [[b"1-0", [b"f", b"new"]]]]]
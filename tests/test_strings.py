@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+from app.resp.RESPCodec import Error, SimpleString
+
+def ok(reply) -> bool:
+    return isinstance(reply, SimpleString) and str(reply) == "OK"
+
+
+def error_text(reply) -> str:
+    assert isinstance(reply, Error), reply
+    return str(reply)
+
+
+def test_set_expiry_options(client):
+    now = time.time()
+    assert ok(client.call("SET", "ex", "v", "EX", 100))
+    assert ok(client.call("SET", "px", "v", "PX", 200))
+    assert ok(client.call("SET", "exat", "v", "EXAT", int(now) - 1))
+    assert ok(client.call("SET", "pxat", "v", "PXAT", int(now * 1000) + 200))
+    # KEEPTTL keeps the TTL a plain SET would drop
+    assert ok(client.call("SET", "keep", "v", "PX", 200))
+    assert ok(client.call("SET", "keep", "w", "KEEPTTL"))
+    assert ok(client.call("SET", "drop", "v", "PX", 200))
+    assert ok(client.call("SET", "drop", "w"))
+    assert client.call("MGET", "ex", "px", "exat", "pxat", "keep", "drop") == [b"v", b"v", None, b"v", b"w", b"w"]
+    time.sleep(0.3)
+    assert client.call("MGET", "ex", "px", "exat", "pxat", "keep", "drop") == [b"v", None, None, None, None, b"w"]
+
+
+def test_set_nx_xx_get(client):
+    assert client.call("SET", "k", "1", "XX") is None
+    assert client.call("EXISTS", "k") == 0
+    assert ok(client.call("SET", "k", "1", "NX"))
+    assert client.call("SET", "k", "2", "NX") is None
+    assert client.call("GET", "k") == b"1"
+    assert client.call("SET", "k", "2", "XX", "GET") == b"1"
+    assert client.call("SET", "k", "3", "NX", "GET") == b"2"
+    assert client.call("GET", "k") == b"2"
+    assert client.call("SET", "new", "1", "GET") is None
+    assert ok(client.call("MSET", "a", "1", "b", "2"))
+    client.call("RPUSH", "list", "a")
+    assert error_text(client.call("SET", "list", "1", "GET")).startswith("WRONGTYPE")
+    assert client.call("LLEN", "list") == 1
+
+
+@pytest.mark.parametrize("options", [
+    ["EX"],
+    ["EX", "10", "PX", "100"],
+    ["EX", "10", "KEEPTTL"],
+    ["NX", "XX"],
+    ["BOGUS"],
+    ["10", "EX"],
+])
+def test_set_rejects_bad_options(client, options):
+    assert error_text(client.call("SET", "k", "v", *options)) == "ERR syntax error"
+    assert client.call("EXISTS", "k") == 0
+
+
+@pytest.mark.parametrize("options, message", [
+    (["EX", "abc"], "ERR value is not an integer or out of range"),
+    (["PX", "1.5"], "ERR value is not an integer or out of range"),
+    (["EX", "0"], "ERR invalid expire time in 'set' command"),
+    (["PX", "-5"], "ERR invalid expire time in 'set' command"),
+    (["EX", str(2 ** 62)], "ERR invalid expire time in 'set' command"),
+])
+def test_set_rejects_bad_expiry(client, options, message):
+    assert error_text(client.call("SET", "k", "v", *options)) == message
+    assert client.call("EXISTS", "k") == 0
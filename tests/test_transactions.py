@@ -0,0 +1,9 @@
+def test_exec_after_watched_key_changed_is_a_null_array(start, connect):
+    port = start()
+    client, other = connect(port), connect(port)
+    client.call("WATCH", "k")
+    client.call("MULTI")
+    client.call("SET", "k", "1")
+    other.call("SET", "k", "2")
+    assert client.call_raw("EXEC") == b"*-1\r\n"
+    assert client.call("GET", "k") == b"2"